@@ -1,104 +1,272 @@
 # app/backend/notifications.py
 """
 Système de notifications en temps réel avec WebSocket
+Monté par server.py sous /api ; la base et l'authentification sont injectées par
+set_database() (server.py importe ce module : pas d'import de server ici).
+Les notifications gardent le schéma de server.py (user_id destinataire, from_user_id) ;
+create_notification() les enregistre puis les diffuse aux sockets de tous les workers.
 """
 
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, Header, HTTPException
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from datetime import datetime, timezone
-from typing import Dict, Set
-import json
-from .server import get_current_user, db
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+import asyncio
+import os
+import time
 import uuid
 
+try:
+    import backend.notification_broker as notification_broker
+except ImportError:
+    import notification_broker
+
 notification_router = APIRouter(prefix="/notifications", tags=["notifications"])
 
+# File d'envoi par connexion : au-delà, les plus anciens messages sont abandonnés
+WS_SEND_QUEUE_SIZE = int(os.environ.get("WS_SEND_QUEUE_SIZE", 100))
+
+# Messages abandonnés d'affilée avant de fermer une connexion trop lente
+WS_MAX_DROPPED = int(os.environ.get("WS_MAX_DROPPED", 50))
+
+# Délai maximum d'un envoi
+WS_SEND_TIMEOUT_SECONDS = float(os.environ.get("WS_SEND_TIMEOUT_SECONDS", 10))
+
+# Ping applicatif ; une connexion muette depuis WS_HEARTBEAT_TIMEOUT_SECONDS est fermée
+WS_HEARTBEAT_SECONDS = float(os.environ.get("WS_HEARTBEAT_SECONDS", 25))
+WS_HEARTBEAT_TIMEOUT_SECONDS = float(os.environ.get("WS_HEARTBEAT_TIMEOUT_SECONDS", 60))
+
+# Code de fermeture « réessayer plus tard » (client trop lent ou muet)
+WS_CLOSE_TRY_AGAIN = 1013
+
+# Code de fermeture à l'arrêt du serveur
+WS_CLOSE_GOING_AWAY = 1001
+
+# Code de fermeture d'une socket non authentifiée
+WS_CLOSE_POLICY_VIOLATION = 1008
+
+PING_MESSAGE = {"type": "ping"}
+
+security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
+
+db = None
+_current_user: Optional[Callable[[HTTPAuthorizationCredentials], Awaitable[dict]]] = None
+_metrics_access: Optional[Callable[[Optional[str], Optional[HTTPAuthorizationCredentials]], Awaitable[None]]] = None
+
+
+class Connection:
+    """Une socket et sa file d'envoi bornée, vidée par sa propre tâche"""
+
+    def __init__(self, websocket: WebSocket, user_id: str, manager: "ConnectionManager"):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.manager = manager
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=WS_SEND_QUEUE_SIZE)
+        self.last_seen = time.monotonic()
+        self.dropped_in_a_row = 0
+        self.closed = False
+        self.task = asyncio.create_task(self._send_loop())
+
+    def enqueue(self, message: dict):
+        """Jamais bloquant : file pleine → le plus ancien message est abandonné"""
+        if self.closed or self.dropped_in_a_row > WS_MAX_DROPPED:
+            return
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.manager.stats["dropped"] += 1
+            self.dropped_in_a_row += 1
+            if self.dropped_in_a_row > WS_MAX_DROPPED:
+                self.manager.stats["closed_slow"] += 1
+                self.manager.spawn(self.close(WS_CLOSE_TRY_AGAIN))
+                return
+        self.queue.put_nowait(message)
+
+    async def _send_loop(self):
+        try:
+            # closed est relu à chaque tour : une annulation arrivée pendant un envoi déjà
+            # terminé peut être absorbée par wait_for (Python < 3.12)
+            while not self.closed:
+                message = await self.queue.get()
+                await asyncio.wait_for(self.websocket.send_json(message), WS_SEND_TIMEOUT_SECONDS)
+                self.dropped_in_a_row = 0
+                self.manager.stats["sent"] += 1
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            # Envoi échoué ou trop lent : la connexion est abandonnée
+            await self.close(WS_CLOSE_TRY_AGAIN)
+
+    async def close(self, code: int = 1000):
+        if self.closed:
+            return
+        self.closed = True
+        self.manager.disconnect(self.websocket, self.user_id)
+        if self.task is not asyncio.current_task():
+            self.task.cancel()
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+
 # Gestionnaire de connexions WebSocket
+# Les sockets de ce worker seulement ; les notifications passent par le broker
+# (notification_broker.py), auquel le worker s'abonne une fois, au premier client connecté
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, Set[WebSocket]] = {}
+    def __init__(self, broker: notification_broker.NotificationBroker):
+        self.active_connections: Dict[str, Dict[WebSocket, Connection]] = {}
+        self.broker = broker
+        self.subscribed = False
+        self.heartbeat: Optional[asyncio.Task] = None
+        # Fermetures lancées hors d'une coroutine (référence gardée jusqu'à la fin de la tâche)
+        self.tasks: Set[asyncio.Task] = set()
+        self.stats = {"sent": 0, "dropped": 0, "closed_slow": 0, "reaped": 0}
 
     async def connect(self, websocket: WebSocket, user_id: str):
         await websocket.accept()
+        if not self.subscribed:
+            self.broker.subscribe(self.deliver)
+            self.subscribed = True
+        if self.heartbeat is None:
+            self.heartbeat = asyncio.create_task(self._heartbeat())
         if user_id not in self.active_connections:
-            self.active_connections[user_id] = set()
-        self.active_connections[user_id].add(websocket)
+            self.active_connections[user_id] = {}
+        self.active_connections[user_id][websocket] = Connection(websocket, user_id, self)
 
     def disconnect(self, websocket: WebSocket, user_id: str):
         if user_id in self.active_connections:
-            self.active_connections[user_id].discard(websocket)
+            connection = self.active_connections[user_id].pop(websocket, None)
+            if connection is not None and not connection.closed:
+                connection.closed = True
+                connection.task.cancel()
             if not self.active_connections[user_id]:
                 del self.active_connections[user_id]
 
-    async def send_notification(self, user_id: str, notification: dict):
-        """Envoyer une notification à un utilisateur spécifique"""
-        if user_id in self.active_connections:
-            dead_connections = set()
-            for connection in self.active_connections[user_id]:
-                try:
-                    await connection.send_json(notification)
-                except:
-                    dead_connections.add(connection)
-            
-            # Nettoyer les connexions mortes
-            for dead in dead_connections:
-                self.disconnect(dead, user_id)
+    def spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
 
-manager = ConnectionManager()
+    async def close(self):
+        """Arrêt du worker : heartbeat annulé, sockets fermées, désabonnement du broker"""
+        if self.heartbeat is not None:
+            self.heartbeat.cancel()
+            try:
+                await self.heartbeat
+            except asyncio.CancelledError:
+                pass
+            self.heartbeat = None
+        for connections in list(self.active_connections.values()):
+            for connection in list(connections.values()):
+                await connection.close(WS_CLOSE_GOING_AWAY)
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+        await self.broker.close()
+        self.subscribed = False
 
+    def touch(self, websocket: WebSocket, user_id: str):
+        """Message reçu du client (pong ou autre) : la connexion est vivante"""
+        connection = self.active_connections.get(user_id, {}).get(websocket)
+        if connection is not None:
+            connection.last_seen = time.monotonic()
 
-@notification_router.websocket("/ws/{user_id}")
-async def websocket_endpoint(websocket: WebSocket, user_id: str):
-    """Endpoint WebSocket pour les notifications en temps réel"""
-    await manager.connect(websocket, user_id)
-    try:
+    async def send_notification(self, user_id: str, notification: dict):
+        """Envoyer une notification à un utilisateur spécifique (quel que soit le worker de sa socket)"""
+        message = {k: v for k, v in notification.items() if k != "_id"}
+        await self.broker.publish(user_id, message)
+
+    async def deliver(self, user_id: str, notification: dict):
+        """Appelé par le broker : dépose la notification dans les files des sockets locales (sans attendre l'envoi)"""
+        for connection in list(self.active_connections.get(user_id, {}).values()):
+            connection.enqueue(notification)
+
+    async def _heartbeat(self):
+        """Ping périodique de toutes les sockets ; les connexions muettes sont fermées"""
         while True:
-            # Garder la connexion ouverte
-            data = await websocket.receive_text()
-            # Optionnel: traiter les messages du client
-    except WebSocketDisconnect:
-        manager.disconnect(websocket, user_id)
+            await asyncio.sleep(WS_HEARTBEAT_SECONDS)
+            now = time.monotonic()
+            for connections in list(self.active_connections.values()):
+                for connection in list(connections.values()):
+                    if now - connection.last_seen > WS_HEARTBEAT_TIMEOUT_SECONDS:
+                        self.stats["reaped"] += 1
+                        await connection.close(WS_CLOSE_TRY_AGAIN)
+                    else:
+                        connection.enqueue(PING_MESSAGE)
+
+    def snapshot(self) -> dict:
+        data = dict(self.stats)
+        depths = [
+            connection.queue.qsize()
+            for connections in self.active_connections.values()
+            for connection in connections.values()
+        ]
+        data["connections"] = len(depths)
+        data["queued"] = sum(depths)
+        data["max_queue_depth"] = max(depths, default=0)
+        data["broker"] = self.broker.snapshot()
+        return data
 
+manager: Optional[ConnectionManager] = None
 
-@notification_router.get("/")
-async def get_notifications(
-    limit: int = 20,
-    current_user: dict = Depends(get_current_user)
+
+def set_database(
+    database,
+    current_user: Callable[[HTTPAuthorizationCredentials], Awaitable[dict]],
+    metrics_access: Callable[[Optional[str], Optional[HTTPAuthorizationCredentials]], Awaitable[None]]
 ):
-    """Récupérer les notifications de l'utilisateur"""
-    try:
-        notifications = await db.notifications.find(
-            {"recipient_id": current_user["id"]}
-        ).sort("created_at", -1).limit(limit).to_list(length=limit)
-        
-        # Convertir ObjectId en string
-        for notif in notifications:
-            notif["_id"] = str(notif["_id"])
-        
-        return notifications
-    except Exception as e:
-        return []
+    """Injecte la DB et les dépendances d'authentification depuis server.py"""
+    global db, _current_user, _metrics_access, manager
+    db = database
+    _current_user = current_user
+    _metrics_access = metrics_access
+    manager = ConnectionManager(notification_broker.create_broker(database))
 
 
-@notification_router.put("/{notification_id}/read")
-async def mark_notification_read(
-    notification_id: str,
-    current_user: dict = Depends(get_current_user)
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """Utilisateur courant (dépendance de server.py)"""
+    return await _current_user(credentials)
+
+
+async def require_metrics_access(
+    x_metrics_token: Optional[str] = Header(None),
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
 ):
-    """Marquer une notification comme lue"""
+    """Accès aux métriques internes (dépendance de server.py)"""
+    await _metrics_access(x_metrics_token, credentials)
+
+
+async def authenticate_socket(token: Optional[str], user_id: str) -> bool:
+    """Le JWT (même contrôle que get_current_user) doit désigner l'utilisateur du chemin"""
+    if not token:
+        return False
     try:
-        result = await db.notifications.update_one(
-            {
-                "id": notification_id,
-                "recipient_id": current_user["id"]
-            },
-            {"$set": {"read": True}}
-        )
-        
-        if result.modified_count > 0:
-            return {"success": True}
-        return {"success": False, "error": "Notification not found"}
-    except Exception as e:
-        return {"success": False, "error": str(e)}
+        user = await _current_user(HTTPAuthorizationCredentials(scheme="Bearer", credentials=token))
+    except HTTPException:
+        return False
+    return user.get("id") == user_id
+
+
+@notification_router.websocket("/ws/{user_id}")
+async def websocket_endpoint(websocket: WebSocket, user_id: str, token: Optional[str] = None):
+    """Endpoint WebSocket pour les notifications en temps réel (?token=<JWT>)"""
+    if not await authenticate_socket(token, user_id):
+        await websocket.close(code=WS_CLOSE_POLICY_VIOLATION)
+        return
+    await manager.connect(websocket, user_id)
+    try:
+        while True:
+            # Garder la connexion ouverte ; tout message (dont "pong") prouve qu'elle est vivante
+            await websocket.receive_text()
+            manager.touch(websocket, user_id)
+    except (WebSocketDisconnect, RuntimeError):
+        manager.disconnect(websocket, user_id)
+
+
+@notification_router.get("/metrics", dependencies=[Depends(require_metrics_access)])
+async def get_realtime_metrics():
+    """Connexions WebSocket de ce worker : profondeur des files, messages abandonnés, connexions fermées"""
+    return manager.snapshot()
 
 
 @notification_router.put("/read-all")
@@ -106,7 +274,7 @@ async def mark_all_notifications_read(current_user: dict = Depends(get_current_u
     """Marquer toutes les notifications comme lues"""
     try:
         result = await db.notifications.update_many(
-            {"recipient_id": current_user["id"], "read": False},
+            {"user_id": current_user["id"], "read": False},
             {"$set": {"read": True}}
         )
         
@@ -120,7 +288,7 @@ async def get_unread_count(current_user: dict = Depends(get_current_user)):
     """Compter les notifications non lues"""
     try:
         count = await db.notifications.count_documents({
-            "recipient_id": current_user["id"],
+            "user_id": current_user["id"],
             "read": False
         })
         return {"count": count}
@@ -130,22 +298,23 @@ async def get_unread_count(current_user: dict = Depends(get_current_user)):
 
 # Fonctions utilitaires pour créer des notifications
 async def create_notification(
-    recipient_id: str,
-    sender_id: str,
+    user_id: str,
+    from_user_id: str,
     notification_type: str,
     content: str,
     link: str = None,
-    metadata: dict = None
+    **fields
 ):
-    """Créer et envoyer une notification"""
+    """Enregistre une notification pour `user_id` et l'envoie en temps réel.
+    `fields` : champs propres au type (post_id, comment_content…)"""
     notification = {
         "id": str(uuid.uuid4()),
-        "recipient_id": recipient_id,
-        "sender_id": sender_id,
+        "user_id": user_id,
         "type": notification_type,  # 'like', 'comment', 'follow', 'story'
+        "from_user_id": from_user_id,
+        **fields,
         "content": content,
         "link": link,
-        "metadata": metadata or {},
         "read": False,
         "created_at": datetime.now(timezone.utc).isoformat()
     }
@@ -154,58 +323,57 @@ async def create_notification(
     await db.notifications.insert_one(notification)
     
     # Envoyer en temps réel via WebSocket
-    await manager.send_notification(recipient_id, notification)
+    await manager.send_notification(user_id, notification)
     
     return notification
 
 
-# Exemples d'utilisation dans les autres endpoints
+async def create_notifications(notifications: List[dict]):
+    """Lot de notifications déjà construites (même schéma) : un seul insert_many,
+    puis envoi en temps réel de chacune"""
+    if not notifications:
+        return
+    await db.notifications.insert_many(notifications)
+    for notification in notifications:
+        await manager.send_notification(notification["user_id"], notification)
+
 
 async def notify_like(post_author_id: str, liker_id: str, liker_username: str, post_id: str):
     """Notifier l'auteur du post qu'il a reçu un like"""
     if post_author_id != liker_id:  # Ne pas notifier soi-même
         await create_notification(
-            recipient_id=post_author_id,
-            sender_id=liker_id,
-            notification_type="like",
+            post_author_id, liker_id, "like",
             content=f"{liker_username} a aimé votre publication",
             link=f"/posts/{post_id}",
-            metadata={"post_id": post_id}
+            post_id=post_id
         )
 
 
-async def notify_comment(post_author_id: str, commenter_id: str, commenter_username: str, post_id: str):
+async def notify_comment(post_author_id: str, commenter_id: str, commenter_username: str, post_id: str, comment: str):
     """Notifier l'auteur du post d'un nouveau commentaire"""
     if post_author_id != commenter_id:
         await create_notification(
-            recipient_id=post_author_id,
-            sender_id=commenter_id,
-            notification_type="comment",
+            post_author_id, commenter_id, "comment",
             content=f"{commenter_username} a commenté votre publication",
             link=f"/posts/{post_id}",
-            metadata={"post_id": post_id}
+            post_id=post_id,
+            comment_content=comment
         )
 
 
 async def notify_follow(followed_id: str, follower_id: str, follower_username: str):
     """Notifier qu'un utilisateur a commencé à suivre"""
     await create_notification(
-        recipient_id=followed_id,
-        sender_id=follower_id,
-        notification_type="follow",
+        followed_id, follower_id, "follow",
         content=f"{follower_username} a commencé à vous suivre",
-        link=f"/profile/{follower_id}",
-        metadata={"user_id": follower_id}
+        link=f"/profile/{follower_id}"
     )
 
 
 async def notify_story(follower_id: str, author_id: str, author_username: str):
     """Notifier les abonnés d'une nouvelle story"""
     await create_notification(
-        recipient_id=follower_id,
-        sender_id=author_id,
-        notification_type="story",
+        follower_id, author_id, "story",
         content=f"{author_username} a publié une nouvelle story",
-        link=f"/stories/{author_id}",
-        metadata={"author_id": author_id}
+        link=f"/stories/{author_id}"
     )
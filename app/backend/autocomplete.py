@@ -0,0 +1,150 @@
+"""
+autocomplete.py - Autocomplétion des usernames (index trié en mémoire, par worker)
+Les usernames normalisés (search.py) sont gardés dans un tableau trié :
+un préfixe = une recherche dichotomique puis au plus `limit` entrées lues, sans requête MongoDB.
+Mis à jour à l'inscription, au changement de username et à la suppression du compte ;
+rechargé en tâche de fond toutes les AUTOCOMPLETE_REFRESH_SECONDS (écritures des autres workers).
+"""
+
+from bisect import bisect_left, insort
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import os
+import sys
+import time
+
+try:
+    import backend.search as search_engine
+except ImportError:
+    import search as search_engine
+
+# Intervalle de rechargement complet (les autres workers convergent dans ce délai)
+AUTOCOMPLETE_REFRESH_SECONDS = float(os.environ.get("AUTOCOMPLETE_REFRESH_SECONDS", 300))
+
+DEFAULT_SUGGESTIONS = 8
+MAX_SUGGESTIONS = 20
+
+
+def username_key(username: Optional[str]) -> str:
+    """'Éloïse_M' → 'eloisem' (même normalisation que la recherche)"""
+    terms = search_engine.username_terms(username)
+    return terms[0] if terms else ""
+
+
+class UsernameIndex:
+    """Tableau trié de (username normalisé, user_id)"""
+
+    def __init__(self):
+        self.entries: List[Tuple[str, str]] = []
+        self.keys: Dict[str, str] = {}  # user_id → clé présente dans entries
+        self.loaded_at: Optional[float] = None
+        self.loading: Optional[asyncio.Task] = None
+        self.changes: List[Tuple[str, Optional[str]]] = []  # (user_id, username | None) reçus pendant un chargement
+        self.stats = {"lookups": 0, "loads": 0}
+
+    # ==================== CHARGEMENT ====================
+
+    async def load(self, db):
+        """Recharge tout l'index depuis `users` (un seul parcours, tri en mémoire)"""
+        entries = []
+        keys = {}
+        self.changes = []
+        async for user in db.users.find({}, {"id": 1, "username": 1, "_id": 0}):
+            key = username_key(user.get("username"))
+            if key and user.get("id"):
+                user_id = sys.intern(user["id"])
+                entries.append((key, user_id))
+                keys[user_id] = key
+        entries.sort()
+        self.entries, self.keys = entries, keys
+        # Le parcours a pu manquer les changements faits pendant le chargement
+        changes, self.changes = self.changes, []
+        for user_id, username in changes:
+            self._apply(user_id, username)
+        self.changes = []
+        self.loaded_at = time.monotonic()
+        self.stats["loads"] += 1
+
+    async def _reload(self, db):
+        try:
+            await self.load(db)
+        except Exception as e:
+            print(f"⚠️ Username index reload failed: {e}")
+        finally:
+            self.loading = None
+
+    def start(self, db):
+        """Au démarrage : chargement en tâche de fond (les premières requêtes l'attendent)"""
+        if self.loaded_at is None and self.loading is None:
+            self.loading = asyncio.create_task(self._reload(db))
+
+    async def ensure_loaded(self, db):
+        """Premier appel : chargement bloquant ; ensuite rechargement en tâche de fond si périmé"""
+        if self.loaded_at is None:
+            if self.loading is None:
+                self.loading = asyncio.create_task(self._reload(db))
+            await asyncio.shield(self.loading)
+        elif time.monotonic() - self.loaded_at > AUTOCOMPLETE_REFRESH_SECONDS and self.loading is None:
+            self.loading = asyncio.create_task(self._reload(db))
+
+    # ==================== MISES À JOUR INCRÉMENTALES ====================
+
+    def add(self, user_id: str, username: Optional[str]):
+        """À appeler après l'inscription ou un changement de username"""
+        self._apply(user_id, username)
+
+    def remove(self, user_id: str):
+        """À appeler après la suppression d'un compte"""
+        self._apply(user_id, None)
+
+    def _apply(self, user_id: str, username: Optional[str]):
+        if self.loading is not None:
+            self.changes.append((user_id, username))
+        self._discard(user_id)
+        if username is None:
+            return
+        key = username_key(username)
+        if key:
+            user_id = sys.intern(user_id)
+            insort(self.entries, (key, user_id))
+            self.keys[user_id] = key
+
+    def _discard(self, user_id: str):
+        key = self.keys.pop(user_id, None)
+        if key is None:
+            return
+        i = bisect_left(self.entries, (key, user_id))
+        if i < len(self.entries) and self.entries[i] == (key, user_id):
+            del self.entries[i]
+
+    # ==================== LECTURE ====================
+
+    def lookup(self, prefix: str, limit: int = DEFAULT_SUGGESTIONS) -> List[str]:
+        """Ids des usernames commençant par `prefix` (ordre alphabétique, le plus court d'abord)"""
+        key = username_key(prefix)
+        if not key:
+            return []
+        self.stats["lookups"] += 1
+        start = bisect_left(self.entries, (key,))
+        end = min(start + limit, len(self.entries))
+        ids = []
+        for i in range(start, end):
+            entry_key, user_id = self.entries[i]
+            if not entry_key.startswith(key):
+                break
+            ids.append(user_id)
+        return ids
+
+    def snapshot(self) -> dict:
+        data = dict(self.stats)
+        data["usernames"] = len(self.entries)
+        return data
+
+
+index = UsernameIndex()
+
+
+def clamp_suggestions(limit: Optional[int]) -> int:
+    if not limit or limit < 1:
+        return DEFAULT_SUGGESTIONS
+    return min(limit, MAX_SUGGESTIONS)
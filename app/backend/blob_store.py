@@ -0,0 +1,389 @@
+"""
+blob_store.py - Stockage des médias adressé par contenu (hors MongoDB)
+- Clé = sha256 du contenu + extension : deux uploads identiques partagent un fichier
+- Les documents ne gardent qu'une référence relative (/api/media/<clé>) ; l'URL absolue
+  est résolue à la sérialisation des réponses (MEDIA_BASE_URL ou hôte public de la requête)
+- GET /api/media/<clé> : diffusion en flux avec ETag, Cache-Control et Range
+- release() : après suppression de documents, efface les blobs que plus rien ne référence
+"""
+
+from abc import ABC, abstractmethod
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from pathlib import Path
+from starlette.concurrency import run_in_threadpool
+from contextvars import ContextVar
+from pydantic import PlainSerializer
+from typing import Annotated, Iterable, Iterator, List, Optional, Tuple
+import base64
+import binascii
+import hashlib
+import os
+import re
+import shutil
+import uuid
+
+# Répertoire du backend local
+MEDIA_ROOT = Path(os.environ.get("MEDIA_ROOT", Path(__file__).parent / "media"))
+
+# Préfixe public des URLs de médias (ex. https://api.example.com) ; sinon l'hôte public de la requête
+# (X-Forwarded-Proto / X-Forwarded-Host derrière un proxy)
+MEDIA_BASE_URL = os.environ.get("MEDIA_BASE_URL", "").rstrip("/")
+
+# Taille des blocs lus pendant la diffusion
+MEDIA_CHUNK_SIZE = 64 * 1024
+
+MEDIA_ROUTE = "/api/media"
+
+# Types acceptés ↔ extension de la clé
+EXTENSIONS = {
+    "image/jpeg": "jpg",
+    "image/png": "png",
+    "image/gif": "gif",
+    "image/webp": "webp",
+    "video/mp4": "mp4",
+    "video/webm": "webm",
+    "video/quicktime": "mov",
+}
+CONTENT_TYPES = {ext: content_type for content_type, ext in EXTENSIONS.items()}
+CONTENT_TYPES["bin"] = "application/octet-stream"
+
+KEY_PATTERN = re.compile(r"^([0-9a-f]{64})\.([a-z0-9]{1,5})$")
+DATA_URI_PATTERN = re.compile(r"^data:([\w.+-]+/[\w.+-]+)?(?:;[\w=.+-]+)*;base64,", re.IGNORECASE)
+
+
+class BlobStore(ABC):
+    """Interface d'un backend de blobs (identifiés par leur sha256)"""
+
+    @abstractmethod
+    def put(self, digest: str, data: bytes):
+        """Stocke un contenu (sans effet s'il est déjà stocké)"""
+
+    @abstractmethod
+    def put_file(self, digest: str, path: Path):
+        """Stocke un fichier déjà écrit sur disque (le fichier source est consommé)"""
+
+    @abstractmethod
+    def size(self, digest: str) -> Optional[int]:
+        """Taille du blob, None s'il n'existe pas"""
+
+    @abstractmethod
+    def iter_range(self, digest: str, start: int, end: int) -> Iterator[bytes]:
+        """Octets [start, end] (inclus) du blob, par blocs"""
+
+    @abstractmethod
+    def delete(self, digest: str):
+        """Efface le blob (sans erreur s'il n'existe pas)"""
+
+    def local_path(self, digest: str) -> Optional[Path]:
+        """Chemin local du blob s'il est lisible directement sur disque"""
+        return None
+
+
+class LocalBlobStore(BlobStore):
+    """Blobs sur le système de fichiers local : <racine>/ab/abcdef…"""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+
+    def _path(self, digest: str) -> Path:
+        return self.root / digest[:2] / digest
+
+    def put(self, digest: str, data: bytes):
+        path = self._path(digest)
+        if path.exists():
+            return  # déjà stocké (déduplication)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{digest}.{uuid.uuid4().hex}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)  # atomique : jamais de blob partiellement écrit
+
+    def put_file(self, digest: str, path: Path):
+        target = self._path(digest)
+        if target.exists():
+            os.unlink(path)  # déjà stocké (déduplication)
+            return
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp = target.with_name(f".{digest}.{uuid.uuid4().hex}.tmp")
+        shutil.move(str(path), tmp)  # simple renommage sur le même disque
+        os.replace(tmp, target)
+
+    def size(self, digest: str) -> Optional[int]:
+        try:
+            return self._path(digest).stat().st_size
+        except FileNotFoundError:
+            return None
+
+    def iter_range(self, digest: str, start: int, end: int) -> Iterator[bytes]:
+        with open(self._path(digest), "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(MEDIA_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    def delete(self, digest: str):
+        try:
+            self._path(digest).unlink()
+        except FileNotFoundError:
+            pass
+
+    def local_path(self, digest: str) -> Optional[Path]:
+        path = self._path(digest)
+        return path if path.exists() else None
+
+
+store: BlobStore = LocalBlobStore(MEDIA_ROOT)
+
+
+def set_blob_store(backend: BlobStore):
+    """Branche un autre backend (ex. stockage objet) à la place du disque local"""
+    global store
+    store = backend
+
+
+# ==================== RÉFÉRENCES ====================
+
+def make_key(digest: str, content_type: Optional[str]) -> str:
+    return f"{digest}.{EXTENSIONS.get((content_type or '').lower(), 'bin')}"
+
+
+def media_url(key: str) -> str:
+    """Référence stockée dans les documents (relative, indépendante de l'hôte)"""
+    return f"{MEDIA_ROUTE}/{key}"
+
+
+def key_from_url(url: Optional[str]) -> Optional[str]:
+    """Clé d'une référence au blob store (relative ou ancienne URL absolue), None sinon"""
+    if not isinstance(url, str) or f"{MEDIA_ROUTE}/" not in url:
+        return None
+    key = url.rsplit("/", 1)[-1]
+    return key if KEY_PATTERN.match(key) else None
+
+
+def digest_from_url(url: Optional[str]) -> Optional[str]:
+    """sha256 d'une URL de média du blob store, None pour une URL externe"""
+    key = key_from_url(url)
+    return KEY_PATTERN.match(key).group(1) if key else None
+
+
+# Hôte public de la requête en cours (posé par MediaBaseURLMiddleware)
+_request_base_url: ContextVar[str] = ContextVar("media_request_base_url", default="")
+
+
+def public_base_url(scope) -> str:
+    """scheme://host vu par le client : en-têtes du proxy d'abord, sinon ceux de la requête"""
+    headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope.get("headers", [])}
+    scheme = headers.get("x-forwarded-proto", "").split(",")[0].strip() or scope.get("scheme", "http")
+    host = headers.get("x-forwarded-host", "").split(",")[0].strip() or headers.get("host", "")
+    return f"{scheme}://{host}" if host else ""
+
+
+class MediaBaseURLMiddleware:
+    """Retient l'hôte public de chaque requête HTTP pour résoudre les URLs de médias"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        token = _request_base_url.set(public_base_url(scope))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _request_base_url.reset(token)
+
+
+def resolve_url(value: Optional[str]) -> Optional[str]:
+    """Référence stockée → URL publique (les URLs externes sont rendues telles quelles)"""
+    key = key_from_url(value)
+    if key is None:
+        return value
+    base = MEDIA_BASE_URL or _request_base_url.get()
+    return f"{base}{MEDIA_ROUTE}/{key}"
+
+
+# Champ de modèle de réponse : référence stockée, URL publique dans le JSON renvoyé
+# (model_dump() garde la référence : les pages mises en cache ne dépendent pas de l'hôte)
+MediaURL = Annotated[Optional[str], PlainSerializer(resolve_url, when_used="json")]
+
+
+async def save_bytes(data: bytes, content_type: Optional[str]) -> str:
+    """Stocke un contenu et retourne sa référence"""
+    digest = hashlib.sha256(data).hexdigest()
+    await run_in_threadpool(store.put, digest, data)
+    return media_url(make_key(digest, content_type))
+
+
+def is_data_uri(value) -> bool:
+    return isinstance(value, str) and value[:5].lower() == "data:"
+
+
+def parse_data_uri(value: str) -> Tuple[Optional[str], bytes]:
+    """data:<type>;base64,<contenu> → (type, octets)"""
+    match = DATA_URI_PATTERN.match(value)
+    if not match:
+        raise ValueError("Unsupported data URI")
+    try:
+        data = base64.b64decode(value[match.end():], validate=False)
+    except (binascii.Error, ValueError):
+        raise ValueError("Invalid base64 payload")
+    return match.group(1), data
+
+
+async def externalize(value: Optional[str]) -> Optional[str]:
+    """Remplace un data URI par une référence au blob store (autres valeurs inchangées)"""
+    if not is_data_uri(value):
+        return value
+    try:
+        content_type, data = parse_data_uri(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid media data")
+    return await save_bytes(data, content_type)
+
+
+# ==================== LIBÉRATION ====================
+
+# Champs qui référencent un blob, par collection (tailles d'avatar : derivatives.AVATAR_SIZES).
+# Les références sont comparées sous leur forme relative : les anciennes URLs absolues
+# doivent avoir été ramenées à cette forme par migrate_media.py.
+REFERENCE_FIELDS = {
+    "posts": ["media_url"],
+    "stories": ["media_url", "thumbnail_url"],
+    "users": ["profile_pic", "profile_pic_sizes.96", "profile_pic_sizes.320"],
+}
+
+# Blobs examinés par requête de vérification
+RELEASE_BATCH_SIZE = 200
+
+
+async def ensure_indexes(db):
+    """Index des champs de référence (vérification de release() sans parcours de collection)"""
+    for collection, fields in REFERENCE_FIELDS.items():
+        for field in fields:
+            await db[collection].create_index([(field, 1)], sparse=True)
+
+
+async def referenced_by(db, collection: str, query: dict) -> List[str]:
+    """Références aux blobs des documents de `collection` qui correspondent à `query`
+    (à lire avant de supprimer ces documents)"""
+    urls = []
+    for field in REFERENCE_FIELDS[collection]:
+        urls.extend(await db[collection].distinct(field, query))
+    return [url for url in urls if key_from_url(url)]
+
+
+def _variants(digest: str) -> List[str]:
+    """Toutes les références possibles d'un contenu (une par extension)"""
+    return [media_url(f"{digest}.{ext}") for ext in CONTENT_TYPES]
+
+
+async def release(db, urls: Iterable[Optional[str]]) -> int:
+    """
+    Efface les blobs de `urls` qu'aucun document ne référence plus (à appeler après
+    la suppression des documents). Un même contenu pouvant être partagé (déduplication),
+    chaque blob est d'abord cherché dans tous les champs de REFERENCE_FIELDS.
+    Retourne le nombre de blobs effacés.
+    """
+    digests = sorted({digest for digest in map(digest_from_url, urls) if digest})
+    freed = 0
+    for start in range(0, len(digests), RELEASE_BATCH_SIZE):
+        batch = digests[start:start + RELEASE_BATCH_SIZE]
+        values = [value for digest in batch for value in _variants(digest)]
+        used = set()
+        for collection, fields in REFERENCE_FIELDS.items():
+            for field in fields:
+                for url in await db[collection].distinct(field, {field: {"$in": values}}):
+                    used.add(digest_from_url(url))
+        for digest in batch:
+            if digest not in used:
+                await run_in_threadpool(store.delete, digest)
+                freed += 1
+    return freed
+
+
+# ==================== DIFFUSION ====================
+
+media_router = APIRouter(prefix=MEDIA_ROUTE, tags=["media"])
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    En-tête Range → (début, fin) inclus.
+    None si l'en-tête est ignoré (plusieurs plages, syntaxe inconnue) ;
+    HTTPException 416 si la plage ne peut pas être satisfaite.
+    """
+    match = re.fullmatch(r"\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*", header)
+    if not match or (not match.group(1) and not match.group(2)):
+        return None
+
+    first, last = match.group(1), match.group(2)
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if last and int(last) < start:
+            return None
+    else:
+        start = max(size - int(last), 0)
+        end = size - 1
+        if int(last) == 0:
+            start = size  # suffixe vide : non satisfiable
+
+    if start >= size:
+        raise HTTPException(
+            status_code=416,
+            detail="Range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    return start, end
+
+
+@media_router.get("/{key}")
+async def get_media(key: str, request: Request):
+    """Sert un blob (public : les balises <img>/<video> n'envoient pas de jeton)"""
+    match = KEY_PATTERN.match(key)
+    if not match:
+        raise HTTPException(status_code=404, detail="Media not found")
+    digest, ext = match.groups()
+
+    size = await run_in_threadpool(store.size, digest)
+    if size is None:
+        raise HTTPException(status_code=404, detail="Media not found")
+
+    # Contenu adressé par hash : immuable, l'ETag fort est le hash lui-même
+    etag = f'"{digest}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "Accept-Ranges": "bytes",
+    }
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in [t.strip() for t in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+
+    media_type = CONTENT_TYPES.get(ext, "application/octet-stream")
+    byte_range = None
+    range_header = request.headers.get("range")
+    if range_header and size > 0:
+        if_range = request.headers.get("if-range")
+        if not if_range or if_range.strip() == etag:
+            byte_range = parse_range(range_header, size)
+
+    if byte_range is None:
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(
+            store.iter_range(digest, 0, size - 1), media_type=media_type, headers=headers
+        )
+
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        store.iter_range(digest, start, end), status_code=206, media_type=media_type, headers=headers
+    )
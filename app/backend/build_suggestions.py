@@ -0,0 +1,48 @@
+# app/backend/build_suggestions.py - Précalcule les suggestions d'abonnement (suggestions.py)
+#
+# Usage : python build_suggestions.py          # comptes dont les abonnements ont changé (+ leurs abonnés)
+#         python build_suggestions.py --full   # tout le graphe
+# À planifier : --full chaque nuit, l'incrémental toutes les quelques minutes.
+
+import asyncio
+import os
+import sys
+import time
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+try:
+    import backend.suggestions as suggestions
+except ImportError:
+    import suggestions
+
+# Charger les variables d'environnement
+load_dotenv()
+
+# Configuration MongoDB
+MONGODB_URL = os.environ.get('MONGODB_URI') or os.environ.get('MONGO_URL') or os.environ.get('DATABASE_URL')
+DATABASE_NAME = os.environ.get('DB_NAME', 'nexus_social')
+
+
+async def build(db, full: bool):
+    await suggestions.ensure_indexes(db)
+    started = time.monotonic()
+    if full:
+        written = await suggestions.rebuild_all(db)
+    else:
+        written = await suggestions.refresh_dirty(db)
+    print(f"✅ {written} users refreshed in {time.monotonic() - started:.1f}s")
+
+
+def main():
+    full = "--full" in sys.argv[1:]
+    print(f"🧭 Building follow suggestions ({'full' if full else 'incremental'})")
+    client = AsyncIOMotorClient(MONGODB_URL)
+    try:
+        asyncio.run(build(client[DATABASE_NAME], full))
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
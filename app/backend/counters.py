@@ -0,0 +1,221 @@
+"""
+counters.py - Agrégation en écriture différée des compteurs ($inc)
+Likes, commentaires, vues de stories et abonnements ne font plus un $inc par action :
+les deltas sont cumulés par document en mémoire puis écrits par bulk_write,
+toutes les COUNTER_FLUSH_INTERVAL_SECONDS ou dès COUNTER_FLUSH_MAX_DOCS documents en attente.
+Les lectures du worker ajoutent les deltas en attente (merge) pour rester à jour.
+Chaque lot écrit porte un identifiant gardé dans le document (COUNTER_FLUSH_FIELD) : un lot
+réessayé après une erreur au résultat inconnu (réseau) n'est jamais appliqué deux fois.
+Après COUNTER_MAX_RETRIES essais, ou sur une erreur d'écriture définitive, les deltas sont
+abandonnés (journalisés) ; reconcile_counters.py corrige les compteurs d'utilisateurs.
+"""
+
+from typing import Dict, Iterable, List, Optional
+import asyncio
+import os
+
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+# Intervalle maximum entre deux écritures
+COUNTER_FLUSH_INTERVAL_SECONDS = float(os.environ.get("COUNTER_FLUSH_INTERVAL_SECONDS", 1.0))
+
+# Nombre de documents en attente déclenchant une écriture immédiate
+COUNTER_FLUSH_MAX_DOCS = int(os.environ.get("COUNTER_FLUSH_MAX_DOCS", 1000))
+
+# Opérations par bulk_write
+COUNTER_BULK_SIZE = 1000
+
+# Essais d'un lot dont l'écriture a échoué avant abandon de ses deltas
+COUNTER_MAX_RETRIES = int(os.environ.get("COUNTER_MAX_RETRIES", 5))
+
+# Identifiants des derniers lots appliqués, gardés dans chaque document
+COUNTER_FLUSH_FIELD = "counter_flushes"
+COUNTER_FLUSH_HISTORY = 8
+
+# collection → id du document → champ → delta
+Deltas = Dict[str, Dict[str, Dict[str, int]]]
+
+
+def _add(deltas: Deltas, collection: str, doc_id: str, fields: Dict[str, int]) -> bool:
+    """Cumule des deltas ; retourne True si le document n'était pas encore en attente"""
+    docs = deltas.setdefault(collection, {})
+    new = doc_id not in docs
+    current = docs.setdefault(doc_id, {})
+    for field, delta in fields.items():
+        current[field] = current.get(field, 0) + delta
+    return new
+
+
+class CounterBuffer:
+    """Tampon des $inc, vidé par une tâche de fond"""
+
+    def __init__(self):
+        self.db = None
+        self.pending: Deltas = {}
+        self.inflight: Deltas = {}  # lot en cours d'écriture (encore visible en lecture)
+        # Lots à réessayer tels quels (même identifiant) : (collection, flush_id, chunk, essais)
+        self.retrying: List[tuple] = []
+        self.pending_docs = 0
+        self.lock = asyncio.Lock()
+        self.wake: Optional[asyncio.Event] = None
+        self.task: Optional[asyncio.Task] = None
+        self.stopping = False
+        self.stats = {"increments": 0, "flushes": 0, "writes": 0, "errors": 0, "retries": 0, "dropped": 0}
+
+    # ==================== ÉCRITURE ====================
+
+    def incr(self, collection: str, doc_id: Optional[str], field: str, delta: int = 1):
+        """Ajoute un delta au compteur `field` du document {"id": doc_id}"""
+        if not doc_id or not delta:
+            return
+        if _add(self.pending, collection, doc_id, {field: delta}):
+            self.pending_docs += 1
+        self.stats["increments"] += 1
+        if self.pending_docs >= COUNTER_FLUSH_MAX_DOCS and self.wake is not None:
+            self.wake.set()
+
+    # ==================== LECTURE ====================
+
+    def pending_delta(self, collection: str, doc_id: str, field: str) -> int:
+        delta = 0
+        for deltas in (self.pending, self.inflight):
+            delta += deltas.get(collection, {}).get(doc_id, {}).get(field, 0)
+        for retry_collection, _, chunk, _ in self.retrying:
+            if retry_collection == collection:
+                delta += sum(inc.get(field, 0) for chunk_id, inc in chunk if chunk_id == doc_id)
+        return delta
+
+    def merge(self, collection: str, docs: Iterable[dict], *fields: str):
+        """Ajoute aux documents lus les deltas pas encore écrits"""
+        if (not self.pending.get(collection) and not self.inflight.get(collection)
+                and not any(retry[0] == collection for retry in self.retrying)):
+            return
+        for doc in docs:
+            for field in fields:
+                delta = self.pending_delta(collection, doc.get("id"), field)
+                if delta:
+                    doc[field] = doc.get(field, 0) + delta
+
+    # ==================== VIDAGE ====================
+
+    async def flush(self) -> int:
+        """Écrit les lots à réessayer puis tous les deltas en attente ;
+        retourne le nombre de documents mis à jour"""
+        async with self.lock:
+            if (not self.pending and not self.retrying) or self.db is None:
+                return 0
+            written = 0
+            retrying, self.retrying = self.retrying, []
+            for collection, flush_id, chunk, attempts in retrying:
+                self.stats["retries"] += 1
+                written += await self._write_chunk(collection, chunk, flush_id, attempts)
+
+            self.inflight, self.pending, self.pending_docs = self.pending, {}, 0
+            try:
+                for collection, docs in self.inflight.items():
+                    items = [
+                        (doc_id, {f: d for f, d in fields.items() if d})
+                        for doc_id, fields in docs.items()
+                    ]
+                    items = [(doc_id, inc) for doc_id, inc in items if inc]
+                    for start in range(0, len(items), COUNTER_BULK_SIZE):
+                        chunk = items[start:start + COUNTER_BULK_SIZE]
+                        written += await self._write_chunk(collection, chunk, ObjectId())
+                self.stats["flushes"] += 1
+                self.stats["writes"] += written
+            finally:
+                self.inflight = {}
+            return written
+
+    async def _write_chunk(self, collection: str, chunk: List, flush_id: ObjectId, attempts: int = 0) -> int:
+        """
+        Un bulk_write idempotent : un document qui porte déjà `flush_id` n'est pas réincrémenté.
+        Résultat inconnu (réseau) : le lot est réessayé tel quel au prochain vidage, au plus
+        COUNTER_MAX_RETRIES fois. Erreur d'écriture d'un document (définitive) : son delta est abandonné.
+        """
+        try:
+            await self.db[collection].bulk_write(
+                [
+                    UpdateOne(
+                        {"id": doc_id, COUNTER_FLUSH_FIELD: {"$ne": flush_id}},
+                        {
+                            "$inc": inc,
+                            "$push": {COUNTER_FLUSH_FIELD: {"$each": [flush_id], "$slice": -COUNTER_FLUSH_HISTORY}}
+                        }
+                    )
+                    for doc_id, inc in chunk
+                ],
+                ordered=False
+            )
+            return len(chunk)
+        except BulkWriteError as e:
+            failed = {err["index"] for err in e.details.get("writeErrors", [])}
+            self.stats["errors"] += 1
+            self._drop(collection, [chunk[i] for i in sorted(failed)], f"write errors: {e.details.get('writeErrors', [])[:1]}")
+            return len(chunk) - len(failed)
+        except Exception as e:
+            self.stats["errors"] += 1
+            if attempts + 1 >= COUNTER_MAX_RETRIES:
+                self._drop(collection, chunk, f"{attempts + 1} attempts, last error: {e}")
+            else:
+                print(f"⚠️ Counter flush failed for {collection} ({e}), retry {attempts + 1}/{COUNTER_MAX_RETRIES - 1}")
+                self.retrying.append((collection, flush_id, chunk, attempts + 1))
+            return 0
+
+    def _drop(self, collection: str, items: List, reason: str):
+        """Deltas abandonnés : journalisés (reconcile_counters.py recompte les utilisateurs)"""
+        if not items:
+            return
+        self.stats["dropped"] += len(items)
+        sample = ", ".join(f"{doc_id} {inc}" for doc_id, inc in items[:5])
+        print(f"❌ Counter flush: {len(items)} {collection} updates dropped ({reason}): {sample}")
+
+    async def _run(self):
+        while not self.stopping:
+            try:
+                await asyncio.wait_for(self.wake.wait(), timeout=COUNTER_FLUSH_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self.wake.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"⚠️ Counter flush error: {e}")
+
+    def start(self, db):
+        """À appeler au démarrage de l'application"""
+        self.db = db
+        self.wake = asyncio.Event()
+        self.stopping = False
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """À l'arrêt : laisse finir l'écriture en cours (pas d'annulation) puis écrit ce qui reste"""
+        if self.task is not None:
+            self.stopping = True
+            self.wake.set()
+            await self.task
+            self.task = None
+        await self.flush()
+
+    def snapshot(self) -> dict:
+        data = dict(self.stats)
+        data["pending_docs"] = self.pending_docs
+        data["retrying_chunks"] = len(self.retrying)
+        return data
+
+
+buffer = CounterBuffer()
+
+
+def incr(collection: str, doc_id: Optional[str], field: str, delta: int = 1):
+    """Raccourci : buffer.incr"""
+    buffer.incr(collection, doc_id, field, delta)
+
+
+def merge(collection: str, docs: Iterable[dict], *fields: str):
+    """Raccourci : buffer.merge"""
+    buffer.merge(collection, docs, *fields)
@@ -0,0 +1,151 @@
+"""
+derivatives.py - Dérivés d'images (tailles d'avatar, miniatures de story)
+Le décodage / redimensionnement tourne dans un ProcessPoolExecutor :
+la boucle d'événements n'exécute jamais de travail image.
+Les dérivés sont stockés par hash comme les originaux (blob_store).
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from starlette.concurrency import run_in_threadpool
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import multiprocessing
+import os
+
+try:
+    import backend.blob_store as blob_store
+except ImportError:
+    import blob_store
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    print("⚠️ WARNING: Pillow not installed. Image derivatives will not be generated.")
+    Image = None
+    ImageOps = None
+
+# Côtés des avatars carrés générés (px)
+AVATAR_SIZES = (96, 320)
+
+# Taille utilisée dans les listes (feed, commentaires, recherche, messages…)
+LIST_AVATAR_SIZE = 96
+
+# Boîte englobante des miniatures de story (px)
+STORY_THUMBNAIL_SIZE = (270, 480)
+
+DERIVATIVE_QUALITY = 85
+
+# Processus dédiés au travail image
+DERIVATIVE_WORKERS = int(os.environ.get("DERIVATIVE_WORKERS", max(1, min(4, (os.cpu_count() or 2) - 1))))
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+# Spécification d'un dérivé : (nom, largeur, hauteur, recadrage carré)
+Spec = Tuple[str, int, int, bool]
+
+
+# ==================== TRAVAIL IMAGE (processus worker) ====================
+
+def render_derivatives(source, specs: List[Spec]) -> List[Tuple[str, bytes]]:
+    """Décode l'image source (chemin ou octets) et encode chaque dérivé en JPEG"""
+    with Image.open(source if isinstance(source, str) else BytesIO(source)) as img:
+        largest = max(max(w, h) for _, w, h, _ in specs)
+        img.draft("RGB", (largest, largest))  # JPEG : décodage directement à taille réduite
+        img = ImageOps.exif_transpose(img)
+        if img.mode in ("RGBA", "LA", "P"):
+            img = img.convert("RGBA")
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.getchannel("A"))
+            img = background
+        else:
+            img = img.convert("RGB")
+
+        results = []
+        for name, width, height, crop in specs:
+            if crop:
+                variant = ImageOps.fit(img, (width, height), Image.LANCZOS)
+            else:
+                variant = img.copy()
+                variant.thumbnail((width, height), Image.LANCZOS)
+            out = BytesIO()
+            variant.save(out, "JPEG", quality=DERIVATIVE_QUALITY, optimize=True, progressive=True)
+            results.append((name, out.getvalue()))
+        return results
+
+
+# ==================== ORCHESTRATION (boucle d'événements) ====================
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # spawn : pas de fork d'un process qui a déjà des threads et une boucle asyncio
+        _executor = ProcessPoolExecutor(
+            max_workers=DERIVATIVE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _executor
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def _read_source(digest: str):
+    """Chemin local du blob (transmis tel quel au worker), sinon son contenu"""
+    path = blob_store.store.local_path(digest)
+    if path is not None:
+        return str(path)
+    size = blob_store.store.size(digest)
+    if size is None:
+        return None
+    return b"".join(blob_store.store.iter_range(digest, 0, size - 1))
+
+
+async def _generate(source_url: str, specs: List[Spec]) -> Dict[str, str]:
+    """Génère les dérivés d'un blob image → {nom: référence}"""
+    if Image is None:
+        return {}
+    digest = blob_store.digest_from_url(source_url)
+    if digest is None:
+        return {}
+
+    source = await run_in_threadpool(_read_source, digest)
+    if source is None:
+        return {}
+
+    try:
+        rendered = await asyncio.get_running_loop().run_in_executor(
+            get_executor(), render_derivatives, source, specs
+        )
+    except Exception as e:
+        print(f"⚠️ Image derivatives failed for {digest}: {e}")
+        return {}
+
+    urls = {}
+    for name, data in rendered:
+        urls[name] = await blob_store.save_bytes(data, "image/jpeg")
+    return urls
+
+
+async def make_avatar_sizes(source_url: str) -> Dict[str, str]:
+    """Avatars carrés aux tailles AVATAR_SIZES → {"96": URL, "320": URL}"""
+    return await _generate(source_url, [(str(s), s, s, True) for s in AVATAR_SIZES])
+
+
+async def make_story_thumbnail(source_url: str) -> Optional[str]:
+    """Miniature d'une story image (les vidéos n'en ont pas)"""
+    width, height = STORY_THUMBNAIL_SIZE
+    urls = await _generate(source_url, [("thumbnail", width, height, False)])
+    return urls.get("thumbnail")
+
+
+def list_avatar(user: Optional[dict]) -> Optional[str]:
+    """Avatar à afficher dans les listes : petite variante si elle existe, sinon l'original"""
+    if not user:
+        return None
+    sizes = user.get("profile_pic_sizes") or {}
+    return sizes.get(str(LIST_AVATAR_SIZE)) or user.get("profile_pic")
@@ -0,0 +1,157 @@
+"""
+feed_cache.py - Cache des pages de feed assemblées, par utilisateur
+- L1 : LRU en mémoire avec TTL (par worker)
+- Backend partagé (interchangeable) : porte la version de feed de chaque
+  utilisateur ; l'incrémenter invalide ses pages sur tous les workers.
+- Stale-while-revalidate : une page expirée depuis peu est servie telle quelle
+  pendant qu'un seul recalcul tourne en arrière-plan.
+- Fraîcheur : un post ou une story invalide l'auteur et ses abonnés, sauf pour un auteur
+  tiré (timelines.py) ; ses abonnés le voient quand leur page expire, au plus
+  FEED_CACHE_TTL_SECONDS + FEED_CACHE_STALE_SECONDS après (75 s par défaut).
+"""
+
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, Optional, Set, Tuple
+import asyncio
+import os
+import time
+
+# Durée pendant laquelle une page est considérée fraîche
+FEED_CACHE_TTL_SECONDS = float(os.environ.get("FEED_CACHE_TTL_SECONDS", 15))
+
+# Fenêtre supplémentaire pendant laquelle une page expirée peut encore être servie
+FEED_CACHE_STALE_SECONDS = float(os.environ.get("FEED_CACHE_STALE_SECONDS", 60))
+
+# Nombre maximum de pages conservées par worker
+FEED_CACHE_MAX_ENTRIES = int(os.environ.get("FEED_CACHE_MAX_ENTRIES", 10000))
+
+
+class SharedCacheBackend(ABC):
+    """Interface du backend partagé entre workers (versions de feed par utilisateur)"""
+
+    @abstractmethod
+    async def get_version(self, user_id: str) -> int:
+        """Version courante du feed de l'utilisateur (0 si jamais invalidé)"""
+
+    @abstractmethod
+    async def bump_versions(self, user_ids: Iterable[str]):
+        """Incrémente la version de chaque utilisateur (invalide ses pages partout)"""
+
+
+class LocalSharedBackend(SharedCacheBackend):
+    """Remplaçant local (un seul process) du backend partagé"""
+
+    def __init__(self):
+        self.versions: Dict[str, int] = {}
+
+    async def get_version(self, user_id: str) -> int:
+        return self.versions.get(user_id, 0)
+
+    async def bump_versions(self, user_ids: Iterable[str]):
+        for user_id in user_ids:
+            self.versions[user_id] = self.versions.get(user_id, 0) + 1
+
+
+class FeedCache:
+    """LRU + TTL devant le backend partagé, avec stale-while-revalidate"""
+
+    def __init__(self, backend: SharedCacheBackend, max_entries: int = FEED_CACHE_MAX_ENTRIES):
+        self.backend = backend
+        self.max_entries = max_entries
+        # (user_id, key) → (version, stored_at, value)
+        self.entries: "OrderedDict[Tuple[str, Hashable], Tuple[int, float, Any]]" = OrderedDict()
+        self.inflight: Dict[Tuple[str, Hashable], asyncio.Future] = {}
+        # Recalculs en arrière-plan (référence gardée jusqu'à la fin de la tâche)
+        self.revalidations: Set[asyncio.Task] = set()
+        self.stats = {"hits": 0, "stale_hits": 0, "misses": 0, "invalidations": 0}
+
+    def _store(self, cache_key, version: int, value):
+        self.entries[cache_key] = (version, time.monotonic(), value)
+        self.entries.move_to_end(cache_key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def _compute(self, cache_key, version: int, compute: Callable[[], Awaitable[Any]]):
+        """Un seul calcul par clé à la fois (les requêtes concurrentes l'attendent)"""
+        future = self.inflight.get(cache_key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[cache_key] = future
+        try:
+            value = await compute()
+            # None = page non cacheable ; ne pas mémoriser un résultat invalidé pendant son calcul
+            if value is not None and await self.backend.get_version(cache_key[0]) == version:
+                self._store(cache_key, version, value)
+            future.set_result(value)
+            return value
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # évite l'avertissement "exception never retrieved"
+            raise
+        finally:
+            if not future.done():  # calcul annulé : débloquer les requêtes en attente
+                future.cancel()
+            self.inflight.pop(cache_key, None)
+
+    async def _revalidate(self, cache_key, version: int, compute):
+        try:
+            await self._compute(cache_key, version, compute)
+        except Exception as e:
+            print(f"⚠️ Feed cache revalidation failed for {cache_key}: {e}")
+
+    async def get_or_compute(self, user_id: str, key: Hashable, compute: Callable[[], Awaitable[Any]]):
+        """Retourne la page en cache ou la calcule via `compute()`"""
+        cache_key = (user_id, key)
+        version = await self.backend.get_version(user_id)
+        cached = self.entries.get(cache_key)
+
+        if cached is not None and cached[0] == version:
+            age = time.monotonic() - cached[1]
+            if age < FEED_CACHE_TTL_SECONDS:
+                self.entries.move_to_end(cache_key)
+                self.stats["hits"] += 1
+                return cached[2]
+            if age < FEED_CACHE_TTL_SECONDS + FEED_CACHE_STALE_SECONDS:
+                self.stats["stale_hits"] += 1
+                if cache_key not in self.inflight:
+                    task = asyncio.create_task(self._revalidate(cache_key, version, compute))
+                    self.revalidations.add(task)
+                    task.add_done_callback(self.revalidations.discard)
+                return cached[2]
+
+        self.stats["misses"] += 1
+        return await self._compute(cache_key, version, compute)
+
+    async def invalidate(self, user_ids: Iterable[str]):
+        """Invalide toutes les pages des utilisateurs donnés (sur tous les workers)"""
+        user_ids = {u for u in user_ids if u}
+        if not user_ids:
+            return
+        try:
+            await self.backend.bump_versions(user_ids)
+            self.stats["invalidations"] += len(user_ids)
+        except Exception as e:
+            print(f"⚠️ Feed cache invalidation failed: {e}")
+        # Les pages d'une ancienne version ne sont plus jamais servies ; le LRU les évince
+
+    def snapshot(self) -> dict:
+        data = dict(self.stats)
+        data["entries"] = len(self.entries)
+        return data
+
+
+cache = FeedCache(LocalSharedBackend())
+
+
+def set_shared_backend(backend: SharedCacheBackend):
+    """Branche un backend partagé (ex. Redis) à la place du remplaçant local"""
+    cache.backend = backend
+    cache.entries.clear()
+
+
+async def invalidate(user_ids: Iterable[Optional[str]]):
+    """Raccourci : invalide le feed des utilisateurs donnés"""
+    await cache.invalidate(user_ids)
@@ -0,0 +1,173 @@
+"""
+follow_graph.py - Index en mémoire du graphe d'abonnements (par worker)
+Ensembles d'adjacence (abonnements / abonnés) chargés à la demande depuis
+`follows`, puis tenus à jour à chaque abonnement / désabonnement / acceptation.
+« A suit-il B ? » devient un test d'appartenance O(1), sans aller-retour Mongo.
+"""
+
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Set, Tuple
+import asyncio
+import os
+import sys
+import time
+
+# Durée de validité d'un ensemble chargé (les autres workers convergent dans ce délai)
+FOLLOW_GRAPH_TTL_SECONDS = float(os.environ.get("FOLLOW_GRAPH_TTL_SECONDS", 300))
+
+# Nombre maximum d'ensembles conservés par direction (LRU)
+FOLLOW_GRAPH_MAX_USERS = int(os.environ.get("FOLLOW_GRAPH_MAX_USERS", 100000))
+
+# Comptes mis à jour par update_many à la suppression d'un compte
+EDGE_BATCH_SIZE = 1000
+
+FOLLOWING = "following"
+FOLLOWERS = "followers"
+
+
+class FollowGraph:
+    """Adjacence abonnements/abonnés, identifiants internés pour partager la mémoire"""
+
+    def __init__(self):
+        # direction → user_id → (loaded_at, ensemble d'ids)
+        self.adjacency: Dict[str, "OrderedDict[str, Tuple[float, Set[str]]]"] = {
+            FOLLOWING: OrderedDict(),
+            FOLLOWERS: OrderedDict(),
+        }
+        self.inflight: Dict[Tuple[str, str], asyncio.Future] = {}
+        self.stats = {"hits": 0, "loads": 0}
+
+    async def _query(self, db, direction: str, user_id: str) -> Set[str]:
+        """Charge un ensemble d'adjacence (parcours couvert par l'index de la direction)"""
+        if direction == FOLLOWING:
+            key, other = "follower_id", "followed_id"
+        else:
+            key, other = "followed_id", "follower_id"
+        cursor = db.follows.find({key: user_id}, {other: 1, "_id": 0})
+        return {sys.intern(f[other]) async for f in cursor if f.get(other)}
+
+    async def _get(self, db, direction: str, user_id: str) -> Set[str]:
+        table = self.adjacency[direction]
+        entry = table.get(user_id)
+        if entry is not None and time.monotonic() - entry[0] < FOLLOW_GRAPH_TTL_SECONDS:
+            table.move_to_end(user_id)
+            self.stats["hits"] += 1
+            return entry[1]
+
+        key = (direction, user_id)
+        future = self.inflight.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        try:
+            ids = await self._query(db, direction, user_id)
+            table[sys.intern(user_id)] = (time.monotonic(), ids)
+            table.move_to_end(user_id)
+            while len(table) > FOLLOW_GRAPH_MAX_USERS:
+                table.popitem(last=False)
+            self.stats["loads"] += 1
+            future.set_result(ids)
+            return ids
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        finally:
+            if not future.done():
+                future.cancel()
+            self.inflight.pop(key, None)
+
+    # ==================== LECTURE ====================
+
+    async def following(self, db, user_id: str) -> Set[str]:
+        """Comptes suivis par user_id (ensemble partagé : ne pas le modifier)"""
+        return await self._get(db, FOLLOWING, user_id)
+
+    async def followers(self, db, user_id: str) -> Set[str]:
+        """Abonnés de user_id (ensemble partagé : ne pas le modifier)"""
+        return await self._get(db, FOLLOWERS, user_id)
+
+    async def is_following(self, db, follower_id: str, followed_id: str) -> bool:
+        return followed_id in await self.following(db, follower_id)
+
+    # ==================== MISES À JOUR INCRÉMENTALES ====================
+
+    def add_edge(self, follower_id: str, followed_id: str):
+        """À appeler après l'insertion d'un abonnement confirmé"""
+        entry = self.adjacency[FOLLOWING].get(follower_id)
+        if entry is not None:
+            entry[1].add(sys.intern(followed_id))
+        entry = self.adjacency[FOLLOWERS].get(followed_id)
+        if entry is not None:
+            entry[1].add(sys.intern(follower_id))
+
+    def remove_edge(self, follower_id: str, followed_id: str):
+        """À appeler après la suppression d'un abonnement"""
+        entry = self.adjacency[FOLLOWING].get(follower_id)
+        if entry is not None:
+            entry[1].discard(followed_id)
+        entry = self.adjacency[FOLLOWERS].get(followed_id)
+        if entry is not None:
+            entry[1].discard(follower_id)
+
+    def drop_user(self, user_id: str):
+        """Oublie un utilisateur supprimé et le retire des ensembles chargés de ses voisins"""
+        following = self.adjacency[FOLLOWING].pop(user_id, None)
+        followers = self.adjacency[FOLLOWERS].pop(user_id, None)
+        for other in (following[1] if following else ()):
+            entry = self.adjacency[FOLLOWERS].get(other)
+            if entry is not None:
+                entry[1].discard(user_id)
+        for other in (followers[1] if followers else ()):
+            entry = self.adjacency[FOLLOWING].get(other)
+            if entry is not None:
+                entry[1].discard(user_id)
+
+    def invalidate(self, user_ids: Iterable[str]):
+        """Force le rechargement des ensembles de ces utilisateurs"""
+        for user_id in user_ids:
+            for direction in (FOLLOWING, FOLLOWERS):
+                self.adjacency[direction].pop(user_id, None)
+
+    def snapshot(self) -> dict:
+        data = dict(self.stats)
+        data["following_sets"] = len(self.adjacency[FOLLOWING])
+        data["followers_sets"] = len(self.adjacency[FOLLOWERS])
+        return data
+
+
+graph = FollowGraph()
+
+
+async def delete_user_edges(db, user_id: str):
+    """Supprime les abonnements d'un compte et décrémente les compteurs de ses voisins"""
+    following = [f["followed_id"] async for f in db.follows.find({"follower_id": user_id}, {"followed_id": 1, "_id": 0})]
+    followers = [f["follower_id"] async for f in db.follows.find({"followed_id": user_id}, {"follower_id": 1, "_id": 0})]
+    await db.follows.delete_many({"$or": [{"follower_id": user_id}, {"followed_id": user_id}]})
+    for ids, field in ((following, "followers_count"), (followers, "following_count")):
+        for start in range(0, len(ids), EDGE_BATCH_SIZE):
+            await db.users.update_many(
+                {"id": {"$in": ids[start:start + EDGE_BATCH_SIZE]}},
+                {"$inc": {field: -1}}
+            )
+
+
+async def ensure_indexes(db):
+    """Un abonnement par paire ; chaque direction est une seule recherche d'index.
+    L'index unique suppose les anciens doublons retirés (migrate_follows.py)."""
+    await db.follows.create_index([("followed_id", 1), ("created_at", -1), ("id", -1)])
+    await db.follows.create_index([("follower_id", 1), ("created_at", -1), ("id", -1)])
+    await db.follows.create_index([("followed_id", 1), ("follower_id", 1)])
+    await db.follows.create_index([("follower_id", 1), ("followed_id", 1)], unique=True)
+
+
+async def get_following_ids(db, user_id: str) -> List[str]:
+    """Liste des comptes suivis par user_id"""
+    return list(await graph.following(db, user_id))
+
+
+async def get_follower_ids(db, user_id: str) -> List[str]:
+    """Liste des abonnés de user_id"""
+    return list(await graph.followers(db, user_id))
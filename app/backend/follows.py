@@ -3,15 +3,36 @@ follows.py - Système de suivi complet pour FastAPI + MongoDB
 Inclut : suivi, demandes d'abonnement, listes abonnés/abonnements
 """
 
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from motor.motor_asyncio import AsyncIOMotorClient
 from datetime import datetime, timezone
-from typing import List, Optional
+from typing import List, Literal, Optional
 from pydantic import BaseModel
+from pymongo import InsertOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 import jwt
 import os
 
+try:
+    import backend.timelines as timelines
+    import backend.feed_cache as feed_cache
+    import backend.follow_graph as follow_graph
+    import backend.counters as counters
+    import backend.user_cards as user_cards
+    import backend.suggestions as suggestions
+    import backend.Notifications as Notifications
+    from backend.pagination import fetch_page, NEXT_CURSOR_HEADER
+except ImportError:
+    import timelines
+    import feed_cache
+    import follow_graph
+    import counters
+    import user_cards
+    import suggestions
+    import Notifications
+    from pagination import fetch_page, NEXT_CURSOR_HEADER
+
 # Router pour les follows
 follow_router = APIRouter(prefix="/api", tags=["follows"])
 
@@ -20,6 +41,9 @@ security = HTTPBearer()
 SECRET_KEY = os.environ.get('SECRET_KEY', '76f267dbc69c6b4e639a50a7ccdd3783')
 ALGORITHM = "HS256"
 
+# Demandes traitées au maximum par POST /follow-requests/bulk
+MAX_BULK_REQUESTS = 500
+
 # MongoDB (sera injecté depuis server.py)
 db = None
 
@@ -44,6 +68,10 @@ class FollowUser(BaseModel):
     is_following_back: Optional[bool] = False
     follows_back: Optional[bool] = False
 
+class BulkRequestAction(BaseModel):
+    action: Literal["accept", "reject"]
+    request_ids: List[str]
+
 class FollowStats(BaseModel):
     followers: int
     following: int
@@ -87,13 +115,8 @@ async def check_follow_status(follower_id: str, followed_id: str) -> str:
     Vérifie le statut d'abonnement
     Returns: 'following', 'pending', 'not_following'
     """
-    # Vérifier abonnement confirmé
-    follow = await db.follows.find_one({
-        "follower_id": follower_id,
-        "followed_id": followed_id,
-        "status": "following"
-    })
-    if follow:
+    # Vérifier abonnement confirmé (graphe en mémoire)
+    if await follow_graph.graph.is_following(db, follower_id, followed_id):
         return "following"
     
     # Vérifier demande en attente
@@ -126,7 +149,11 @@ async def can_view_profile(viewer_id: str, profile_id: str) -> bool:
 # ==================== ENDPOINTS SUIVI ====================
 
 @follow_router.post("/users/{user_id}/follow")
-async def follow_user(user_id: str, current_user_id: str = Depends(get_current_user)):
+async def follow_user(
+    user_id: str,
+    background_tasks: BackgroundTasks,
+    current_user_id: str = Depends(get_current_user)
+):
     """
     Suivre un utilisateur (ou envoyer demande si privé)
     POST /api/users/{user_id}/follow
@@ -181,31 +208,34 @@ async def follow_user(user_id: str, current_user_id: str = Depends(get_current_u
             follow_id = f"follow_{current_user_id}_{user_id}"
             print(f"🔓 Creating follow (public account): {follow_id}")
             
-            # Insérer l'abonnement
-            await db.follows.insert_one({
-                "id": follow_id,
-                "follower_id": current_user_id,
-                "followed_id": user_id,
-                "status": "following",
-                "created_at": datetime.now(timezone.utc).isoformat()
-            })
+            # Insérer l'abonnement (index unique : une requête concurrente a pu le créer)
+            try:
+                await db.follows.insert_one({
+                    "id": follow_id,
+                    "follower_id": current_user_id,
+                    "followed_id": user_id,
+                    "status": "following",
+                    "created_at": datetime.now(timezone.utc).isoformat()
+                })
+            except DuplicateKeyError:
+                raise HTTPException(status_code=400, detail="Vous suivez déjà cet utilisateur")
             
+            follow_graph.graph.add_edge(current_user_id, user_id)
             print(f"✅ Follow created successfully")
             
-            # Incrémenter compteurs (ne pas planter si ça échoue)
-            try:
-                print(f"📈 Updating follower counts...")
-                await db.users.update_one(
-                    {"id": user_id},
-                    {"$inc": {"followers_count": 1}}
-                )
-                await db.users.update_one(
-                    {"id": current_user_id},
-                    {"$inc": {"following_count": 1}}
-                )
-                print(f"✅ Counts updated")
-            except Exception as count_error:
-                print(f"⚠️ Warning: Could not update follow counts: {count_error}")
+            # Incrémenter compteurs (écriture différée, regroupée par counters.py)
+            counters.incr("users", user_id, "followers_count", 1)
+            counters.incr("users", current_user_id, "following_count", 1)
+            
+            await feed_cache.invalidate([current_user_id])
+            background_tasks.add_task(timelines.backfill_author, db, current_user_id, user_id)
+            background_tasks.add_task(suggestions.mark_dirty, db, [current_user_id])
+            
+            # Notification (enregistrée et envoyée en temps réel)
+            follower = (await user_cards.cache.get_many(db, [current_user_id])).get(current_user_id, {})
+            background_tasks.add_task(
+                Notifications.notify_follow, user_id, current_user_id, follower.get("username", "")
+            )
             
             return {
                 "status": "following",
@@ -221,7 +251,11 @@ async def follow_user(user_id: str, current_user_id: str = Depends(get_current_u
         raise HTTPException(status_code=500, detail=f"Erreur serveur: {str(e)}")
 
 @follow_router.delete("/users/{user_id}/follow")
-async def unfollow_user(user_id: str, current_user_id: str = Depends(get_current_user)):
+async def unfollow_user(
+    user_id: str,
+    background_tasks: BackgroundTasks,
+    current_user_id: str = Depends(get_current_user)
+):
     """
     Se désabonner d'un utilisateur
     DELETE /api/users/{user_id}/follow
@@ -245,16 +279,15 @@ async def unfollow_user(user_id: str, current_user_id: str = Depends(get_current
             "followed_id": user_id
         })
         
+        follow_graph.graph.remove_edge(current_user_id, user_id)
+        
         # Décrémenter compteurs SEULEMENT si l'abonnement existait
         if existing_follow:
-            await db.users.update_one(
-                {"id": user_id},
-                {"$inc": {"followers_count": -1}}
-            )
-            await db.users.update_one(
-                {"id": current_user_id},
-                {"$inc": {"following_count": -1}}
-            )
+            counters.incr("users", user_id, "followers_count", -1)
+            counters.incr("users", current_user_id, "following_count", -1)
+            await feed_cache.invalidate([current_user_id])
+            background_tasks.add_task(timelines.prune_author, db, current_user_id, user_id)
+            background_tasks.add_task(suggestions.mark_dirty, db, [current_user_id])
         
         return {"message": "Désabonnement réussi"}
     
@@ -278,108 +311,196 @@ async def get_follow_status(user_id: str, current_user_id: str = Depends(get_cur
 
 # ==================== LISTES ABONNÉS/ABONNEMENTS ====================
 
+async def get_follow_count(user_id: str, field: str) -> int:
+    """Compteur maintenu (users.followers_count / following_count) + deltas pas encore écrits"""
+    user = await db.users.find_one({"id": user_id}, {field: 1, "_id": 0})
+    count = (user or {}).get(field, 0) + counters.buffer.pending_delta("users", user_id, field)
+    return max(count, 0)
+
+async def get_follow_page(
+    edge_query: dict,
+    other_key: str,
+    user_id: str,
+    count_field: str,
+    response: Response,
+    limit: int,
+    before: Optional[str]
+):
+    """Page d'abonnements (keyset) + cartes des comptes en une requête $in + compteur maintenu"""
+    edges, next_cursor = await fetch_page(db.follows, edge_query, limit=limit, before=before)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    
+    other_ids = [edge.get(other_key) for edge in edges]
+    cards = await user_cards.cache.get_many(db, other_ids)
+    count = await get_follow_count(user_id, count_field)
+    return [user_cards.public_card(cards[other_id]) for other_id in other_ids if other_id in cards], count
+
 @follow_router.get("/users/{user_id}/followers")
-async def get_followers(user_id: str, current_user_id: str = Depends(get_current_user)):
+async def get_followers(
+    user_id: str,
+    response: Response,
+    limit: int = 50,
+    before: Optional[str] = None,
+    current_user_id: str = Depends(get_current_user)
+):
     """
-    Liste des abonnés d'un utilisateur
-    GET /api/users/{user_id}/followers
+    Liste des abonnés d'un utilisateur (paginée, curseur suivant dans X-Next-Cursor)
+    GET /api/users/{user_id}/followers?limit=&before=
     """
     # Vérifier autorisation
     if not await can_view_profile(current_user_id, user_id):
         raise HTTPException(status_code=403, detail="Compte privé - abonnement requis")
     
-    # Récupérer les abonnés
-    followers_list = []
-    async for follow in db.follows.find({"followed_id": user_id, "status": "following"}):
-        follower = await db.users.find_one({"id": follow["follower_id"]})
-        if follower:
-            # Vérifier si suit en retour
-            is_following_back = await db.follows.find_one({
-                "follower_id": current_user_id,
-                "followed_id": follower["id"],
-                "status": "following"
-            }) is not None
-            
-            followers_list.append({
-                "id": follower["id"],
-                "username": follower["username"],
-                "profile_pic": follower.get("profile_pic"),
-                "is_following_back": is_following_back
-            })
+    cards, count = await get_follow_page(
+        {"followed_id": user_id},
+        "follower_id", user_id, "followers_count", response, limit, before
+    )
+    
+    # Suivi en retour : intersection avec les abonnements du lecteur (un seul ensemble)
+    viewer_following = await follow_graph.graph.following(db, current_user_id)
+    followers_list = [
+        {**card, "is_following_back": card["id"] in viewer_following}
+        for card in cards
+    ]
     
     return {
         "followers": followers_list,
-        "count": len(followers_list)
+        "count": count
     }
 
 @follow_router.get("/users/{user_id}/following")
-async def get_following(user_id: str, current_user_id: str = Depends(get_current_user)):
+async def get_following(
+    user_id: str,
+    response: Response,
+    limit: int = 50,
+    before: Optional[str] = None,
+    current_user_id: str = Depends(get_current_user)
+):
     """
-    Liste des abonnements d'un utilisateur
-    GET /api/users/{user_id}/following
+    Liste des abonnements d'un utilisateur (paginée, curseur suivant dans X-Next-Cursor)
+    GET /api/users/{user_id}/following?limit=&before=
     """
     # Vérifier autorisation
     if not await can_view_profile(current_user_id, user_id):
         raise HTTPException(status_code=403, detail="Compte privé - abonnement requis")
     
-    # Récupérer les abonnements
-    following_list = []
-    async for follow in db.follows.find({"follower_id": user_id, "status": "following"}):
-        followed_user = await db.users.find_one({"id": follow["followed_id"]})
-        if followed_user:
-            # Vérifier si suit en retour
-            follows_back = await db.follows.find_one({
-                "follower_id": followed_user["id"],
-                "followed_id": current_user_id,
-                "status": "following"
-            }) is not None
-            
-            following_list.append({
-                "id": followed_user["id"],
-                "username": followed_user["username"],
-                "profile_pic": followed_user.get("profile_pic"),
-                "follows_back": follows_back
-            })
+    cards, count = await get_follow_page(
+        {"follower_id": user_id},
+        "followed_id", user_id, "following_count", response, limit, before
+    )
+    
+    # Abonnés du lecteur parmi la page : un seul ensemble
+    viewer_followers = await follow_graph.graph.followers(db, current_user_id)
+    following_list = [
+        {**card, "follows_back": card["id"] in viewer_followers}
+        for card in cards
+    ]
     
     return {
         "following": following_list,
-        "count": len(following_list)
+        "count": count
     }
 
 # ==================== DEMANDES D'ABONNEMENT ====================
 
+async def accept_requests(requests: List[dict], background_tasks: BackgroundTasks) -> int:
+    """
+    Accepte des demandes d'un même compte : un bulk_write sur follows, un delete_many sur
+    follow_requests, deltas de compteurs cumulés. Retourne le nombre d'abonnements créés
+    (une demande dont l'abonnement existe déjà est seulement retirée).
+    """
+    if not requests:
+        return 0
+    now = datetime.now(timezone.utc).isoformat()
+    inserts = [
+        InsertOne({
+            "id": f"follow_{r['follower_id']}_{r['followed_id']}",
+            "follower_id": r["follower_id"],
+            "followed_id": r["followed_id"],
+            "status": "following",
+            "created_at": now
+        })
+        for r in requests
+    ]
+    failed, duplicates = set(), set()
+    error = None
+    try:
+        await db.follows.bulk_write(inserts, ordered=False)
+    except BulkWriteError as e:
+        # Écriture non ordonnée : seules les insertions en erreur ont échoué
+        errors = e.details.get("writeErrors", [])
+        failed = {err["index"] for err in errors}
+        # Doublons (index unique) : déjà abonné ; toute autre erreur remonte une fois
+        # les insertions réussies prises en compte (leur demande reste en attente)
+        duplicates = {err["index"] for err in errors if err.get("code") == 11000}
+        if failed - duplicates:
+            error = e
+    
+    settled = [r for i, r in enumerate(requests) if i not in failed or i in duplicates]
+    if settled:
+        await db.follow_requests.delete_many({"id": {"$in": [r["id"] for r in settled]}})
+    
+    accepted = [r for i, r in enumerate(requests) if i not in failed]
+    if accepted:
+        followed_id = accepted[0]["followed_id"]
+        follower_ids = [r["follower_id"] for r in accepted]
+        for follower_id in follower_ids:
+            follow_graph.graph.add_edge(follower_id, followed_id)
+            counters.incr("users", follower_id, "following_count", 1)
+        counters.incr("users", followed_id, "followers_count", len(accepted))
+        await feed_cache.invalidate(follower_ids)
+        if error is None:
+            for follower_id in follower_ids:
+                background_tasks.add_task(timelines.backfill_author, db, follower_id, followed_id)
+            background_tasks.add_task(suggestions.mark_dirty, db, follower_ids)
+        else:
+            # La réponse sera une erreur : les tâches de fond ne seraient pas exécutées
+            for follower_id in follower_ids:
+                await timelines.backfill_author(db, follower_id, followed_id)
+            await suggestions.mark_dirty(db, follower_ids)
+    if error is not None:
+        raise error
+    return len(accepted)
+
 @follow_router.get("/follow-requests")
-async def get_follow_requests(current_user_id: str = Depends(get_current_user)):
+async def get_follow_requests(
+    response: Response,
+    limit: int = 50,
+    before: Optional[str] = None,
+    current_user_id: str = Depends(get_current_user)
+):
     """
-    Liste des demandes d'abonnement reçues
-    GET /api/follow-requests
+    Liste des demandes d'abonnement reçues (paginée, curseur suivant dans X-Next-Cursor)
+    GET /api/follow-requests?limit=&before=
     """
-    requests_list = []
+    query = {"followed_id": current_user_id, "status": "pending"}
+    requests_raw, next_cursor = await fetch_page(db.follow_requests, query, limit=limit, before=before)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     
-    async for request in db.follow_requests.find({
-        "followed_id": current_user_id,
-        "status": "pending"
-    }).sort("created_at", -1):
-        
-        follower = await db.users.find_one({"id": request["follower_id"]})
-        if follower:
-            requests_list.append({
-                "id": request["id"],
-                "user": {
-                    "id": follower["id"],
-                    "username": follower["username"],
-                    "profile_pic": follower.get("profile_pic")
-                },
-                "created_at": request["created_at"]
-            })
+    # Cartes des demandeurs en une requête $in (cache)
+    cards = await user_cards.cache.get_many(db, [r["follower_id"] for r in requests_raw])
+    requests_list = [
+        {
+            "id": request["id"],
+            "user": user_cards.public_card(cards[request["follower_id"]]),
+            "created_at": request["created_at"]
+        }
+        for request in requests_raw if request["follower_id"] in cards
+    ]
     
     return {
         "requests": requests_list,
-        "count": len(requests_list)
+        "count": await db.follow_requests.count_documents(query)
     }
 
 @follow_router.post("/follow-requests/{request_id}/accept")
-async def accept_follow_request(request_id: str, current_user_id: str = Depends(get_current_user)):
+async def accept_follow_request(
+    request_id: str,
+    background_tasks: BackgroundTasks,
+    current_user_id: str = Depends(get_current_user)
+):
     """
     Accepter une demande d'abonnement
     POST /api/follow-requests/{request_id}/accept
@@ -394,27 +515,7 @@ async def accept_follow_request(request_id: str, current_user_id: str = Depends(
     if not request:
         raise HTTPException(status_code=404, detail="Demande introuvable")
     
-    # Créer l'abonnement
-    await db.follows.insert_one({
-        "id": f"follow_{request['follower_id']}_{request['followed_id']}",
-        "follower_id": request["follower_id"],
-        "followed_id": request["followed_id"],
-        "status": "following",
-        "created_at": datetime.now(timezone.utc).isoformat()
-    })
-    
-    # Supprimer la demande
-    await db.follow_requests.delete_one({"id": request_id})
-    
-    # Incrémenter compteurs
-    await db.users.update_one(
-        {"id": request["followed_id"]},
-        {"$inc": {"followers_count": 1}}
-    )
-    await db.users.update_one(
-        {"id": request["follower_id"]},
-        {"$inc": {"following_count": 1}}
-    )
+    await accept_requests([request], background_tasks)
     
     return {"message": "Demande acceptée"}
 
@@ -435,6 +536,35 @@ async def reject_follow_request(request_id: str, current_user_id: str = Depends(
     
     return {"message": "Demande refusée"}
 
+@follow_router.post("/follow-requests/bulk")
+async def bulk_follow_requests(
+    action: BulkRequestAction,
+    background_tasks: BackgroundTasks,
+    current_user_id: str = Depends(get_current_user)
+):
+    """
+    Accepter / refuser plusieurs demandes en une fois
+    POST /api/follow-requests/bulk  {"action": "accept" | "reject", "request_ids": [...]}
+    """
+    request_ids = list(dict.fromkeys(action.request_ids))
+    if len(request_ids) > MAX_BULK_REQUESTS:
+        raise HTTPException(status_code=400, detail=f"{MAX_BULK_REQUESTS} demandes maximum par lot")
+    
+    query = {"id": {"$in": request_ids}, "followed_id": current_user_id, "status": "pending"}
+    requests_raw = await db.follow_requests.find(query).to_list(length=len(request_ids))
+    found = {r["id"] for r in requests_raw}
+    
+    if action.action == "accept":
+        await accept_requests(requests_raw, background_tasks)
+    elif requests_raw:
+        await db.follow_requests.delete_many({"id": {"$in": list(found)}})
+    
+    return {
+        "action": action.action,
+        "processed": len(found),
+        "not_found": [request_id for request_id in request_ids if request_id not in found]
+    }
+
 # ==================== STATISTIQUES ====================
 
 @follow_router.get("/users/{user_id}/stats")
@@ -442,27 +572,17 @@ async def get_user_stats(user_id: str, current_user_id: str = Depends(get_curren
     """
     Statistiques publiques d'un utilisateur
     GET /api/users/{user_id}/stats
+    Compteurs maintenus du document utilisateur (+ deltas pas encore écrits),
+    corrigés périodiquement par reconcile_counters.py
     """
-    # Compter abonnés
-    followers_count = await db.follows.count_documents({
-        "followed_id": user_id,
-        "status": "following"
-    })
-    
-    # Compter abonnements
-    following_count = await db.follows.count_documents({
-        "follower_id": user_id,
-        "status": "following"
-    })
-    
-    # Compter posts (non supprimés)
-    posts_count = await db.posts.count_documents({
-        "author_id": user_id,
-        "deleted_at": None
-    })
+    stats_fields = ("followers_count", "following_count", "posts_count")
+    user = await db.users.find_one({"id": user_id}, {"id": 1, **{f: 1 for f in stats_fields}, "_id": 0})
+    if not user:
+        user = {"id": user_id}
+    counters.merge("users", [user], *stats_fields)
     
     return {
-        "followers": followers_count,
-        "following": following_count,
-        "posts": posts_count
+        "followers": max(user.get("followers_count", 0), 0),
+        "following": max(user.get("following_count", 0), 0),
+        "posts": max(user.get("posts_count", 0), 0)
     }
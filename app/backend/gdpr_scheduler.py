@@ -8,6 +8,17 @@ from motor.motor_asyncio import AsyncIOMotorClient
 import os
 from dotenv import load_dotenv
 
+try:
+    import backend.blob_store as blob_store
+    import backend.post_search as post_search
+    import backend.follow_graph as follow_graph
+    import backend.reconcile_counters as reconcile_counters
+except ImportError:
+    import blob_store
+    import post_search
+    import follow_graph
+    import reconcile_counters
+
 # Charger les variables d'environnement
 load_dotenv()
 
@@ -32,6 +43,22 @@ privacy_settings_collection = db["privacy_settings"]
 
 # ==================== TÂCHES AUTOMATIQUES ====================
 
+async def delete_posts(query: dict):
+    """Supprime des posts en les journalisant pour les index de recherche des serveurs,
+    en décrémentant users.posts_count de leurs auteurs et en effaçant leurs médias orphelins"""
+    post_ids = await posts_collection.distinct("id", query)
+    media = await blob_store.referenced_by(db, "posts", query)
+    await post_search.record_deletions(db, post_ids)
+    per_author = await posts_collection.aggregate([
+        {"$match": query},
+        {"$group": {"_id": "$author_id", "n": {"$sum": 1}}}
+    ]).to_list(length=None)
+    result = await posts_collection.delete_many(query)
+    for author in per_author:
+        await users_collection.update_one({"id": author["_id"]}, {"$inc": {"posts_count": -author["n"]}})
+    await blob_store.release(db, media)
+    return result
+
 async def auto_delete_scheduled_accounts():
     """Supprime automatiquement les comptes dont le délai de 30 jours est expiré"""
     
@@ -61,10 +88,10 @@ async def auto_delete_scheduled_accounts():
                 print(f"   🔄 Suppression du compte {user_id}...")
                 
                 # Supprimer toutes les données utilisateur
-                await posts_collection.delete_many({"author_id": user_id})
+                await delete_posts({"author_id": user_id})
                 await comments_collection.delete_many({"author_id": user_id})
                 await likes_collection.delete_many({"user_id": user_id})
-                await follows_collection.delete_many({"$or": [{"follower_id": user_id}, {"following_id": user_id}]})
+                await follow_graph.delete_user_edges(db, user_id)
                 
                 if "messages" in await db.list_collection_names():
                     await messages_collection.delete_many({"$or": [{"sender_id": user_id}, {"recipient_id": user_id}]})
@@ -75,8 +102,14 @@ async def auto_delete_scheduled_accounts():
                     {"$set": {"user_id": "DELETED_USER", "anonymized": True}}
                 )
                 
-                # Supprimer l'utilisateur
+                # Stories de l'utilisateur
+                story_media = await blob_store.referenced_by(db, "stories", {"author_id": user_id})
+                await db.stories.delete_many({"author_id": user_id})
+                
+                # Supprimer l'utilisateur (puis ses médias qui ne servent plus)
+                avatar = await blob_store.referenced_by(db, "users", {"id": user_id})
                 await users_collection.delete_one({"id": user_id})
+                await blob_store.release(db, story_media + avatar)
                 
                 # Marquer la demande comme complétée
                 await deletion_requests_collection.update_one(
@@ -129,7 +162,7 @@ async def auto_delete_old_data():
                 user_id = setting["user_id"]
                 
                 # Supprimer les anciennes publications
-                posts_result = await posts_collection.delete_many({
+                posts_result = await delete_posts({
                     "author_id": user_id,
                     "created_at": {"$lt": cutoff_date}
                 })
@@ -168,10 +201,11 @@ async def clean_expired_stories():
         
         now = datetime.now(timezone.utc).isoformat()
         
-        # Supprimer les stories expirées
-        result = await db.stories.delete_many({
-            "expires_at": {"$lt": now}
-        })
+        # Supprimer les stories expirées (puis leurs médias qui ne servent plus)
+        expired = {"expires_at": {"$lt": now}}
+        media = await blob_store.referenced_by(db, "stories", expired)
+        result = await db.stories.delete_many(expired)
+        await blob_store.release(db, media)
         
         if result.deleted_count > 0:
             print(f"✅ {result.deleted_count} story/stories expirée(s) supprimée(s)")
@@ -243,6 +277,12 @@ def schedule_gdpr_tasks():
     )
     print("⏰ Nettoyage logs programmé : Tous les jours à 4h00")
     
+    # Tous les jours à 5h : recomptage des compteurs d'utilisateurs
+    schedule.every().day.at("05:00").do(
+        lambda: asyncio.run(reconcile_counters.reconcile_users(db))
+    )
+    print("⏰ Réconciliation compteurs programmée : Tous les jours à 5h00")
+    
     print("="*60)
     print("✅ Scheduler configuré avec succès !")
     print("="*60 + "\n")
@@ -0,0 +1,79 @@
+"""
+hydration.py - Hydratation par lot de l'état propre au lecteur
+Remplit is_liked / has_viewed pour une page entière en une seule requête $in
+au lieu d'un find_one par élément, ainsi que la carte de l'auteur (user_cards).
+"""
+
+from typing import Iterable, List, Set
+import asyncio
+
+try:
+    import backend.user_cards as user_cards
+    import backend.counters as counters
+except ImportError:
+    import user_cards
+    import counters
+
+
+async def _matching_ids(collection, key: str, ids: Iterable[str], user_id: str) -> Set[str]:
+    """Retourne le sous-ensemble de `ids` pour lequel user_id a un document dans `collection`"""
+    ids = [i for i in set(ids) if i]
+    if not ids or not user_id:
+        return set()
+
+    cursor = collection.find(
+        {key: {"$in": ids}, "user_id": user_id},
+        {key: 1, "_id": 0}
+    )
+    return {doc[key] async for doc in cursor if key in doc}
+
+
+async def get_liked_post_ids(db, user_id: str, post_ids: Iterable[str]) -> Set[str]:
+    """IDs des posts likés par user_id parmi post_ids (1 requête)"""
+    return await _matching_ids(db.likes, "post_id", post_ids, user_id)
+
+
+async def get_liked_comment_ids(db, user_id: str, comment_ids: Iterable[str]) -> Set[str]:
+    """IDs des commentaires likés par user_id parmi comment_ids (1 requête)"""
+    return await _matching_ids(db.comment_likes, "comment_id", comment_ids, user_id)
+
+
+async def get_viewed_story_ids(db, user_id: str, story_ids: Iterable[str]) -> Set[str]:
+    """IDs des stories vues par user_id parmi story_ids (1 requête)"""
+    return await _matching_ids(db.story_views, "story_id", story_ids, user_id)
+
+
+async def hydrate_posts(db, posts: List[dict], user_id: str) -> List[dict]:
+    """Ajoute is_liked et la carte de l'auteur à chaque post (dicts déjà convertis)"""
+    liked, _ = await asyncio.gather(
+        get_liked_post_ids(db, user_id, (p.get("id") for p in posts)),
+        user_cards.attach_cards(db, posts, "author")
+    )
+    for post in posts:
+        post["is_liked"] = post.get("id") in liked
+    counters.merge("posts", posts, "likes_count", "comments_count")
+    return posts
+
+
+async def hydrate_comments(db, comments: List[dict], user_id: str) -> List[dict]:
+    """Ajoute is_liked et la carte de l'auteur à chaque commentaire / réponse"""
+    liked, _ = await asyncio.gather(
+        get_liked_comment_ids(db, user_id, (c.get("id") for c in comments)),
+        user_cards.attach_cards(db, comments, "author")
+    )
+    for comment in comments:
+        comment["is_liked"] = comment.get("id") in liked
+    counters.merge("comments", comments, "likes_count", "replies_count")
+    return comments
+
+
+async def hydrate_stories(db, stories: List[dict], user_id: str) -> List[dict]:
+    """Ajoute has_viewed et la carte de l'auteur à chaque story"""
+    viewed, _ = await asyncio.gather(
+        get_viewed_story_ids(db, user_id, (s.get("id") for s in stories)),
+        user_cards.attach_cards(db, stories, "author")
+    )
+    for story in stories:
+        story["has_viewed"] = story.get("id") in viewed
+    counters.merge("stories", stories, "views_count")
+    return stories
@@ -0,0 +1,118 @@
+"""
+likes.py - Like / unlike atomique (posts et commentaires)
+- Index unique (cible, user_id) : un double-clic ne peut pas créer deux likes
+- Aller-retour 1 : upsert du like, en parallèle de la lecture de la cible
+- Aller-retour 2 : notification / cache (like) ou suppression (unlike)
+- Le compteur ne bouge que si le like a réellement été créé / supprimé (counters.py)
+"""
+
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, List, NamedTuple, Optional
+import asyncio
+import uuid
+
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+try:
+    import backend.counters as counters
+except ImportError:
+    import counters
+
+# Type de like → (collection des likes, champ cible, collection cible)
+LIKE_KINDS = {
+    "post": ("likes", "post_id", "posts"),
+    "comment": ("comment_likes", "comment_id", "comments"),
+}
+
+
+class LikeToggle(NamedTuple):
+    liked: bool      # état final pour l'utilisateur
+    changed: bool    # False si une requête concurrente avait déjà fait le changement
+    target: dict     # cible (id, author_id)
+
+
+# Effets à lancer avec la mise à jour du compteur : (cible, liked) → awaitables
+SideEffects = Callable[[dict, bool], List[Awaitable]]
+
+
+async def _upsert_like(likes, key: str, target_id: str, user_id: str):
+    """Insère le like s'il n'existe pas ; retourne True si inséré"""
+    try:
+        result = await likes.update_one(
+            {key: target_id, "user_id": user_id},
+            {"$setOnInsert": {
+                "id": str(uuid.uuid4()),
+                key: target_id,
+                "user_id": user_id,
+                "created_at": datetime.now(timezone.utc).isoformat()
+            }},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        return False  # upsert concurrent : le like existe déjà
+    return result.upserted_id is not None
+
+
+async def toggle_like(
+    db,
+    kind: str,
+    target_id: str,
+    user_id: str,
+    side_effects: Optional[SideEffects] = None
+) -> Optional[LikeToggle]:
+    """Like si absent, unlike sinon. None si la cible n'existe pas."""
+    likes_name, key, targets_name = LIKE_KINDS[kind]
+    likes, targets = db[likes_name], db[targets_name]
+    like_filter = {key: target_id, "user_id": user_id}
+
+    target, inserted = await asyncio.gather(
+        targets.find_one({"id": target_id}, {"id": 1, "author_id": 1, "_id": 0}),
+        _upsert_like(likes, key, target_id, user_id)
+    )
+
+    if target is None:
+        if inserted:
+            await likes.delete_one(like_filter)  # cible supprimée : pas de like orphelin
+        return None
+
+    if inserted:
+        # Le compteur ne bouge que si l'upsert a réellement créé le like
+        counters.incr(targets_name, target_id, "likes_count", 1)
+        if side_effects:
+            await asyncio.gather(*side_effects(target, True))
+        return LikeToggle(liked=True, changed=True, target=target)
+
+    # Like déjà présent : unlike (si une requête concurrente l'a supprimé avant nous, rien ne change)
+    deleted, *_ = await asyncio.gather(
+        likes.delete_one(like_filter),
+        *(side_effects(target, False) if side_effects else [])
+    )
+    if deleted.deleted_count == 0:
+        return LikeToggle(liked=False, changed=False, target=target)
+    counters.incr(targets_name, target_id, "likes_count", -1)
+    return LikeToggle(liked=False, changed=True, target=target)
+
+
+async def _dedupe(collection, key: str):
+    """Supprime les doublons (cible, user_id) hérités d'avant l'index unique"""
+    pipeline = [
+        {"$group": {"_id": {"t": f"${key}", "u": "$user_id"}, "ids": {"$push": "$_id"}, "n": {"$sum": 1}}},
+        {"$match": {"n": {"$gt": 1}}}
+    ]
+    removed = 0
+    async for group in collection.aggregate(pipeline, allowDiskUse=True):
+        result = await collection.delete_many({"_id": {"$in": group["ids"][1:]}})
+        removed += result.deleted_count
+    return removed
+
+
+async def ensure_indexes(db):
+    """Index uniques des likes (dédoublonne une fois si nécessaire)"""
+    for likes_name, key, _ in LIKE_KINDS.values():
+        collection = db[likes_name]
+        try:
+            await collection.create_index([(key, 1), ("user_id", 1)], unique=True)
+        except (DuplicateKeyError, OperationFailure):
+            removed = await _dedupe(collection, key)
+            print(f"⚠️ Removed {removed} duplicate {likes_name} before creating the unique index")
+            await collection.create_index([(key, 1), ("user_id", 1)], unique=True)
@@ -0,0 +1,158 @@
+# app/backend/migrate_follows.py - Normalise la collection `follows` (une seule forme d'abonnement)
+#
+# Usage : python migrate_follows.py
+# 1. Réécrit les anciens abonnements : following_id → followed_id, status / id / created_at manquants
+#    complétés ; les documents inexploitables (sans suiveur, sans cible, auto-abonnement) sont retirés
+# 2. Supprime les doublons (follower_id, followed_id) en gardant le plus ancien
+# 3. Crée l'index unique (follower_id, followed_id) et les index inverses (follow_graph.py)
+#
+# Parcours par _id croissant, par lots de MIGRATION_BATCH_SIZE avec une pause de
+# MIGRATION_PAUSE_SECONDS entre deux lots (charge bornée sur la base en production).
+# La progression est enregistrée dans `migrations` : une exécution interrompue reprend
+# au dernier lot écrit ; relançable sans risque.
+
+import asyncio
+import os
+import uuid
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import DeleteOne, UpdateOne
+
+try:
+    import backend.follow_graph as follow_graph
+except ImportError:
+    import follow_graph
+
+# Charger les variables d'environnement
+load_dotenv()
+
+# Configuration MongoDB
+MONGODB_URL = os.environ.get('MONGODB_URI') or os.environ.get('MONGO_URL') or os.environ.get('DATABASE_URL')
+DATABASE_NAME = os.environ.get('DB_NAME', 'nexus_social')
+
+BATCH_SIZE = int(os.environ.get("MIGRATION_BATCH_SIZE", 500))
+PAUSE_SECONDS = float(os.environ.get("MIGRATION_PAUSE_SECONDS", 0.2))
+
+MIGRATION_ID = "follows_canonical"
+
+# Documents qui ne sont pas encore dans la forme canonique
+LEGACY_QUERY = {
+    "$or": [
+        {"following_id": {"$exists": True}},
+        {"followed_id": {"$exists": False}},
+        {"status": {"$exists": False}},
+        {"id": {"$exists": False}},
+        {"created_at": {"$exists": False}},
+    ]
+}
+
+
+def canonical_update(doc: dict):
+    """Opération ramenant un abonnement à la forme canonique (None si déjà canonique)"""
+    follower_id = doc.get("follower_id")
+    followed_id = doc.get("followed_id") or doc.get("following_id")
+    if not follower_id or not followed_id or follower_id == followed_id:
+        return DeleteOne({"_id": doc["_id"]})
+
+    changes = {}
+    if doc.get("followed_id") != followed_id:
+        changes["followed_id"] = followed_id
+    if not doc.get("status"):
+        changes["status"] = "following"
+    if not doc.get("id"):
+        changes["id"] = str(uuid.uuid4())
+    if not doc.get("created_at"):
+        # Date d'insertion d'après l'ObjectId
+        changes["created_at"] = doc["_id"].generation_time.isoformat()
+
+    update = {}
+    if changes:
+        update["$set"] = changes
+    if "following_id" in doc:
+        update["$unset"] = {"following_id": ""}
+    return UpdateOne({"_id": doc["_id"]}, update) if update else None
+
+
+async def save_progress(db, phase: str, last_id=None):
+    await db.migrations.update_one(
+        {"_id": MIGRATION_ID},
+        {"$set": {"phase": phase, "last_id": last_id}},
+        upsert=True
+    )
+
+
+async def normalize(db, last_id=None) -> dict:
+    """Phase 1 : réécrit les anciens documents, lot par lot, en reprenant après last_id"""
+    stats = {"updated": 0, "deleted": 0}
+    while True:
+        query = LEGACY_QUERY if last_id is None else {"$and": [{"_id": {"$gt": last_id}}, LEGACY_QUERY]}
+        docs = await db.follows.find(query).sort("_id", 1).limit(BATCH_SIZE).to_list(length=BATCH_SIZE)
+        if not docs:
+            return stats
+
+        ops = [op for op in (canonical_update(doc) for doc in docs) if op is not None]
+        if ops:
+            await db.follows.bulk_write(ops, ordered=False)
+            stats["deleted"] += sum(isinstance(op, DeleteOne) for op in ops)
+            stats["updated"] += sum(isinstance(op, UpdateOne) for op in ops)
+
+        last_id = docs[-1]["_id"]
+        await save_progress(db, "normalize", last_id)
+        await asyncio.sleep(PAUSE_SECONDS)
+
+
+async def deduplicate(db) -> int:
+    """Phase 2 : un seul document par paire (follower_id, followed_id), le plus ancien"""
+    pipeline = [
+        {"$sort": {"created_at": 1, "_id": 1}},
+        {"$group": {
+            "_id": {"follower_id": "$follower_id", "followed_id": "$followed_id"},
+            "ids": {"$push": "$_id"},
+            "count": {"$sum": 1},
+        }},
+        {"$match": {"count": {"$gt": 1}}},
+    ]
+    extra = []
+    async for group in db.follows.aggregate(pipeline, allowDiskUse=True):
+        extra.extend(group["ids"][1:])
+
+    deleted = 0
+    for start in range(0, len(extra), BATCH_SIZE):
+        result = await db.follows.delete_many({"_id": {"$in": extra[start:start + BATCH_SIZE]}})
+        deleted += result.deleted_count
+        await asyncio.sleep(PAUSE_SECONDS)
+    return deleted
+
+
+async def migrate_all(db):
+    progress = await db.migrations.find_one({"_id": MIGRATION_ID}) or {}
+    phase = progress.get("phase")
+
+    if phase in (None, "normalize", "done"):
+        last_id = progress.get("last_id") if phase == "normalize" else None
+        if last_id is not None:
+            print(f"↩️  Resuming after {last_id}")
+        stats = await normalize(db, last_id)
+        print(f"✅ follows: {stats['updated']} documents rewritten, {stats['deleted']} unusable removed")
+        await save_progress(db, "deduplicate")
+
+    deleted = await deduplicate(db)
+    print(f"✅ follows: {deleted} duplicates removed")
+    await save_progress(db, "indexes")
+
+    await follow_graph.ensure_indexes(db)
+    print("✅ follows: unique (follower_id, followed_id) and reverse indexes ready")
+    await save_progress(db, "done")
+
+
+def main():
+    print("🔗 Normalizing follow edges")
+    client = AsyncIOMotorClient(MONGODB_URL)
+    try:
+        asyncio.run(migrate_all(client[DATABASE_NAME]))
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+# app/backend/migrate_media.py - Migration ponctuelle des médias inline (data URI) vers le blob store
+#
+# Usage : python migrate_media.py [--dry-run]
+# Idempotent : seuls les champs commençant encore par "data:" sont traités ; les anciennes URLs
+# absolues du blob store (http(s)://hôte/api/media/<clé>) sont ramenées à la référence relative.
+
+import asyncio
+import os
+import sys
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+try:
+    import backend.blob_store as blob_store
+except ImportError:
+    import blob_store
+
+# Charger les variables d'environnement
+load_dotenv()
+
+# Configuration MongoDB
+MONGODB_URL = os.environ.get('MONGODB_URI') or os.environ.get('MONGO_URL') or os.environ.get('DATABASE_URL')
+DATABASE_NAME = os.environ.get('DB_NAME', 'nexus_social')
+
+# Documents traités par lot
+BATCH_SIZE = 200
+
+# Collection → champs pouvant contenir un data URI (y compris les copies dénormalisées)
+MEDIA_FIELDS = {
+    "users": ["profile_pic"],
+    "posts": ["media_url", "author_profile_pic"],
+    "stories": ["media_url", "author_profile_pic", "avatar"],
+    "comments": ["author_profile_pic"],
+    "notifications": ["from_profile_pic"],
+    "messages": ["sender_profile_pic"],
+}
+
+
+async def migrate_field(db, collection: str, field: str, dry_run: bool = False) -> dict:
+    """Déplace les data URI d'un champ vers le blob store, par lots"""
+    stats = {"migrated": 0, "invalid": 0}
+    query = {field: {"$regex": "^data:"}}
+    skip_ids = []  # documents invalides, laissés en place
+
+    while True:
+        batch = await db[collection].find(
+            {**query, "_id": {"$nin": skip_ids}}, {field: 1}
+        ).limit(BATCH_SIZE).to_list(length=BATCH_SIZE)
+        if not batch:
+            break
+
+        updates = []
+        for doc in batch:
+            try:
+                content_type, data = blob_store.parse_data_uri(doc[field])
+            except ValueError:
+                stats["invalid"] += 1
+                skip_ids.append(doc["_id"])
+                continue
+            if dry_run:
+                skip_ids.append(doc["_id"])
+            else:
+                url = await blob_store.save_bytes(data, content_type)
+                # Filtre sur l'ancienne valeur : ne pas écraser une mise à jour concurrente
+                updates.append(UpdateOne({"_id": doc["_id"], field: doc[field]}, {"$set": {field: url}}))
+            stats["migrated"] += 1
+
+        if updates:
+            await db[collection].bulk_write(updates, ordered=False)
+
+    return stats
+
+
+# Collection → champs pouvant contenir une ancienne URL absolue du blob store
+REFERENCE_FIELDS = {
+    "users": ["profile_pic"],
+    "posts": ["media_url"],
+    "stories": ["media_url", "thumbnail_url"],
+}
+
+ABSOLUTE_PATTERN = f"^https?://[^/]+{blob_store.MEDIA_ROUTE}/"
+
+
+def relative_reference(url):
+    """URL absolue du blob store → référence relative (autres valeurs inchangées)"""
+    key = blob_store.key_from_url(url)
+    return blob_store.media_url(key) if key else url
+
+
+async def relativize_field(db, collection: str, field: str, dry_run: bool = False) -> int:
+    """Réécrit les URLs absolues d'un champ en références relatives, par lots"""
+    rewritten = 0
+    last_id = None
+    while True:
+        query = {field: {"$regex": ABSOLUTE_PATTERN}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        batch = await db[collection].find(query, {field: 1}).sort("_id", 1).limit(BATCH_SIZE).to_list(length=BATCH_SIZE)
+        if not batch:
+            return rewritten
+        updates = [
+            UpdateOne({"_id": doc["_id"], field: doc[field]}, {"$set": {field: relative_reference(doc[field])}})
+            for doc in batch if relative_reference(doc[field]) != doc[field]
+        ]
+        if updates and not dry_run:
+            await db[collection].bulk_write(updates, ordered=False)
+        rewritten += len(updates)
+        last_id = batch[-1]["_id"]
+
+
+async def relativize_avatar_sizes(db, dry_run: bool = False) -> int:
+    """Même réécriture pour les variantes d'avatar (users.profile_pic_sizes)"""
+    rewritten = 0
+    updates = []
+    async for user in db.users.find({"profile_pic_sizes": {"$type": "object"}}, {"profile_pic_sizes": 1}):
+        sizes = {name: relative_reference(url) for name, url in user["profile_pic_sizes"].items()}
+        if sizes != user["profile_pic_sizes"]:
+            updates.append(UpdateOne({"_id": user["_id"]}, {"$set": {"profile_pic_sizes": sizes}}))
+        if len(updates) >= BATCH_SIZE:
+            if not dry_run:
+                await db.users.bulk_write(updates, ordered=False)
+            rewritten += len(updates)
+            updates = []
+    if updates and not dry_run:
+        await db.users.bulk_write(updates, ordered=False)
+    return rewritten + len(updates)
+
+
+async def migrate_all(db, dry_run: bool = False):
+    for collection, fields in MEDIA_FIELDS.items():
+        for field in fields:
+            stats = await migrate_field(db, collection, field, dry_run)
+            print(f"✅ {collection}.{field}: {stats['migrated']} migrated, {stats['invalid']} invalid")
+
+    for collection, fields in REFERENCE_FIELDS.items():
+        for field in fields:
+            rewritten = await relativize_field(db, collection, field, dry_run)
+            print(f"✅ {collection}.{field}: {rewritten} absolute URLs made relative")
+    rewritten = await relativize_avatar_sizes(db, dry_run)
+    print(f"✅ users.profile_pic_sizes: {rewritten} users made relative")
+
+
+def main():
+    dry_run = "--dry-run" in sys.argv
+    print(f"🚚 Migrating inline media to {blob_store.MEDIA_ROOT}{' (dry run)' if dry_run else ''}")
+    client = AsyncIOMotorClient(MONGODB_URL)
+    try:
+        asyncio.run(migrate_all(client[DATABASE_NAME], dry_run))
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# app/backend/migrate_search.py - Calcule les champs de recherche des documents existants
+#
+# Usage : python migrate_search.py
+# Remplit les champs de recherche des utilisateurs (username_key, name_keys, search_keys) et
+# posts.search_terms (search.py) pour les documents créés avant l'index de recherche ou
+# indexés avant la séparation username / bio ; relançable sans risque.
+
+import asyncio
+import os
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+try:
+    import backend.search as search_engine
+except ImportError:
+    import search as search_engine
+
+# Charger les variables d'environnement
+load_dotenv()
+
+# Configuration MongoDB
+MONGODB_URL = os.environ.get('MONGODB_URI') or os.environ.get('MONGO_URL') or os.environ.get('DATABASE_URL')
+DATABASE_NAME = os.environ.get('DB_NAME', 'nexus_social')
+
+BATCH_SIZE = 500
+
+
+async def backfill(db, collection: str, field: str, projection: dict, compute) -> int:
+    updated = 0
+    batch = []
+    cursor = db[collection].find({field: {"$exists": False}}, projection)
+    async for doc in cursor:
+        batch.append(UpdateOne({"_id": doc["_id"]}, {"$set": compute(doc)}))
+        if len(batch) >= BATCH_SIZE:
+            await db[collection].bulk_write(batch, ordered=False)
+            updated += len(batch)
+            batch = []
+    if batch:
+        await db[collection].bulk_write(batch, ordered=False)
+        updated += len(batch)
+    return updated
+
+
+async def migrate_all(db):
+    users = await backfill(
+        db, "users", "name_keys", {"username": 1, "bio": 1},
+        lambda u: search_engine.user_search_fields(u.get("username"), u.get("bio"))
+    )
+    print(f"✅ users: {users} documents indexed")
+    posts = await backfill(
+        db, "posts", "search_terms", {"content": 1},
+        lambda p: search_engine.post_search_fields(p.get("content"))
+    )
+    print(f"✅ posts: {posts} documents indexed")
+    await search_engine.ensure_indexes(db)
+
+
+def main():
+    print("🔎 Building search fields")
+    client = AsyncIOMotorClient(MONGODB_URL)
+    try:
+        asyncio.run(migrate_all(client[DATABASE_NAME]))
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
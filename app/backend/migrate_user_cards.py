@@ -0,0 +1,63 @@
+# app/backend/migrate_user_cards.py - Retire les copies dénormalisées (username / avatar) des documents
+#
+# Usage : python migrate_user_cards.py
+# Les réponses sont complétées depuis les cartes utilisateur (user_cards.py) ;
+# ces champs ne sont plus écrits et ne servent plus qu'aux comptes supprimés.
+
+import asyncio
+import os
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+try:
+    import backend.user_cards as user_cards
+except ImportError:
+    import user_cards
+
+# Charger les variables d'environnement
+load_dotenv()
+
+# Configuration MongoDB
+MONGODB_URL = os.environ.get('MONGODB_URI') or os.environ.get('MONGO_URL') or os.environ.get('DATABASE_URL')
+DATABASE_NAME = os.environ.get('DB_NAME', 'nexus_social')
+
+# Collection → rôles dont les copies sont retirées
+COLLECTION_ROLES = {
+    "posts": ["author"],
+    "comments": ["author"],
+    "comment_replies": ["author"],
+    "stories": ["author", "user"],
+    "notifications": ["from"],
+    "messages": ["sender", "recipient"],
+}
+
+
+async def strip_collection(db, collection: str, roles) -> int:
+    fields = [
+        field for role in roles
+        for field in user_cards.ROLES[role][1:] if field
+    ]
+    result = await db[collection].update_many(
+        {"$or": [{field: {"$exists": True}} for field in fields]},
+        {"$unset": {field: "" for field in fields}}
+    )
+    return result.modified_count
+
+
+async def migrate_all(db):
+    for collection, roles in COLLECTION_ROLES.items():
+        modified = await strip_collection(db, collection, roles)
+        print(f"✅ {collection}: {modified} documents cleaned")
+
+
+def main():
+    print("🧹 Removing denormalized usernames / avatars")
+    client = AsyncIOMotorClient(MONGODB_URL)
+    try:
+        asyncio.run(migrate_all(client[DATABASE_NAME]))
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
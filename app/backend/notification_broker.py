@@ -0,0 +1,242 @@
+"""
+notification_broker.py - Diffusion des notifications temps réel entre workers (pub/sub)
+Une notification est publiée une fois ; chaque worker est abonné une seule fois et la remet
+aux sockets WebSocket qu'il détient (Notifications.ConnectionManager).
+- LocalBroker : en mémoire, un seul process (tests, développement)
+- MongoBroker : événements insérés dans une collection à TTL et suivis par change stream ;
+  sans replica set (change streams indisponibles), un parcours par numéro de séquence toutes les
+  BROKER_POLL_SECONDS (une requête par worker, quel que soit le nombre d'utilisateurs connectés).
+  Le numéro est attribué par la base ($inc) à la publication : contrairement aux ObjectId générés
+  par chaque process, il est strictement croissant entre workers. Il coûte un aller-retour et
+  sérialise les publications sur un document : il n'est attribué qu'en mode parcours, choisi
+  une fois par worker d'après la topologie de la base (la même pour tous les workers) ou BROKER_MODE.
+"""
+
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, List, Optional
+import asyncio
+import os
+import time
+
+from pymongo import ReturnDocument
+from pymongo.errors import OperationFailure
+
+# Implémentation : "mongo" (plusieurs workers) ou "local" (un seul process)
+NOTIFICATION_BROKER = os.environ.get("NOTIFICATION_BROKER", "mongo")
+
+# Mode de suivi : "auto" (change stream sur un replica set / cluster shardé, sinon parcours),
+# "change_stream" ou "polling"
+BROKER_MODE = os.environ.get("BROKER_MODE", "auto")
+
+# Durée de vie des événements publiés (seuls les abonnés connectés les lisent)
+BROKER_TTL_SECONDS = int(os.environ.get("BROKER_TTL_SECONDS", 300))
+
+# Intervalle du parcours de secours (sans change stream)
+BROKER_POLL_SECONDS = float(os.environ.get("BROKER_POLL_SECONDS", 1.0))
+
+# Attente maximale d'un numéro de séquence manquant (attribué mais pas encore inséré)
+# avant de le considérer comme perdu
+BROKER_GAP_SECONDS = float(os.environ.get("BROKER_GAP_SECONDS", 5.0))
+
+# Attente avant de rouvrir un flux interrompu
+BROKER_RETRY_SECONDS = 2.0
+
+BROKER_COLLECTION = "realtime_events"
+
+# Compteur de séquence des événements (un document par collection d'événements)
+SEQUENCE_COLLECTION = "realtime_sequences"
+
+# Événements lus par requête en mode parcours
+POLL_BATCH_SIZE = 500
+
+Handler = Callable[[str, dict], Awaitable[None]]
+
+
+class NotificationBroker(ABC):
+    """Interface : publier pour un utilisateur, s'abonner à tout ce qui est publié"""
+
+    def __init__(self):
+        self.handlers: List[Handler] = []
+        self.stats = {"published": 0, "received": 0, "handler_errors": 0}
+
+    @abstractmethod
+    async def publish(self, user_id: str, message: dict):
+        """Diffuse `message` à tous les workers abonnés"""
+
+    def subscribe(self, handler: Handler):
+        """À appeler une fois par worker : `handler(user_id, message)` reçoit chaque événement"""
+        self.handlers.append(handler)
+
+    async def close(self):
+        pass
+
+    async def _dispatch(self, user_id: str, message: dict):
+        self.stats["received"] += 1
+        for handler in self.handlers:
+            try:
+                await handler(user_id, message)
+            except Exception as e:
+                self.stats["handler_errors"] += 1
+                print(f"⚠️ Notification handler failed: {e}")
+
+    def snapshot(self) -> dict:
+        data = dict(self.stats)
+        data["broker"] = type(self).__name__
+        return data
+
+
+class LocalBroker(NotificationBroker):
+    """Remplaçant en mémoire : remet directement aux abonnés du process"""
+
+    async def publish(self, user_id: str, message: dict):
+        self.stats["published"] += 1
+        await self._dispatch(user_id, message)
+
+
+class MongoBroker(NotificationBroker):
+    """Événements dans `realtime_events`, suivis par un seul flux par worker"""
+
+    def __init__(self, db, collection: str = BROKER_COLLECTION):
+        super().__init__()
+        self.db = db
+        self.collection = collection
+        self.task: Optional[asyncio.Task] = None
+        self.resume_token = None
+        self.polling = False
+        self.mode_resolved = False
+        self.stopping = False
+        self.indexed = False
+        self.stats["gaps_skipped"] = 0
+
+    async def ensure_indexes(self):
+        await self.db[self.collection].create_index([("created_at", 1)], expireAfterSeconds=BROKER_TTL_SECONDS)
+        await self.db[self.collection].create_index([("seq", 1)])
+        self.indexed = True
+
+    async def _next_seq(self) -> int:
+        counter = await self.db[SEQUENCE_COLLECTION].find_one_and_update(
+            {"_id": self.collection},
+            {"$inc": {"seq": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return counter["seq"]
+
+    async def _resolve_mode(self):
+        """Change stream ou parcours, décidé une fois (avant la première publication / lecture)"""
+        if self.mode_resolved:
+            return
+        self.mode_resolved = True
+        if BROKER_MODE == "polling":
+            self.polling = True
+        elif BROKER_MODE == "auto" and not self.polling:
+            try:
+                hello = await self.db.command("hello")
+                # Change streams : replica set (setName) ou routeur mongos
+                self.polling = "setName" not in hello and hello.get("msg") != "isdbgrid"
+            except Exception:
+                self.polling = True
+            if self.polling:
+                print(f"⚠️ Standalone MongoDB, polling {self.collection}")
+
+    async def publish(self, user_id: str, message: dict):
+        if not self.indexed:
+            await self.ensure_indexes()
+        await self._resolve_mode()
+        event = {
+            "user_id": user_id,
+            "message": message,
+            "created_at": datetime.now(timezone.utc)
+        }
+        if self.polling:
+            # Numéro de séquence lu par les workers en mode parcours uniquement
+            event["seq"] = await self._next_seq()
+        await self.db[self.collection].insert_one(event)
+        self.stats["published"] += 1
+
+    def subscribe(self, handler: Handler):
+        super().subscribe(handler)
+        if self.task is None:
+            self.stopping = False
+            self.task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        await self._resolve_mode()
+        while not self.stopping:
+            try:
+                if self.polling:
+                    await self._poll()
+                else:
+                    await self._watch()
+            except (OperationFailure, NotImplementedError) as e:
+                if not self.polling:
+                    # Change stream refusé malgré la topologie : parcours par numéro de séquence
+                    # (attribué désormais par ce worker ; BROKER_MODE=polling pour tous les workers)
+                    print(f"⚠️ Change streams unavailable ({e}), polling {self.collection}")
+                    self.polling = True
+                    continue
+                print(f"⚠️ Notification broker error: {e}")
+                await asyncio.sleep(BROKER_RETRY_SECONDS)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Notification broker error: {e}")
+                await asyncio.sleep(BROKER_RETRY_SECONDS)
+
+    async def _watch(self):
+        pipeline = [{"$match": {"operationType": "insert"}}]
+        async with self.db[self.collection].watch(pipeline, resume_after=self.resume_token) as stream:
+            async for change in stream:
+                self.resume_token = stream.resume_token
+                event = change["fullDocument"]
+                await self._dispatch(event["user_id"], event["message"])
+
+    async def _poll(self):
+        # Seuls les événements publiés après l'abonnement sont remis
+        latest = await self.db[self.collection].find({"seq": {"$exists": True}}, {"seq": 1}).sort("seq", -1).limit(1).to_list(length=1)
+        last_seq = latest[0]["seq"] if latest else 0
+        gap_since = None
+        while not self.stopping:
+            events = await self.db[self.collection].find(
+                {"seq": {"$gt": last_seq}}
+            ).sort("seq", 1).limit(POLL_BATCH_SIZE).to_list(length=POLL_BATCH_SIZE)
+            caught_up = len(events) < POLL_BATCH_SIZE
+            for event in events:
+                if event["seq"] != last_seq + 1:
+                    # Numéro attribué à une publication pas encore insérée : on l'attend,
+                    # au plus BROKER_GAP_SECONDS (publication abandonnée)
+                    now = time.monotonic()
+                    if gap_since is None:
+                        gap_since = now
+                    if now - gap_since < BROKER_GAP_SECONDS:
+                        caught_up = True
+                        break
+                    self.stats["gaps_skipped"] += 1
+                gap_since = None
+                last_seq = event["seq"]
+                await self._dispatch(event["user_id"], event["message"])
+            if caught_up:
+                await asyncio.sleep(BROKER_POLL_SECONDS)
+
+    async def close(self):
+        if self.task is not None:
+            self.stopping = True
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def snapshot(self) -> dict:
+        data = super().snapshot()
+        data["mode"] = "polling" if self.polling else "change_stream"
+        return data
+
+
+def create_broker(db) -> NotificationBroker:
+    """Broker choisi par NOTIFICATION_BROKER"""
+    if NOTIFICATION_BROKER == "local":
+        return LocalBroker()
+    return MongoBroker(db)
@@ -0,0 +1,93 @@
+"""
+pagination.py - Pagination par curseur (keyset) sur (created_at, id)
+Chaque page = un seul parcours d'index, sans skip ni relecture des pages précédentes.
+"""
+
+from fastapi import HTTPException
+from typing import List, Optional, Tuple
+import base64
+import json
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+
+# En-tête de réponse portant le curseur de la page suivante
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(doc: dict) -> str:
+    """Curseur opaque à partir d'un document (created_at, id)"""
+    raw = json.dumps([doc["created_at"], doc["id"]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    """Décode un curseur opaque → (created_at, id)"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, doc_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(created_at, str) or not isinstance(doc_id, str):
+            raise ValueError
+        return created_at, doc_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def clamp_limit(limit: Optional[int]) -> int:
+    """Borne la taille de page demandée"""
+    if not limit or limit < 1:
+        return DEFAULT_PAGE_SIZE
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def keyset_filter(cursor: str, older: bool) -> dict:
+    """Filtre strictement avant (older=True) ou après le curseur, départage par id"""
+    created_at, doc_id = decode_cursor(cursor)
+    op = "$lt" if older else "$gt"
+    return {
+        "$or": [
+            {"created_at": {op: created_at}},
+            {"created_at": created_at, "id": {op: doc_id}}
+        ]
+    }
+
+
+async def fetch_page(
+    collection,
+    query: dict,
+    limit: Optional[int] = None,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    oldest_first: bool = False
+) -> Tuple[List[dict], Optional[str]]:
+    """
+    Récupère une page triée du plus récent au plus ancien.
+    - before : éléments plus anciens que le curseur (défilement infini)
+    - after  : éléments plus récents que le curseur (rafraîchissement)
+    - oldest_first : ordre chronologique (fils de réponses), poursuivi avec `after`
+    Retourne (documents, next_cursor) ; next_cursor est None en fin de liste.
+    """
+    if before and after:
+        raise HTTPException(status_code=400, detail="Use either 'before' or 'after', not both")
+    if before and oldest_first:
+        raise HTTPException(status_code=400, detail="Use 'after' to continue a chronological list")
+
+    limit = clamp_limit(limit)
+    newer = bool(after) or oldest_first
+
+    if before or after:
+        query = {"$and": [query, keyset_filter(before or after, older=not newer)]}
+
+    direction = 1 if newer else -1
+    docs = await collection.find(query).sort(
+        [("created_at", direction), ("id", direction)]
+    ).limit(limit + 1).to_list(length=limit + 1)
+
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+    next_cursor = encode_cursor(docs[-1]) if has_more and docs else None
+
+    if newer and not oldest_first:
+        docs.reverse()
+
+    return docs, next_cursor
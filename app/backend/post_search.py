@@ -0,0 +1,508 @@
+"""
+post_search.py - Recherche plein texte des posts (BM25, index inversé en mémoire par worker)
+- Postings compacts : une base CSR NumPy (offsets / documents / fréquences) + les ajouts récents
+  en tableaux `array`, fusionnés périodiquement hors de la boucle d'événements
+- Indexation incrémentale à la création / suppression ; les autres workers et le scheduler RGPD
+  sont rattrapés toutes les POST_SEARCH_SYNC_SECONDS (nouveaux posts + journal `post_deletions`)
+- Instantané sur disque rechargé au démarrage, puis rattrapage depuis son horodatage
+- Les résultats sont relus dans MongoDB : posts supprimés écartés, auteurs privés filtrés
+"""
+
+from array import array
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from starlette.concurrency import run_in_threadpool
+from fastapi import HTTPException
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import math
+import os
+import time
+
+import numpy as np
+
+try:
+    import backend.search as search_engine
+    import backend.follow_graph as follow_graph
+except ImportError:
+    import search as search_engine
+    import follow_graph
+
+# Instantané de l'index (rechargé au démarrage)
+POST_SEARCH_SNAPSHOT = Path(os.environ.get(
+    "POST_SEARCH_SNAPSHOT", Path(__file__).parent / "search_index" / "posts.npz"
+))
+
+# Rattrapage des écritures des autres processus
+POST_SEARCH_SYNC_SECONDS = float(os.environ.get("POST_SEARCH_SYNC_SECONDS", 5))
+
+# Intervalle entre deux instantanés
+POST_SEARCH_SNAPSHOT_SECONDS = float(os.environ.get("POST_SEARCH_SNAPSHOT_SECONDS", 900))
+
+# Postings ajoutés déclenchant une fusion dans la base
+POST_SEARCH_MERGE_POSTINGS = int(os.environ.get("POST_SEARCH_MERGE_POSTINGS", 200000))
+
+# Marge relue à chaque rattrapage (created_at est fixé avant l'insertion)
+SYNC_OVERLAP_SECONDS = 30
+
+# Journal des suppressions (lu par les workers, purgé par index TTL)
+POST_DELETIONS = "post_deletions"
+POST_DELETIONS_TTL_DAYS = 7
+
+# Résultats classés au maximum par requête (profondeur de pagination)
+MAX_RANKED_RESULTS = 1000
+
+DEFAULT_RESULTS = 20
+MAX_RESULTS = 50
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_POST_FIELDS = {"id": 1, "content": 1, "created_at": 1, "_id": 0}
+
+# Base CSR : (terme → numéro, offsets, documents, fréquences)
+Base = Tuple[Dict[str, int], np.ndarray, np.ndarray, np.ndarray]
+# Ajouts : terme → (documents, fréquences)
+Delta = Dict[str, Tuple[array, array]]
+
+
+# ==================== POSTINGS (hors boucle d'événements) ====================
+
+def merge_postings(base: Base, delta: Delta, alive: bytes) -> Base:
+    """Nouvelle base = base + ajouts, sans les documents supprimés"""
+    terms, offsets, docs, tfs = base
+    vocab = dict(terms)
+    alive = np.frombuffer(alive, np.uint8).astype(bool)
+
+    tid_parts = [np.repeat(np.arange(len(offsets) - 1, dtype=np.int64), np.diff(offsets))]
+    doc_parts = [docs]
+    tf_parts = [tfs]
+    for term, (term_docs, term_tfs) in delta.items():
+        tid = vocab.setdefault(term, len(vocab))
+        tid_parts.append(np.full(len(term_docs), tid, np.int64))
+        doc_parts.append(np.frombuffer(term_docs, np.intc).astype(np.int32))
+        tf_parts.append(np.frombuffer(term_tfs, np.uint16))
+
+    tids = np.concatenate(tid_parts)
+    all_docs = np.concatenate(doc_parts)
+    all_tfs = np.concatenate(tf_parts)
+    keep = alive[all_docs]
+    tids, all_docs, all_tfs = tids[keep], all_docs[keep], all_tfs[keep]
+
+    # Tri stable par terme : les documents restent croissants dans chaque liste
+    order = np.argsort(tids, kind="stable")
+    counts = np.bincount(tids, minlength=len(vocab))
+    new_offsets = np.zeros(len(vocab) + 1, np.int64)
+    np.cumsum(counts, out=new_offsets[1:])
+    return vocab, new_offsets, all_docs[order], all_tfs[order]
+
+
+def write_snapshot(path: Path, base: Base, alive: bytes, doc_ids: List[str], lengths: array,
+                   watermark: Optional[str], deletions_watermark: Optional[str]):
+    """Écrit la base (documents vivants renumérotés, termes vides retirés) de façon atomique"""
+    terms, offsets, docs, tfs = base
+    alive = np.frombuffer(alive, np.uint8).astype(bool)
+    renumber = np.cumsum(alive) - 1
+    counts = np.diff(offsets)
+    nonempty = counts > 0
+    kept_terms = [term for term, keep in zip(terms, nonempty) if keep]
+    kept_offsets = np.zeros(len(kept_terms) + 1, np.int64)
+    np.cumsum(counts[nonempty], out=kept_offsets[1:])
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        np.savez(
+            f,
+            terms=np.frombuffer("\n".join(kept_terms).encode(), np.uint8),
+            offsets=kept_offsets,
+            docs=renumber[docs].astype(np.int32),
+            tfs=tfs,
+            lengths=np.frombuffer(lengths, np.uintc)[alive],
+            doc_ids=np.array([d for d, a in zip(doc_ids, alive) if a], dtype="S"),
+            watermark=np.array(watermark or ""),
+            deletions_watermark=np.array(deletions_watermark or ""),
+        )
+    os.replace(tmp, path)
+
+
+def read_snapshot(path: Path) -> Optional[dict]:
+    if not path.exists():
+        return None
+    with np.load(path, allow_pickle=False) as data:
+        blob = data["terms"].tobytes().decode()
+        return {
+            "terms": blob.split("\n") if blob else [],
+            "offsets": data["offsets"],
+            "docs": data["docs"],
+            "tfs": data["tfs"],
+            "lengths": data["lengths"].astype(np.uintc),
+            "doc_ids": [d.decode() for d in data["doc_ids"].tolist()],
+            "watermark": str(data["watermark"]) or None,
+            "deletions_watermark": str(data["deletions_watermark"]) or None,
+        }
+
+
+# ==================== INDEX ====================
+
+class PostSearchIndex:
+    """Index inversé des contenus de posts, noté en BM25"""
+
+    def __init__(self):
+        # Documents (numéro → id) ; un document supprimé garde son numéro jusqu'à l'instantané suivant
+        self.doc_ids: List[str] = []
+        self.doc_numbers: Dict[str, int] = {}
+        self.lengths = array("I")
+        self.alive = bytearray()
+        self.live_docs = 0
+        self.total_length = 0
+
+        self.base: Base = ({}, np.zeros(1, np.int64), np.empty(0, np.int32), np.empty(0, np.uint16))
+        self.delta: Delta = {}
+        self.merging: Delta = {}  # ajouts en cours de fusion (encore lus par les requêtes)
+        self.delta_postings = 0
+
+        self.watermark: Optional[str] = None                 # created_at le plus récent indexé
+        self.deletions_watermark: Optional[datetime] = None  # deleted_at le plus récent lu
+
+        self.db = None
+        self.ready = False
+        self.lock = asyncio.Lock()
+        self.wake: Optional[asyncio.Event] = None
+        self.task: Optional[asyncio.Task] = None
+        self.stopping = False
+        self.last_snapshot = time.monotonic()
+        self.stats = {"queries": 0, "added": 0, "removed": 0, "merges": 0, "snapshots": 0}
+
+    # ==================== MISES À JOUR INCRÉMENTALES ====================
+
+    def add(self, post: dict):
+        """À appeler après l'insertion d'un post"""
+        post_id = post.get("id")
+        if not post_id or post_id in self.doc_numbers:
+            return
+        terms = search_engine.tokenize(post.get("content"))
+        docno = len(self.doc_ids)
+        self.doc_ids.append(post_id)
+        self.doc_numbers[post_id] = docno
+        self.lengths.append(len(terms))
+        self.alive.append(1)
+        self.live_docs += 1
+        self.total_length += len(terms)
+
+        counts: Dict[str, int] = {}
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+        for term, tf in counts.items():
+            postings = self.delta.get(term)
+            if postings is None:
+                postings = self.delta[term] = (array("i"), array("H"))
+            postings[0].append(docno)
+            postings[1].append(min(tf, 65535))
+        self.delta_postings += len(counts)
+
+        created_at = post.get("created_at")
+        if created_at and (self.watermark is None or created_at > self.watermark):
+            self.watermark = created_at
+        self.stats["added"] += 1
+        if self.delta_postings >= POST_SEARCH_MERGE_POSTINGS and self.wake is not None:
+            self.wake.set()
+
+    def remove(self, post_id: str):
+        """À appeler après la suppression d'un post"""
+        docno = self.doc_numbers.get(post_id)
+        if docno is None or not self.alive[docno]:
+            return
+        self.alive[docno] = 0
+        self.live_docs -= 1
+        self.total_length -= self.lengths[docno]
+        self.stats["removed"] += 1
+
+    # ==================== REQUÊTES ====================
+
+    def _postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        terms, offsets, docs, tfs = self.base
+        doc_parts, tf_parts = [], []
+        tid = terms.get(term)
+        if tid is not None:
+            start, end = offsets[tid], offsets[tid + 1]
+            doc_parts.append(docs[start:end])
+            tf_parts.append(tfs[start:end])
+        for delta in (self.merging, self.delta):
+            postings = delta.get(term)
+            if postings is not None:
+                doc_parts.append(np.frombuffer(postings[0], np.intc).astype(np.int32))
+                tf_parts.append(np.frombuffer(postings[1], np.uint16).copy())
+        if not doc_parts:
+            return np.empty(0, np.int32), np.empty(0, np.uint16)
+        return np.concatenate(doc_parts), np.concatenate(tf_parts)
+
+    def ranked(self, terms: List[str], limit: int = MAX_RANKED_RESULTS) -> List[str]:
+        """Ids des posts contenant au moins un terme, par score BM25 décroissant (puis plus récent)"""
+        if not terms or self.live_docs <= 0:
+            return []
+        self.stats["queries"] += 1
+        alive = np.frombuffer(bytes(self.alive), np.uint8).astype(bool)
+        lengths = np.frombuffer(self.lengths.tobytes(), np.uintc)
+        avgdl = max(self.total_length / self.live_docs, 1.0)
+
+        doc_parts, score_parts = [], []
+        for term in terms:
+            docs, tfs = self._postings(term)
+            live = alive[docs]
+            docs, tfs = docs[live], tfs[live].astype(np.float64)
+            df = len(docs)
+            if df == 0:
+                continue
+            idf = math.log(1 + (self.live_docs - df + 0.5) / (df + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[docs] / avgdl)
+            doc_parts.append(docs)
+            score_parts.append(idf * tfs * (BM25_K1 + 1) / (tfs + norm))
+        if not doc_parts:
+            return []
+
+        docs = np.concatenate(doc_parts)
+        scores = np.concatenate(score_parts)
+        if len(doc_parts) > 1:
+            docs, inverse = np.unique(docs, return_inverse=True)
+            scores = np.bincount(inverse, weights=scores)
+
+        k = min(limit, len(docs))
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(docs) else np.arange(len(docs))
+        order = top[np.lexsort((-docs[top], -scores[top]))]
+        return [self.doc_ids[d] for d in docs[order].tolist()]
+
+    # ==================== FUSION / INSTANTANÉ ====================
+
+    async def merge(self, snapshot: bool = False):
+        """Fusionne les ajouts dans la base (dans un thread) ; écrit l'instantané si demandé"""
+        async with self.lock:
+            n = len(self.doc_ids)
+            alive = bytes(self.alive)
+            meta = (
+                self.doc_ids[:n], self.lengths[:n], self.watermark,
+                self.deletions_watermark.isoformat() if self.deletions_watermark else None
+            )
+            self.merging, self.delta, self.delta_postings = self.delta, {}, 0
+            try:
+                merged = await run_in_threadpool(merge_postings, self.base, self.merging, alive)
+            except Exception as e:
+                print(f"⚠️ Post search merge failed: {e}")
+                for term, (docs, tfs) in self.merging.items():
+                    newer = self.delta.get(term)
+                    self.delta[term] = (docs + newer[0], tfs + newer[1]) if newer else (docs, tfs)
+                    self.delta_postings += len(docs)
+                return
+            finally:
+                self.merging = {}
+            self.base = merged
+            self.stats["merges"] += 1
+
+            if snapshot:
+                try:
+                    await run_in_threadpool(write_snapshot, POST_SEARCH_SNAPSHOT, merged, alive, *meta)
+                    self.stats["snapshots"] += 1
+                except Exception as e:
+                    print(f"⚠️ Post search snapshot failed: {e}")
+                self.last_snapshot = time.monotonic()
+
+    def _install_snapshot(self, data: dict):
+        self.doc_ids = data["doc_ids"]
+        self.doc_numbers = {post_id: i for i, post_id in enumerate(self.doc_ids)}
+        self.lengths = array("I")
+        self.lengths.frombytes(data["lengths"].tobytes())
+        self.alive = bytearray(b"\x01") * len(self.doc_ids)
+        self.live_docs = len(self.doc_ids)
+        self.total_length = int(data["lengths"].sum())
+        self.base = (
+            {term: i for i, term in enumerate(data["terms"])},
+            data["offsets"], data["docs"], data["tfs"]
+        )
+        self.delta, self.delta_postings = {}, 0
+        self.watermark = data["watermark"]
+        if data["deletions_watermark"]:
+            self.deletions_watermark = datetime.fromisoformat(data["deletions_watermark"])
+
+    # ==================== RATTRAPAGE ====================
+
+    async def sync(self):
+        """Indexe les posts créés ailleurs et applique les suppressions journalisées"""
+        query = {}
+        if self.watermark:
+            since = datetime.fromisoformat(self.watermark) - timedelta(seconds=SYNC_OVERLAP_SECONDS)
+            query = {"created_at": {"$gte": since.isoformat()}}
+        async for post in self.db.posts.find(query, _POST_FIELDS):
+            self.add(post)
+
+        query = {}
+        if self.deletions_watermark:
+            query = {"deleted_at": {"$gte": self.deletions_watermark - timedelta(seconds=SYNC_OVERLAP_SECONDS)}}
+        async for deletion in self.db[POST_DELETIONS].find(query, {"post_id": 1, "deleted_at": 1, "_id": 0}):
+            self.remove(deletion.get("post_id"))
+            deleted_at = deletion.get("deleted_at")
+            if isinstance(deleted_at, datetime):
+                if deleted_at.tzinfo is None:
+                    deleted_at = deleted_at.replace(tzinfo=timezone.utc)
+                if self.deletions_watermark is None or deleted_at > self.deletions_watermark:
+                    self.deletions_watermark = deleted_at
+
+    async def _bootstrap(self):
+        started = time.monotonic()
+        try:
+            data = await run_in_threadpool(read_snapshot, POST_SEARCH_SNAPSHOT)
+        except Exception as e:
+            print(f"⚠️ Post search snapshot unreadable, rebuilding: {e}")
+            data = None
+        if data is not None:
+            self._install_snapshot(data)
+        await self.sync()
+        await self.merge(snapshot=data is None)
+        self.ready = True
+        print(f"✅ Post search index ready: {self.live_docs} posts in {time.monotonic() - started:.1f}s")
+
+    async def _run(self):
+        try:
+            await self._bootstrap()
+        except Exception as e:
+            print(f"⚠️ Post search bootstrap failed: {e}")
+        while not self.stopping:
+            try:
+                await asyncio.wait_for(self.wake.wait(), timeout=POST_SEARCH_SYNC_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self.wake.clear()
+            if self.stopping:
+                break
+            try:
+                if not self.ready:
+                    await self._bootstrap()
+                    continue
+                await self.sync()
+                snapshot = time.monotonic() - self.last_snapshot > POST_SEARCH_SNAPSHOT_SECONDS
+                if snapshot or self.delta_postings >= POST_SEARCH_MERGE_POSTINGS:
+                    await self.merge(snapshot=snapshot)
+            except Exception as e:
+                print(f"⚠️ Post search sync error: {e}")
+
+    def start(self, db):
+        """À appeler au démarrage : instantané + rattrapage en tâche de fond"""
+        self.db = db
+        self.wake = asyncio.Event()
+        self.stopping = False
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.stopping = True
+            self.wake.set()
+            await self.task
+            self.task = None
+
+    def snapshot(self) -> dict:
+        data = dict(self.stats)
+        data.update(
+            ready=self.ready, live_docs=self.live_docs, documents=len(self.doc_ids),
+            terms=len(self.base[0]), base_postings=len(self.base[2]), delta_postings=self.delta_postings
+        )
+        return data
+
+
+index = PostSearchIndex()
+
+
+# ==================== SUPPRESSIONS ====================
+
+async def record_deletions(db, post_ids: List[str]):
+    """Journalise des suppressions de posts pour les index des autres processus"""
+    post_ids = [p for p in post_ids if p]
+    if not post_ids:
+        return
+    now = datetime.now(timezone.utc)
+    await db[POST_DELETIONS].insert_many([{"post_id": p, "deleted_at": now} for p in post_ids])
+
+
+async def ensure_indexes(db):
+    await db.posts.create_index([("created_at", -1)])
+    await db[POST_DELETIONS].create_index(
+        [("deleted_at", 1)], expireAfterSeconds=POST_DELETIONS_TTL_DAYS * 86400
+    )
+
+
+# ==================== PAGE DE RÉSULTATS ====================
+
+def encode_position(position: int) -> str:
+    return str(position)
+
+
+def decode_position(cursor: Optional[str]) -> int:
+    if not cursor:
+        return 0
+    try:
+        position = int(cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if position < 0:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return position
+
+
+def clamp_results(limit: Optional[int]) -> int:
+    if not limit or limit < 1:
+        return DEFAULT_RESULTS
+    return min(limit, MAX_RESULTS)
+
+
+async def hidden_authors(db, author_ids, viewer_id: str, following) -> set:
+    """Auteurs privés que le lecteur ne suit pas"""
+    candidates = [a for a in set(author_ids) if a != viewer_id and a not in following]
+    if not candidates:
+        return set()
+    cursor = db.users.find({"id": {"$in": candidates}, "is_private": True}, {"id": 1, "_id": 0})
+    return {u["id"] async for u in cursor}
+
+
+async def search_page(
+    db,
+    q: str,
+    viewer_id: str,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None
+) -> Tuple[List[dict], Optional[str]]:
+    """
+    Page de posts visibles par le lecteur, par pertinence.
+    Retourne (posts, next_cursor) ; next_cursor est None en fin de résultats.
+    """
+    limit = clamp_results(limit)
+    position = decode_position(cursor)
+    terms = search_engine.parse_query(q)
+    following = await follow_graph.graph.following(db, viewer_id)
+
+    if not index.ready:
+        # Index en cours de construction : recherche par termes (search.py), sans pagination
+        if position:
+            return [], None
+        posts = await search_engine.search_posts(db, q, limit=limit)
+        hidden = await hidden_authors(db, (p["author_id"] for p in posts), viewer_id, following)
+        return [p for p in posts if p["author_id"] not in hidden], None
+
+    ranked = index.ranked(terms)
+    results: List[dict] = []
+    while position < len(ranked) and len(results) < limit:
+        chunk = ranked[position:position + 2 * limit]
+        posts = {p["id"]: p async for p in db.posts.find({"id": {"$in": chunk}}, {"_id": 0})}
+        hidden = await hidden_authors(db, (p["author_id"] for p in posts.values()), viewer_id, following)
+        for post_id in chunk:
+            position += 1
+            post = posts.get(post_id)
+            if post is None:
+                index.remove(post_id)  # supprimé par un autre processus, pas encore journalisé ici
+                continue
+            if post["author_id"] in hidden:
+                continue
+            results.append(post)
+            if len(results) == limit:
+                break
+
+    next_cursor = encode_position(position) if position < len(ranked) else None
+    return results, next_cursor
@@ -0,0 +1,129 @@
+"""
+ranking.py - Classement du feed par engagement (?ranking=engagement)
+Un lot de candidats est noté en une seule passe NumPy :
+décroissance temporelle × (1 + engagement) × (1 + affinité auteur), puis top-k.
+"""
+
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+import os
+
+import numpy as np
+
+# Nombre maximum de candidats notés par requête
+RANKING_CANDIDATES = int(os.environ.get("RANKING_CANDIDATES", 1000))
+
+# Ancienneté maximale d'un candidat
+RANKING_WINDOW_DAYS = int(os.environ.get("RANKING_WINDOW_DAYS", 7))
+
+# Demi-vie de la décroissance temporelle (heures)
+RECENCY_HALF_LIFE_HOURS = float(os.environ.get("RANKING_HALF_LIFE_HOURS", 12))
+
+# Pondérations de l'engagement et de l'affinité
+LIKE_WEIGHT = 1.0
+COMMENT_WEIGHT = 2.0
+SHARE_WEIGHT = 3.0
+AFFINITY_WEIGHT = 0.5
+
+# Interactions récentes du lecteur prises en compte pour l'affinité
+AFFINITY_HISTORY = 500
+
+_CANDIDATE_FIELDS = {
+    "id": 1, "author_id": 1, "created_at": 1,
+    "likes_count": 1, "comments_count": 1, "shares_count": 1, "_id": 0
+}
+
+
+def iso_to_epoch(values: List[str]) -> np.ndarray:
+    """Horodatages ISO 8601 (UTC, 'YYYY-MM-DDTHH:MM:SS...') → secondes epoch, sans boucle Python"""
+    digits = np.array(values, dtype="S19").view(np.uint8).reshape(-1, 19).astype(np.int64) - 48
+    year = digits[:, 0] * 1000 + digits[:, 1] * 100 + digits[:, 2] * 10 + digits[:, 3]
+    month = digits[:, 5] * 10 + digits[:, 6]
+    day = digits[:, 8] * 10 + digits[:, 9]
+    seconds = (digits[:, 11] * 10 + digits[:, 12]) * 3600 \
+        + (digits[:, 14] * 10 + digits[:, 15]) * 60 \
+        + digits[:, 17] * 10 + digits[:, 18]
+    days = (
+        (year - 1970).astype("datetime64[Y]").astype("datetime64[M]") + (month - 1)
+    ).astype("datetime64[D]") + (day - 1)
+    return days.astype(np.int64) * 86400 + seconds
+
+
+def score_candidates(candidates: List[dict], affinity: Dict[str, float], now: float) -> np.ndarray:
+    """Score de chaque candidat (même ordre que `candidates`)"""
+    n = len(candidates)
+    if n == 0:
+        return np.empty(0)
+
+    created = iso_to_epoch([c["created_at"] for c in candidates])
+    likes = np.fromiter((c.get("likes_count", 0) for c in candidates), np.float64, n)
+    comments = np.fromiter((c.get("comments_count", 0) for c in candidates), np.float64, n)
+    shares = np.fromiter((c.get("shares_count", 0) for c in candidates), np.float64, n)
+
+    # Affinité : une recherche par auteur distinct, puis diffusion sur les posts
+    author_index: Dict[str, int] = {}
+    inverse = np.fromiter(
+        (author_index.setdefault(c["author_id"], len(author_index)) for c in candidates), np.intp, n
+    )
+    author_affinity = np.fromiter(
+        (affinity.get(a, 0.0) for a in author_index), np.float64, len(author_index)
+    )
+
+    age_hours = np.maximum(now - created, 0) / 3600.0
+    recency = np.exp2(-age_hours / RECENCY_HALF_LIFE_HOURS)
+    engagement = np.log1p(
+        LIKE_WEIGHT * np.maximum(likes, 0)
+        + COMMENT_WEIGHT * np.maximum(comments, 0)
+        + SHARE_WEIGHT * np.maximum(shares, 0)
+    )
+    return recency * (1.0 + engagement) * (1.0 + AFFINITY_WEIGHT * np.log1p(author_affinity[inverse]))
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices des k meilleurs scores, triés par score décroissant"""
+    if len(scores) <= k:
+        return np.argsort(-scores, kind="stable")
+    best = np.argpartition(-scores, k)[:k]
+    return best[np.argsort(-scores[best], kind="stable")]
+
+
+async def get_author_affinity(db, viewer_id: str) -> Dict[str, float]:
+    """Nombre de likes et commentaires récents du lecteur par auteur"""
+    likes = await db.likes.find(
+        {"user_id": viewer_id}, {"post_id": 1, "_id": 0}
+    ).sort("created_at", -1).limit(AFFINITY_HISTORY).to_list(length=AFFINITY_HISTORY)
+    comments = await db.comments.find(
+        {"author_id": viewer_id}, {"post_id": 1, "_id": 0}
+    ).sort("created_at", -1).limit(AFFINITY_HISTORY).to_list(length=AFFINITY_HISTORY)
+
+    interactions = [d["post_id"] for d in likes + comments if d.get("post_id")]
+    if not interactions:
+        return {}
+
+    posts = await db.posts.find(
+        {"id": {"$in": list(set(interactions))}}, {"id": 1, "author_id": 1, "_id": 0}
+    ).to_list(length=None)
+    author_of = {p["id"]: p["author_id"] for p in posts}
+    counts = Counter(author_of[i] for i in interactions if i in author_of)
+    counts.pop(viewer_id, None)
+    return dict(counts)
+
+
+async def get_ranked_feed(db, viewer_id: str, author_ids: List[str], limit: int) -> List[dict]:
+    """Top-`limit` des posts récents des auteurs donnés, classés par score"""
+    since = (datetime.now(timezone.utc) - timedelta(days=RANKING_WINDOW_DAYS)).isoformat()
+    candidates = await db.posts.find(
+        {"author_id": {"$in": author_ids}, "created_at": {"$gte": since}},
+        _CANDIDATE_FIELDS
+    ).sort("created_at", -1).limit(RANKING_CANDIDATES).to_list(length=RANKING_CANDIDATES)
+    if not candidates:
+        return []
+
+    affinity = await get_author_affinity(db, viewer_id)
+    scores = score_candidates(candidates, affinity, datetime.now(timezone.utc).timestamp())
+    ids = [candidates[i]["id"] for i in top_k(scores, limit)]
+
+    posts = await db.posts.find({"id": {"$in": ids}}).to_list(length=len(ids))
+    by_id = {p["id"]: p for p in posts}
+    return [by_id[i] for i in ids if i in by_id]
@@ -0,0 +1,126 @@
+# app/backend/reconcile_counters.py - Recompte et corrige les compteurs des utilisateurs
+#
+# Usage : python reconcile_counters.py [--dry-run]
+# Planifié chaque nuit par gdpr_scheduler.py.
+# Les utilisateurs sont parcourus par _id, par lots de RECONCILE_BATCH_SIZE : pour chaque lot,
+# une agrégation par compteur (follows / posts, $match $in + $group) donne les vraies valeurs.
+# Un écart n'est corrigé que s'il persiste après RECONCILE_SETTLE_SECONDS (les deltas en attente
+# dans counters.py des serveurs ont été écrits entre-temps), par un $set conditionnel sur la
+# valeur relue ; une pause de RECONCILE_PAUSE_SECONDS sépare deux lots.
+
+import asyncio
+import os
+import sys
+from typing import Dict, List
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+# Charger les variables d'environnement
+load_dotenv()
+
+# Configuration MongoDB
+MONGODB_URL = os.environ.get('MONGODB_URI') or os.environ.get('MONGO_URL') or os.environ.get('DATABASE_URL')
+DATABASE_NAME = os.environ.get('DB_NAME', 'nexus_social')
+
+BATCH_SIZE = int(os.environ.get("RECONCILE_BATCH_SIZE", 500))
+PAUSE_SECONDS = float(os.environ.get("RECONCILE_PAUSE_SECONDS", 0.5))
+SETTLE_SECONDS = float(os.environ.get("RECONCILE_SETTLE_SECONDS", 5))
+
+# Compteur → (collection comptée, champ désignant l'utilisateur)
+COUNTERS = {
+    "followers_count": ("follows", "followed_id"),
+    "following_count": ("follows", "follower_id"),
+    "posts_count": ("posts", "author_id"),
+}
+
+# Exemples d'écarts gardés dans le rapport
+MAX_SAMPLES = 20
+
+
+async def recount(db, user_ids: List[str]) -> Dict[str, Dict[str, int]]:
+    """Vraies valeurs : user_id → compteur → nombre (une agrégation par compteur)"""
+    actual = {user_id: {field: 0 for field in COUNTERS} for user_id in user_ids}
+    for field, (collection, key) in COUNTERS.items():
+        pipeline = [
+            {"$match": {key: {"$in": user_ids}}},
+            {"$group": {"_id": f"${key}", "n": {"$sum": 1}}},
+        ]
+        async for group in db[collection].aggregate(pipeline):
+            if group["_id"] in actual:
+                actual[group["_id"]][field] = group["n"]
+    return actual
+
+
+def drift(users: List[dict], actual: Dict[str, Dict[str, int]]) -> Dict[str, Dict[str, tuple]]:
+    """user_id → compteur → (valeur stockée, vraie valeur), pour les seuls écarts"""
+    found = {}
+    for user in users:
+        for field in COUNTERS:
+            stored = user.get(field)
+            expected = actual[user["id"]][field]
+            if stored != expected:
+                found.setdefault(user["id"], {})[field] = (stored, expected)
+    return found
+
+
+async def reconcile_batch(db, users: List[dict], report: dict, dry_run: bool):
+    ids = [u["id"] for u in users if u.get("id")]
+    suspects = drift([u for u in users if u.get("id")], await recount(db, ids))
+    if not suspects:
+        return
+
+    # Confirmation : un écart dû à un delta pas encore écrit disparaît après le délai
+    await asyncio.sleep(SETTLE_SECONDS)
+    suspect_ids = list(suspects)
+    projection = {"id": 1, "_id": 0, **{field: 1 for field in COUNTERS}}
+    users = await db.users.find({"id": {"$in": suspect_ids}}, projection).to_list(length=None)
+    confirmed = drift(users, await recount(db, suspect_ids))
+
+    ops = []
+    for user_id, fields in confirmed.items():
+        for field, (stored, expected) in fields.items():
+            report["fixed"][field] += 1
+            if len(report["samples"]) < MAX_SAMPLES:
+                report["samples"].append({"user_id": user_id, "field": field, "stored": stored, "actual": expected})
+            # Conditionnel : une écriture concurrente depuis la relecture l'emporte
+            ops.append(UpdateOne({"id": user_id, field: stored}, {"$set": {field: expected}}))
+    if ops and not dry_run:
+        result = await db.users.bulk_write(ops, ordered=False)
+        report["written"] += result.modified_count
+
+
+async def reconcile_users(db, dry_run: bool = False) -> dict:
+    """Parcourt tous les utilisateurs ; retourne le rapport des écarts corrigés"""
+    report = {"scanned": 0, "fixed": {field: 0 for field in COUNTERS}, "written": 0, "samples": []}
+    projection = {"_id": 1, "id": 1, **{field: 1 for field in COUNTERS}}
+    last_id = None
+    while True:
+        query = {} if last_id is None else {"_id": {"$gt": last_id}}
+        users = await db.users.find(query, projection).sort("_id", 1).limit(BATCH_SIZE).to_list(length=BATCH_SIZE)
+        if not users:
+            break
+        await reconcile_batch(db, users, report, dry_run)
+        report["scanned"] += len(users)
+        last_id = users[-1]["_id"]
+        await asyncio.sleep(PAUSE_SECONDS)
+
+    fixed = ", ".join(f"{field}={n}" for field, n in report["fixed"].items())
+    print(f"✅ Counters reconciled: {report['scanned']} users scanned, drift {fixed}, {report['written']} written")
+    for sample in report["samples"]:
+        print(f"   {sample['user_id']} {sample['field']}: {sample['stored']} → {sample['actual']}")
+    return report
+
+
+def main():
+    dry_run = "--dry-run" in sys.argv[1:]
+    print(f"🧮 Reconciling user counters{' (dry run)' if dry_run else ''}")
+    client = AsyncIOMotorClient(MONGODB_URL)
+    try:
+        asyncio.run(reconcile_users(client[DATABASE_NAME], dry_run))
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
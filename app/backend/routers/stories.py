@@ -1,9 +1,17 @@
 from fastapi import APIRouter, Depends, File, UploadFile, HTTPException
 from datetime import datetime, timedelta, timezone
-import base64
 import uuid
 from bson import ObjectId
 
+try:
+    import backend.blob_store as blob_store
+    import backend.uploads as uploads
+    import backend.user_cards as user_cards
+except ImportError:
+    import blob_store
+    import uploads
+    import user_cards
+
 router = APIRouter(tags=["stories"])
 
 # Récupère db et get_current_user depuis server.py
@@ -27,16 +35,11 @@ async def create_story(
     db = Depends(get_db)
 ):
     """Créer une nouvelle story"""
-    contents = await file.read()
-    base64_media = base64.b64encode(contents).decode('utf-8')
-    media_url = f"data:{file.content_type};base64,{base64_media}"
-    media_type = "image" if file.content_type.startswith("image") else "video"
+    media_type, media_url = await uploads.save_upload(file)
 
     story_to_insert = { 
         "id": str(uuid.uuid4()),
         "user_id": current_user["id"],
-        "username": current_user["username"],
-        "avatar": current_user.get("profile_pic"),
         "media_url": media_url,
         "media_type": media_type,
         "created_at": datetime.now(timezone.utc).isoformat(),
@@ -50,6 +53,9 @@ async def create_story(
 
     if inserted_story_raw:
         story_response = convert_mongo_doc_to_dict(inserted_story_raw)
+        await user_cards.attach_cards(db, [story_response], "user")
+        story_response["avatar"] = blob_store.resolve_url(story_response.get("avatar"))
+        story_response["media_url"] = blob_store.resolve_url(story_response["media_url"])
         return {"success": True, "story": story_response}
     else:
         raise HTTPException(status_code=500, detail="Failed to retrieve inserted story")
@@ -72,6 +78,7 @@ async def delete_story(
         raise HTTPException(status_code=403, detail="Not authorized")
 
     await db.stories.delete_one({"id": story_id})
+    await blob_store.release(db, [story.get("media_url")])
     return {"message": "Story deleted successfully"}
     
 
@@ -81,18 +88,12 @@ async def get_stories_feed(
     db = Depends(get_db)
 ):
     """Feed des stories"""
-    follows_raw = await db.follows.find({
-        "follower_id": current_user["id"],
-        "status": "following"
-    }).to_list(1000)
-    
-    follows = [convert_mongo_doc_to_dict(f) for f in follows_raw]
+    follows_raw = await db.follows.find(
+        {"follower_id": current_user["id"]},
+        {"followed_id": 1, "_id": 0}
+    ).to_list(1000)
     
-    following_ids = []
-    for f in follows:
-        user_id = f.get("followed_id") or f.get("following_id")
-        if user_id:
-            following_ids.append(user_id)
+    following_ids = [f["followed_id"] for f in follows_raw if f.get("followed_id")]
     following_ids.append(current_user["id"])
 
     now = datetime.now(timezone.utc).isoformat()
@@ -101,18 +102,24 @@ async def get_stories_feed(
         "expires_at": {"$gt": now}
     }).sort("created_at", -1).to_list(1000)
 
+    # Username / avatar à jour depuis les cartes (une requête $in, cache)
+    cards = await user_cards.cache.get_many(db, [s["user_id"] for s in raw_stories])
+
     grouped = {}
     for s_doc in raw_stories:
         s = convert_mongo_doc_to_dict(s_doc)
         uid = s["user_id"]
+        if uid not in cards:
+            continue
         if uid not in grouped:
+            card = user_cards.public_card(cards[uid])
             grouped[uid] = {
-                "user": {"id": uid, "username": s["username"], "avatar": s.get("avatar")},
+                "user": {"id": uid, "username": card["username"], "avatar": card["profile_pic"]},
                 "stories": []
             }
         grouped[uid]["stories"].append({
             "id": s["id"],
-            "media_url": s["media_url"],
+            "media_url": blob_store.resolve_url(s["media_url"]),
             "media_type": s["media_type"],
             "user_id": s["user_id"],
             "created_at": s["created_at"]
@@ -144,10 +151,7 @@ async def reply_to_story(
     message = {
         "id": message_id,
         "sender_id": current_user["id"],
-        "sender_username": current_user["username"],
-        "sender_profile_pic": current_user.get("profile_pic"),
         "recipient_id": story["user_id"],
-        "recipient_username": author["username"],
         "content": reply_data.get("content", ""),
         "story_id": story_id,
         "read": False,
@@ -155,4 +159,7 @@ async def reply_to_story(
     }
     
     await db.messages.insert_one(message)
-    return {"success": True, "message": convert_mongo_doc_to_dict(message)}
+    message = convert_mongo_doc_to_dict(message)
+    await user_cards.attach_cards(db, [message], "sender", "recipient")
+    message["sender_profile_pic"] = blob_store.resolve_url(message.get("sender_profile_pic"))
+    return {"success": True, "message": message}
@@ -0,0 +1,182 @@
+"""
+search.py - Recherche indexée (utilisateurs et posts)
+Le texte est normalisé (minuscules, sans accents) et découpé en termes,
+stockés dans des champs tableau couverts par un index multikey :
+- users.username_key : username entier normalisé (correspondance exacte)
+- users.name_keys : préfixes des termes du username (recherche à la frappe)
+- users.search_keys : name_keys + préfixes des MAX_PREFIXED_BIO_TERMS premiers termes de la bio
+  (les suivants ne sont trouvés qu'entiers)
+- posts.search_terms : termes du contenu
+La requête n'est jamais interprétée comme une regex : elle est découpée de la même façon,
+chaque terme doit être présent, et au plus SEARCH_CANDIDATE_LIMIT candidats sont classés,
+lus dans l'ordre username exact, username par préfixe (les plus suivis d'abord), puis bio.
+"""
+
+from typing import Dict, List, Optional
+import math
+import os
+import re
+import unicodedata
+
+# Candidats lus au maximum par recherche (borne la latence quelle que soit la taille des collections)
+SEARCH_CANDIDATE_LIMIT = int(os.environ.get("SEARCH_CANDIDATE_LIMIT", 200))
+
+# Termes retenus au maximum dans une requête
+MAX_QUERY_TERMS = 8
+
+# Longueur maximum d'un terme / d'un préfixe indexé
+MAX_TERM_LENGTH = 32
+
+# Termes indexés au maximum par document (bio / contenu)
+MAX_DOCUMENT_TERMS = 256
+
+# Termes de la bio indexés par préfixe (un terme de 32 lettres donne 32 clés)
+MAX_PREFIXED_BIO_TERMS = int(os.environ.get("MAX_PREFIXED_BIO_TERMS", 32))
+
+# Champs d'index jamais renvoyés avec les utilisateurs
+USER_PROJECTION = {"_id": 0, "password": 0, "username_key": 0, "name_keys": 0, "search_keys": 0}
+
+_TERM_RE = re.compile(r"[^\W_]+")
+
+
+# ==================== NORMALISATION ====================
+
+def normalize(text: Optional[str]) -> str:
+    """Minuscules sans accents : 'Éloïse' → 'eloise'"""
+    if not text:
+        return ""
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Termes normalisés, dans l'ordre, doublons compris"""
+    return [t[:MAX_TERM_LENGTH] for t in _TERM_RE.findall(normalize(text))]
+
+
+def parse_query(q: Optional[str]) -> List[str]:
+    """Termes distincts de la requête (les métacaractères sont de simples séparateurs)"""
+    terms = []
+    for term in tokenize(q):
+        if term not in terms:
+            terms.append(term)
+    return terms[:MAX_QUERY_TERMS]
+
+
+def _unique(terms: List[str]) -> List[str]:
+    return list(dict.fromkeys(terms))[:MAX_DOCUMENT_TERMS]
+
+
+def _unique_keys(keys: List[str]) -> List[str]:
+    return list(dict.fromkeys(keys))
+
+
+def prefixes(terms: List[str]) -> List[str]:
+    """Tous les préfixes des termes : 'anna' → a, an, ann, anna"""
+    keys = {}
+    for term in terms:
+        for end in range(1, len(term) + 1):
+            keys[term[:end]] = None
+    return list(keys)
+
+
+def username_terms(username: Optional[str]) -> List[str]:
+    """Le username entier normalisé + ses parties ('jean_luc.d' → jeanlucd, jean, luc, d)"""
+    parts = tokenize(username)
+    whole = "".join(parts)[:MAX_TERM_LENGTH]
+    return _unique(([whole] if whole else []) + parts)
+
+
+# ==================== CHAMPS INDEXÉS ====================
+
+def user_search_fields(username: Optional[str], bio: Optional[str]) -> Dict[str, List[str]]:
+    """Champs à $set sur un utilisateur à la création / modification du username ou de la bio"""
+    name_terms = username_terms(username)
+    bio_terms = [t for t in _unique(tokenize(bio)) if t not in name_terms]
+    name_keys = prefixes(name_terms)
+    bio_keys = prefixes(bio_terms[:MAX_PREFIXED_BIO_TERMS]) + bio_terms[MAX_PREFIXED_BIO_TERMS:]
+    return {
+        "username_key": name_terms[0] if name_terms else "",
+        "name_keys": name_keys,
+        "search_keys": _unique_keys(name_keys + bio_keys),
+    }
+
+
+def post_search_fields(content: Optional[str]) -> Dict[str, List[str]]:
+    """Champs à $set sur un post à la création / modification du contenu"""
+    return {"search_terms": _unique(tokenize(content))}
+
+
+async def ensure_indexes(db):
+    await db.users.create_index([("username_key", 1)])
+    await db.users.create_index([("name_keys", 1), ("followers_count", -1)])
+    await db.users.create_index([("search_keys", 1)])
+    await db.posts.create_index([("search_terms", 1), ("created_at", -1)])
+
+
+# ==================== REQUÊTES ====================
+
+def _user_score(user: dict, terms: List[str]) -> float:
+    """Username exact > début du username > partie du username > bio ; popularité en départage"""
+    whole = "".join(terms)
+    name_terms = username_terms(user.get("username"))
+    score = 0.0
+    if name_terms and name_terms[0] == whole:
+        score += 100
+    elif name_terms and name_terms[0].startswith(whole):
+        score += 50
+    for term in terms:
+        if any(t.startswith(term) for t in name_terms):
+            score += 10
+    return score + math.log1p(user.get("followers_count", 0))
+
+
+async def search_users(db, q: str, limit: int = 20, projection: Optional[dict] = None) -> List[dict]:
+    """Utilisateurs dont chaque terme de la requête préfixe un terme du username ou de la bio"""
+    terms = parse_query(q)
+    if not terms:
+        return []
+    # Les correspondances sur le username passent avant la bio : un username exact
+    # n'est jamais écarté par les SEARCH_CANDIDATE_LIMIT premiers résultats de bio
+    queries = [
+        ({"username_key": "".join(terms)[:MAX_TERM_LENGTH]}, None),
+        ({"name_keys": {"$all": terms}}, "followers_count"),
+        ({"search_keys": {"$all": terms}}, None),
+    ]
+    candidates: List[dict] = []
+    seen: List[str] = []
+    for query, sort in queries:
+        remaining = SEARCH_CANDIDATE_LIMIT - len(candidates)
+        if remaining <= 0:
+            break
+        if seen:
+            query = {**query, "id": {"$nin": seen}}
+        cursor = db.users.find(query, projection or USER_PROJECTION)
+        if sort:
+            cursor = cursor.sort(sort, -1)
+        for user in await cursor.limit(remaining).to_list(length=remaining):
+            candidates.append(user)
+            seen.append(user.get("id"))
+    candidates.sort(key=lambda u: _user_score(u, terms), reverse=True)
+    return candidates[:limit]
+
+
+def _post_score(post: dict, terms: List[str]) -> float:
+    """Occurrences des termes de la requête dans le contenu, puis fraîcheur"""
+    counts: Dict[str, int] = {}
+    for term in tokenize(post.get("content")):
+        counts[term] = counts.get(term, 0) + 1
+    return sum(math.log1p(counts.get(term, 0)) for term in terms)
+
+
+async def search_posts(db, q: str, limit: int = 20) -> List[dict]:
+    """Posts contenant tous les termes de la requête, les plus pertinents d'abord"""
+    terms = parse_query(q)
+    if not terms:
+        return []
+    candidates = await db.posts.find(
+        {"search_terms": {"$all": terms}}, {"_id": 0}
+    ).sort("created_at", -1).limit(SEARCH_CANDIDATE_LIMIT).to_list(length=SEARCH_CANDIDATE_LIMIT)
+    # Tri stable : à pertinence égale, l'ordre antichronologique est conservé
+    candidates.sort(key=lambda p: _post_score(p, terms), reverse=True)
+    return candidates[:limit]
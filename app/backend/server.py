@@ -4,21 +4,21 @@ from pathlib import Path
 # Cette ligne magique règle TOUT le problème Render
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, File, UploadFile, Form, Response
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, File, UploadFile, Form, Header, Response, BackgroundTasks
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
-from pymongo.errors import InvalidURI, ConnectionFailure
+from pymongo.errors import InvalidURI, ConnectionFailure, DuplicateKeyError
 import os
 import logging
+import secrets
 from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional
+from typing import Dict, List, Optional
 import uuid
 from datetime import datetime, timezone, timedelta
 from passlib.context import CryptContext
 import jwt
-import base64
 from bson import ObjectId
 import json
 from collections import defaultdict
@@ -34,6 +34,120 @@ except ImportError:
         follow_router = None
         set_database = None
 
+# Hydratation par lot (is_liked / has_viewed)
+try:
+    from backend.hydration import hydrate_posts, hydrate_comments, hydrate_stories
+except ImportError:
+    from hydration import hydrate_posts, hydrate_comments, hydrate_stories
+
+# Pagination par curseur (keyset)
+try:
+    from backend.pagination import fetch_page, clamp_limit, NEXT_CURSOR_HEADER
+except ImportError:
+    from pagination import fetch_page, clamp_limit, NEXT_CURSOR_HEADER
+
+# Timelines matérialisées (fan-out à l'écriture)
+try:
+    import backend.timelines as timelines
+except ImportError:
+    import timelines
+
+# Cache des pages de feed (invalidation par événements)
+try:
+    import backend.feed_cache as feed_cache
+except ImportError:
+    import feed_cache
+
+# Index en mémoire du graphe d'abonnements
+try:
+    import backend.follow_graph as follow_graph
+except ImportError:
+    import follow_graph
+
+# Classement du feed par engagement (?ranking=engagement)
+try:
+    import backend.ranking as ranking_engine
+except ImportError:
+    import ranking as ranking_engine
+
+# Stockage des médias adressé par contenu (hors MongoDB)
+try:
+    import backend.blob_store as blob_store
+except ImportError:
+    import blob_store
+
+# Uploads en flux, bornés en taille
+try:
+    import backend.uploads as uploads
+except ImportError:
+    import uploads
+
+# Dérivés d'images (tailles d'avatar, miniatures) sur un pool de processus
+try:
+    import backend.derivatives as derivatives
+except ImportError:
+    import derivatives
+
+# Cartes utilisateur (username, avatar) pour compléter les réponses
+try:
+    import backend.user_cards as user_cards
+except ImportError:
+    import user_cards
+
+# Like / unlike atomique (index unique + compteur conditionnel)
+try:
+    import backend.likes as likes
+except ImportError:
+    import likes
+
+# Compteurs en écriture différée ($inc cumulés puis bulk_write)
+try:
+    import backend.counters as counters
+except ImportError:
+    import counters
+
+# Fil de commentaires (commentaires + premières réponses en une requête)
+try:
+    import backend.threads as threads
+except ImportError:
+    import threads
+
+# Recherche indexée (termes normalisés, sans regex)
+try:
+    import backend.search as search_engine
+except ImportError:
+    import search as search_engine
+
+# Autocomplétion des usernames (index trié en mémoire)
+try:
+    import backend.autocomplete as autocomplete
+except ImportError:
+    import autocomplete
+
+# Recherche plein texte des posts (BM25, index en mémoire)
+try:
+    import backend.post_search as post_search
+except ImportError:
+    import post_search
+
+# Hashtags, mentions et tendances
+try:
+    import backend.tags as tags
+except ImportError:
+    import tags
+
+# Suggestions d'abonnement « amis d'amis » (précalculées par build_suggestions.py)
+try:
+    import backend.suggestions as suggestions
+except ImportError:
+    import suggestions
+
+# Notifications temps réel (WebSocket, diffusées entre workers par notification_broker.py)
+try:
+    import backend.Notifications as Notifications
+except ImportError:
+    import Notifications
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
@@ -81,9 +195,21 @@ security = HTTPBearer()
 SECRET_KEY = os.environ.get('SECRET_KEY', '76f267dbc69c6b4e639a50a7ccdd3783')
 ALGORITHM = "HS256"
 
+# Routes de supervision (métriques internes) : jeton X-Metrics-Token ou compte administrateur ;
+# fermées à tous si ni l'un ni l'autre n'est configuré
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+ADMIN_USER_IDS = {u.strip() for u in os.environ.get('ADMIN_USER_IDS', '').split(',') if u.strip()}
+optional_security = HTTPBearer(auto_error=False)
+
 # Create the main app
 app = FastAPI(title="Nexus Social API", version="1.0.0")
 
+# Hôte public des requêtes (URLs absolues des médias, résolues à la sérialisation)
+app.add_middleware(blob_store.MediaBaseURLMiddleware)
+
+# Refus des corps de requête trop volumineux (ajouté avant CORS : les 413 gardent les en-têtes CORS)
+app.add_middleware(uploads.BodySizeLimitMiddleware)
+
 # ==================== CORS ====================
 app.add_middleware(
     CORSMiddleware,
@@ -97,6 +223,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Health check pour Render
@@ -169,16 +296,9 @@ def convert_mongo_doc_to_dict(doc: dict) -> dict:
 async def check_is_following(follower_id: str, followed_id: str) -> bool:
     """
     Vérifie si follower_id suit followed_id
-    Compatible avec ancien format (following_id) et nouveau (followed_id)
     """
-    # Chercher avec les deux formats
-    follow = await db.follows.find_one({
-        "$or": [
-            {"follower_id": follower_id, "followed_id": followed_id},
-            {"follower_id": follower_id, "following_id": followed_id}
-        ]
-    })
-    return bool(follow)
+    # O(1) via le graphe en mémoire (chargé une fois par utilisateur)
+    return await follow_graph.graph.is_following(db, follower_id, followed_id)
 
 
 # Router principal
@@ -201,17 +321,31 @@ class User(BaseModel):
     username: str
     email: str
     bio: str = ""
-    profile_pic: Optional[str] = None
+    profile_pic: blob_store.MediaURL = None
+    profile_pic_sizes: Optional[Dict[str, blob_store.MediaURL]] = None
     followers_count: int = 0
     following_count: int = 0
     created_at: str
 
+class UserSuggestion(BaseModel):
+    id: str
+    username: str
+    profile_pic: blob_store.MediaURL = None
+    is_following: bool = False
+
+class FollowSuggestion(BaseModel):
+    id: str
+    username: str
+    profile_pic: blob_store.MediaURL = None
+    mutual_count: int = 0
+
 class UserProfile(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str
     username: str
     bio: str = ""
-    profile_pic: Optional[str] = None
+    profile_pic: blob_store.MediaURL = None
+    profile_pic_sizes: Optional[Dict[str, blob_store.MediaURL]] = None
     followers_count: int = 0
     following_count: int = 0
     is_following: bool = False
@@ -227,14 +361,15 @@ class Post(BaseModel):
     id: str
     author_id: str
     author_username: str
-    author_profile_pic: Optional[str] = None
+    author_profile_pic: blob_store.MediaURL = None
     content: str
     media_type: Optional[str] = None
-    media_url: Optional[str] = None
+    media_url: blob_store.MediaURL = None
     likes_count: int = 0
     comments_count: int = 0
     shares_count: int = 0
     is_liked: bool = False
+    hashtags: List[str] = []
     created_at: str
 
 class CommentCreate(BaseModel):
@@ -246,10 +381,17 @@ class Comment(BaseModel):
     post_id: str
     author_id: str
     author_username: str
-    author_profile_pic: Optional[str] = None
+    author_profile_pic: blob_store.MediaURL = None
     content: str
+    likes_count: int = 0
+    replies_count: int = 0
+    is_liked: bool = False
     created_at: str
 
+class CommentThread(Comment):
+    replies: List[Comment] = []
+    replies_next_cursor: Optional[str] = None
+
 class MessageCreate(BaseModel):
     recipient_id: str
     content: str
@@ -259,7 +401,7 @@ class Message(BaseModel):
     id: str
     sender_id: str
     sender_username: str
-    sender_profile_pic: Optional[str] = None
+    sender_profile_pic: blob_store.MediaURL = None
     recipient_id: str
     recipient_username: str
     content: str
@@ -269,7 +411,7 @@ class Message(BaseModel):
 class Conversation(BaseModel):
     user_id: str
     username: str
-    profile_pic: Optional[str] = None
+    profile_pic: blob_store.MediaURL = None
     last_message: str
     last_message_time: str
     unread_count: int = 0
@@ -281,7 +423,7 @@ class Notification(BaseModel):
     type: str
     from_user_id: str
     from_username: str
-    from_profile_pic: Optional[str] = None
+    from_profile_pic: blob_store.MediaURL = None
     post_id: Optional[str] = None
     comment_content: Optional[str] = None
     read: bool = False
@@ -296,9 +438,10 @@ class Story(BaseModel):
     id: str
     author_id: str
     author_username: str
-    author_profile_pic: Optional[str] = None
+    author_profile_pic: blob_store.MediaURL = None
     media_type: str
-    media_url: str
+    media_url: blob_store.MediaURL
+    thumbnail_url: blob_store.MediaURL = None
     views_count: int = 0
     created_at: str
     expires_at: str
@@ -307,7 +450,7 @@ class Story(BaseModel):
 class StoryGroup(BaseModel):
     user_id: str
     username: str
-    profile_pic: Optional[str] = None
+    profile_pic: blob_store.MediaURL = None
     stories: List[Story]
     last_story_time: str
 
@@ -351,6 +494,19 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     except Exception as e:
         raise HTTPException(status_code=401, detail=f"Authentication error: {str(e)}")
 
+async def require_metrics_access(
+    x_metrics_token: Optional[str] = Header(None),
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+):
+    """Accès aux métriques internes : jeton de supervision ou administrateur (ADMIN_USER_IDS)"""
+    if METRICS_TOKEN and x_metrics_token and secrets.compare_digest(x_metrics_token, METRICS_TOKEN):
+        return
+    if credentials is not None and ADMIN_USER_IDS:
+        user = await get_current_user(credentials)
+        if user["id"] in ADMIN_USER_IDS:
+            return
+    raise HTTPException(status_code=403, detail="Accès réservé à la supervision")
+
 # ==================== AUTH ROUTES ====================
 @api_router.post("/auth/register")
 async def register(user_data: UserCreate):
@@ -375,9 +531,12 @@ async def register(user_data: UserCreate):
         "profile_pic": None,
         "followers_count": 0,
         "following_count": 0,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "posts_count": 0,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        **search_engine.user_search_fields(user_data.username, user_data.bio)
     }
     await db.users.insert_one(user_to_insert)
+    autocomplete.index.add(user_id, user_data.username)
    
     token = create_access_token({"sub": user_id})
    
@@ -414,7 +573,7 @@ async def login(credentials: UserLogin):
             "username": user["username"],
             "email": user["email"],
             "bio": user.get("bio", ""),
-            "profile_pic": user.get("profile_pic"),
+            "profile_pic": blob_store.resolve_url(user.get("profile_pic")),
             "followers_count": user.get("followers_count", 0),
             "following_count": user.get("following_count", 0),
             "created_at": user["created_at"]
@@ -424,7 +583,9 @@ async def login(credentials: UserLogin):
 @api_router.get("/auth/me", response_model=User)
 async def get_me(current_user: dict = Depends(get_current_user)):
     """Récupère le profil de l'utilisateur actuel"""
-    return User(**current_user)
+    user = dict(current_user)
+    counters.merge("users", [user], "followers_count", "following_count")
+    return User(**user)
 
 @api_router.put("/auth/profile")
 async def update_profile(
@@ -437,17 +598,24 @@ async def update_profile(
    
     if bio is not None:
         update_data["bio"] = bio
+        update_data.update(search_engine.user_search_fields(current_user["username"], bio))
    
     if profile_pic:
-        contents = await profile_pic.read()
-        base64_image = base64.b64encode(contents).decode('utf-8')
-        update_data["profile_pic"] = f"data:{profile_pic.content_type};base64,{base64_image}"
+        _, update_data["profile_pic"] = await uploads.save_upload(profile_pic, allowed_kinds=("image",))
+        # Petites tailles pour les listes (calculées hors de la boucle d'événements)
+        update_data["profile_pic_sizes"] = await derivatives.make_avatar_sizes(update_data["profile_pic"])
    
     if update_data:
         await db.users.update_one({"id": current_user["id"]}, {"$set": update_data})
+    if profile_pic:
+        # Ancien avatar et ses variantes : effacés s'ils ne servent plus ailleurs
+        await blob_store.release(db, [
+            current_user.get("profile_pic"), *(current_user.get("profile_pic_sizes") or {}).values()
+        ])
    
     updated_user_raw = await db.users.find_one({"id": current_user["id"]})
     updated_user = convert_mongo_doc_to_dict(updated_user_raw)
+    user_cards.cache.update(updated_user)
     return User(**updated_user)
 
 @api_router.put("/users/me/privacy")
@@ -500,6 +668,8 @@ async def update_profile_details(
             raise HTTPException(status_code=400, detail="Aucune donnée valide")
         
         update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
+        if "bio" in update_data:
+            update_data.update(search_engine.user_search_fields(current_user["username"], update_data["bio"]))
         
         await db.users.update_one(
             {"id": current_user["id"]},
@@ -647,64 +817,137 @@ async def end_user_session(
 
 # ==================== POSTS ROUTES ====================
 @api_router.post("/posts", response_model=Post)
-async def create_post(post_data: PostCreate, current_user: dict = Depends(get_current_user)):
+async def create_post(
+    post_data: PostCreate,
+    background_tasks: BackgroundTasks,
+    current_user: dict = Depends(get_current_user)
+):
     """Créer un nouveau post"""
     post_id = str(uuid.uuid4())
     now = datetime.now(timezone.utc)
+    # Un média envoyé en data URI part dans le blob store ; le post n'en garde que l'URL
+    uploads.check_data_uri(post_data.media_url)
+    media_url = await blob_store.externalize(post_data.media_url)
+    hashtags, mentioned_usernames = tags.extract(post_data.content)
+    mentioned_ids = await tags.resolve_mentions(db, mentioned_usernames)
     
     post_to_insert = {
         "id": post_id,
         "author_id": current_user["id"],
-        "author_username": current_user["username"],
-        "author_profile_pic": current_user.get("profile_pic"),
         "content": post_data.content,
         "media_type": post_data.media_type,
-        "media_url": post_data.media_url,
+        "media_url": media_url,
         "likes_count": 0,
         "comments_count": 0,
         "shares_count": 0,
-        "created_at": now.isoformat()
+        "hashtags": hashtags,
+        "mentions": mentioned_ids,
+        "created_at": now.isoformat(),
+        **search_engine.post_search_fields(post_data.content)
     }
     
     await db.posts.insert_one(post_to_insert)
+    counters.incr("users", current_user["id"], "posts_count", 1)
+    post_search.index.add(post_to_insert)
+    tags.trending.record(hashtags)
+    background_tasks.add_task(tags.notify_mentions, post_to_insert, mentioned_ids, current_user["username"])
+    await feed_cache.invalidate([current_user["id"]])
+    background_tasks.add_task(timelines.fan_out_post, db, post_to_insert, current_user)
     
     post = convert_mongo_doc_to_dict(post_to_insert)
     post["is_liked"] = False
+    await user_cards.attach_cards(db, [post], "author")
     return Post(**post)
 
 @api_router.get("/posts/feed", response_model=List[Post])
-async def get_posts_feed(current_user: dict = Depends(get_current_user)):
-    """Récupère le feed de posts (seulement des comptes autorisés)"""
-    # Récupère les utilisateurs suivis
-    follows_raw = await db.follows.find({
-        "follower_id": current_user["id"],
-        "status": "following"  # ← IMPORTANT: seulement les follows confirmés
-    }).to_list(length=100)
-    
-    # Support ancien format (following_id) et nouveau (followed_id)
-    followed_user_ids = []
-    for f in follows_raw:
-        f_dict = convert_mongo_doc_to_dict(f)
-        # Essaie followed_id puis following_id (rétrocompatibilité)
-        user_id = f_dict.get("followed_id") or f_dict.get("following_id")
-        if user_id:
-            followed_user_ids.append(user_id)
+async def get_posts_feed(
+    response: Response,
+    background_tasks: BackgroundTasks,
+    limit: int = 50,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    ranking: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Récupère le feed de posts (seulement des comptes autorisés)
     
+    Pagination : ?before=<curseur> / ?after=<curseur>, curseur suivant dans l'en-tête X-Next-Cursor
+    Classement : ?ranking=engagement → top-`limit` des posts récents par score (sans curseur)
+    """
+    if ranking is not None:
+        if ranking != "engagement":
+            raise HTTPException(status_code=400, detail="Unsupported ranking")
+        return await get_ranked_posts_feed(current_user, clamp_limit(limit))
+    
+    # Lecture de la timeline matérialisée (fan-out à l'écriture), via le cache de pages
+    async def read_cached_page():
+        page = await timelines.read_timeline(db, current_user["id"], limit=limit, before=before, after=after)
+        if page is None:
+            return None
+        posts_raw, next_cursor = page
+        posts = [convert_mongo_doc_to_dict(p) for p in posts_raw]
+        await hydrate_posts(db, posts, current_user["id"])
+        return posts, next_cursor
+    
+    cached = await feed_cache.cache.get_or_compute(
+        current_user["id"], ("posts", limit, before, after), read_cached_page
+    )
+    if cached is not None:
+        posts, next_cursor = cached
+        if next_cursor:
+            response.headers[NEXT_CURSOR_HEADER] = next_cursor
+        return [Post(**post) for post in posts]
+    
+    # Sinon : construction à la lecture, puis matérialisation en arrière-plan
+    # Récupère les utilisateurs suivis (graphe en mémoire, sans plafond)
+    followed_user_ids = await follow_graph.get_following_ids(db, current_user["id"])
     followed_user_ids.append(current_user["id"])
     
     # Récupère les posts
-    posts_raw = await db.posts.find({
-        "author_id": {"$in": followed_user_ids}
-    }).sort("created_at", -1).limit(50).to_list(length=50)
-    
-    posts = []
-    for post_raw in posts_raw:
-        post = convert_mongo_doc_to_dict(post_raw)
-        like_raw = await db.likes.find_one({"post_id": post["id"], "user_id": current_user["id"]})
-        post["is_liked"] = bool(like_raw)
-        posts.append(Post(**post))
+    posts_raw, next_cursor = await fetch_page(
+        db.posts,
+        {"author_id": {"$in": followed_user_ids}},
+        limit=limit, before=before, after=after
+    )
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    if not before and not after:
+        background_tasks.add_task(timelines.rebuild_timeline, db, current_user["id"])
+    
+    posts = [convert_mongo_doc_to_dict(p) for p in posts_raw]
+    await hydrate_posts(db, posts, current_user["id"])
+    
+    return [Post(**post) for post in posts]
+
+async def get_ranked_posts_feed(current_user: dict, limit: int) -> List[Post]:
+    """Feed classé par engagement (mis en cache comme les pages chronologiques)"""
+    async def build_ranked_page():
+        author_ids = await follow_graph.get_following_ids(db, current_user["id"])
+        author_ids.append(current_user["id"])
+        posts = [
+            convert_mongo_doc_to_dict(p)
+            for p in await ranking_engine.get_ranked_feed(db, current_user["id"], author_ids, limit)
+        ]
+        await hydrate_posts(db, posts, current_user["id"])
+        return posts
     
-    return posts
+    posts = await feed_cache.cache.get_or_compute(
+        current_user["id"], ("posts", "engagement", limit), build_ranked_page
+    )
+    return [Post(**post) for post in posts]
+
+@api_router.get("/feed/metrics", dependencies=[Depends(require_metrics_access)])
+async def get_feed_metrics():
+    """Métriques du feed hybride (fan-out push / fusion pull) et du cache de pages"""
+    metrics = timelines.metrics.snapshot()
+    metrics["cache"] = feed_cache.cache.snapshot()
+    metrics["follow_graph"] = follow_graph.graph.snapshot()
+    metrics["autocomplete"] = autocomplete.index.snapshot()
+    metrics["post_search"] = post_search.index.snapshot()
+    metrics["trending"] = tags.trending.snapshot()
+    metrics["user_cards"] = user_cards.cache.snapshot()
+    metrics["counters"] = counters.buffer.snapshot()
+    return metrics
 
 @api_router.get("/posts/{post_id}", response_model=Post)
 async def get_post(post_id: str, current_user: dict = Depends(get_current_user)):
@@ -714,12 +957,15 @@ async def get_post(post_id: str, current_user: dict = Depends(get_current_user))
         raise HTTPException(status_code=404, detail="Post not found")
     
     post = convert_mongo_doc_to_dict(post_raw)
-    like_raw = await db.likes.find_one({"post_id": post["id"], "user_id": current_user["id"]})
-    post["is_liked"] = bool(like_raw)
+    await hydrate_posts(db, [post], current_user["id"])
     return Post(**post)
 
 @api_router.delete("/posts/{post_id}")
-async def delete_post(post_id: str, current_user: dict = Depends(get_current_user)):
+async def delete_post(
+    post_id: str,
+    background_tasks: BackgroundTasks,
+    current_user: dict = Depends(get_current_user)
+):
     """Supprime un post"""
     post_raw = await db.posts.find_one({"id": post_id})
     if not post_raw:
@@ -729,66 +975,78 @@ async def delete_post(post_id: str, current_user: dict = Depends(get_current_use
     if post["author_id"] != current_user["id"]:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    await db.posts.delete_one({"id": post_id})
+    result = await db.posts.delete_one({"id": post_id})
+    if result.deleted_count:
+        counters.incr("users", current_user["id"], "posts_count", -1)
+    post_search.index.remove(post_id)
+    await post_search.record_deletions(db, [post_id])
     await db.likes.delete_many({"post_id": post_id})
     await db.comments.delete_many({"post_id": post_id})
+    await feed_cache.invalidate([current_user["id"]])
+    background_tasks.add_task(timelines.retract_post, db, post_id, current_user["id"])
+    background_tasks.add_task(blob_store.release, db, [post.get("media_url")])
     
     return {"message": "Post deleted successfully"}
 
 @api_router.post("/posts/{post_id}/like")
 async def like_post(post_id: str, current_user: dict = Depends(get_current_user)):
     """Like/unlike un post"""
-    post_raw = await db.posts.find_one({"id": post_id})
-    if not post_raw:
+    def side_effects(post: dict, liked: bool):
+        effects = [feed_cache.invalidate([current_user["id"]])]
+        # Créer une notification
+        if liked:
+            effects.append(Notifications.notify_like(
+                post["author_id"], current_user["id"], current_user["username"], post_id
+            ))
+        return effects
+    
+    result = await likes.toggle_like(db, "post", post_id, current_user["id"], side_effects)
+    if result is None:
         raise HTTPException(status_code=404, detail="Post not found")
     
-    like_raw = await db.likes.find_one({"post_id": post_id, "user_id": current_user["id"]})
-    
-    if like_raw:
-        # Unlike
-        await db.likes.delete_one({"post_id": post_id, "user_id": current_user["id"]})
-        await db.posts.update_one({"id": post_id}, {"$inc": {"likes_count": -1}})
-        return {"liked": False}
-    else:
-        # Like
-        like_id = str(uuid.uuid4())
-        await db.likes.insert_one({
-            "id": like_id,
-            "post_id": post_id,
-            "user_id": current_user["id"],
-            "created_at": datetime.now(timezone.utc).isoformat()
-        })
-        await db.posts.update_one({"id": post_id}, {"$inc": {"likes_count": 1}})
-        
-        # Créer une notification
-        post = convert_mongo_doc_to_dict(post_raw)
-        if post["author_id"] != current_user["id"]:
-            notif_id = str(uuid.uuid4())
-            await db.notifications.insert_one({
-                "id": notif_id,
-                "user_id": post["author_id"],
-                "type": "like",
-                "from_user_id": current_user["id"],
-                "from_username": current_user["username"],
-                "from_profile_pic": current_user.get("profile_pic"),
-                "post_id": post_id,
-                "read": False,
-                "created_at": datetime.now(timezone.utc).isoformat()
-            })
-        
-        return {"liked": True}
+    return {"liked": result.liked}
 
 @api_router.get("/posts/{post_id}/comments", response_model=List[Comment])
-async def get_post_comments(post_id: str, current_user: dict = Depends(get_current_user)):
-    """Récupère les commentaires d'un post"""
-    comments_raw = await db.comments.find({"post_id": post_id}).sort("created_at", -1).to_list(length=100)
-    
-    comments = []
-    for comment_raw in comments_raw:
-        comment = convert_mongo_doc_to_dict(comment_raw)
-        comments.append(Comment(**comment))
+async def get_post_comments(
+    post_id: str,
+    response: Response,
+    limit: int = 50,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Récupère les commentaires d'un post (paginé, curseur suivant dans X-Next-Cursor)"""
+    comments_raw, next_cursor = await fetch_page(
+        db.comments, {"post_id": post_id},
+        limit=limit, before=before, after=after
+    )
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    
+    comments = [convert_mongo_doc_to_dict(c) for c in comments_raw]
+    await hydrate_comments(db, comments, current_user["id"])
+    
+    return [Comment(**comment) for comment in comments]
+
+@api_router.get("/posts/{post_id}/thread", response_model=List[CommentThread])
+async def get_post_thread(
+    post_id: str,
+    response: Response,
+    limit: int = 50,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    replies: int = threads.DEFAULT_REPLIES_PER_COMMENT,
+    current_user: dict = Depends(get_current_user)
+):
+    """Commentaires d'un post avec leurs premières réponses (curseur des réponses suivantes par commentaire)"""
+    comments, next_cursor = await threads.load_thread(
+        db, post_id, current_user["id"],
+        limit=limit, before=before, after=after, replies=replies
+    )
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     
-    return comments
+    return [CommentThread(**comment) for comment in comments]
 
 @api_router.post("/posts/{post_id}/comments", response_model=Comment)
 async def create_comment(post_id: str, comment_data: CommentCreate, current_user: dict = Depends(get_current_user)):
@@ -802,33 +1060,21 @@ async def create_comment(post_id: str, comment_data: CommentCreate, current_user
         "id": comment_id,
         "post_id": post_id,
         "author_id": current_user["id"],
-        "author_username": current_user["username"],
-        "author_profile_pic": current_user.get("profile_pic"),
         "content": comment_data.content,
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     
     await db.comments.insert_one(comment_to_insert)
-    await db.posts.update_one({"id": post_id}, {"$inc": {"comments_count": 1}})
+    counters.incr("posts", post_id, "comments_count", 1)
     
     # Créer une notification
     post = convert_mongo_doc_to_dict(post_raw)
-    if post["author_id"] != current_user["id"]:
-        notif_id = str(uuid.uuid4())
-        await db.notifications.insert_one({
-            "id": notif_id,
-            "user_id": post["author_id"],
-            "type": "comment",
-            "from_user_id": current_user["id"],
-            "from_username": current_user["username"],
-            "from_profile_pic": current_user.get("profile_pic"),
-            "post_id": post_id,
-            "comment_content": comment_data.content,
-            "read": False,
-            "created_at": datetime.now(timezone.utc).isoformat()
-        })
+    await Notifications.notify_comment(
+        post["author_id"], current_user["id"], current_user["username"], post_id, comment_data.content
+    )
     
     comment = convert_mongo_doc_to_dict(comment_to_insert)
+    await user_cards.attach_cards(db, [comment], "author")
     return Comment(**comment)
 
 @api_router.delete("/posts/{post_id}/comments/{comment_id}")
@@ -843,47 +1089,39 @@ async def delete_comment(post_id: str, comment_id: str, current_user: dict = Dep
         raise HTTPException(status_code=403, detail="Not authorized")
     
     await db.comments.delete_one({"id": comment_id})
-    await db.posts.update_one({"id": post_id}, {"$inc": {"comments_count": -1}})
+    counters.incr("posts", post_id, "comments_count", -1)
     
     return {"message": "Comment deleted successfully"}
 
 @api_router.post("/comments/{comment_id}/like")
 async def like_comment(comment_id: str, current_user: dict = Depends(get_current_user)):
     """Like/unlike un commentaire"""
-    comment_raw = await db.comments.find_one({"id": comment_id})
-    if not comment_raw:
+    result = await likes.toggle_like(db, "comment", comment_id, current_user["id"])
+    if result is None:
         raise HTTPException(status_code=404, detail="Comment not found")
     
-    like_raw = await db.comment_likes.find_one({"comment_id": comment_id, "user_id": current_user["id"]})
-    
-    if like_raw:
-        # Unlike
-        await db.comment_likes.delete_one({"comment_id": comment_id, "user_id": current_user["id"]})
-        await db.comments.update_one({"id": comment_id}, {"$inc": {"likes_count": -1}})
-        return {"liked": False}
-    else:
-        # Like
-        like_id = str(uuid.uuid4())
-        await db.comment_likes.insert_one({
-            "id": like_id,
-            "comment_id": comment_id,
-            "user_id": current_user["id"],
-            "created_at": datetime.now(timezone.utc).isoformat()
-        })
-        await db.comments.update_one({"id": comment_id}, {"$inc": {"likes_count": 1}})
-        return {"liked": True}
+    return {"liked": result.liked}
 
 @api_router.get("/comments/{comment_id}/replies")
-async def get_comment_replies(comment_id: str, current_user: dict = Depends(get_current_user)):
-    """Récupère les réponses d'un commentaire"""
-    replies_raw = await db.comment_replies.find({"parent_comment_id": comment_id}).sort("created_at", 1).to_list(length=100)
+async def get_comment_replies(
+    comment_id: str,
+    response: Response,
+    limit: int = 50,
+    after: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Récupère les réponses d'un commentaire (ordre chronologique, suite via `after`)"""
+    replies_raw, next_cursor = await fetch_page(
+        db.comment_replies, {"parent_comment_id": comment_id},
+        limit=limit, after=after, oldest_first=True
+    )
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     
-    replies = []
-    for reply_raw in replies_raw:
-        reply = convert_mongo_doc_to_dict(reply_raw)
-        replies.append(Comment(**reply))
+    replies = [convert_mongo_doc_to_dict(r) for r in replies_raw]
+    await hydrate_comments(db, replies, current_user["id"])
     
-    return replies
+    return [Comment(**reply) for reply in replies]
 
 @api_router.post("/comments/{comment_id}/replies")
 async def create_comment_reply(comment_id: str, reply_data: CommentCreate, current_user: dict = Depends(get_current_user)):
@@ -898,31 +1136,56 @@ async def create_comment_reply(comment_id: str, reply_data: CommentCreate, curre
         "parent_comment_id": comment_id,
         "post_id": convert_mongo_doc_to_dict(comment_raw)["post_id"],
         "author_id": current_user["id"],
-        "author_username": current_user["username"],
-        "author_profile_pic": current_user.get("profile_pic"),
         "content": reply_data.content,
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     
     await db.comment_replies.insert_one(reply_to_insert)
-    await db.comments.update_one({"id": comment_id}, {"$inc": {"replies_count": 1}})
+    counters.incr("comments", comment_id, "replies_count", 1)
     
     reply = convert_mongo_doc_to_dict(reply_to_insert)
+    await user_cards.attach_cards(db, [reply], "author")
     return Comment(**reply)
 
 # ==================== USERS ROUTES ====================
-@api_router.get("/users/search")
-async def search_users(q: str, current_user: dict = Depends(get_current_user)):
-    """Recherche des utilisateurs"""
-    if not q or len(q.strip()) == 0:
+@api_router.get("/users/autocomplete", response_model=List[UserSuggestion])
+async def autocomplete_users(
+    prefix: str,
+    limit: int = autocomplete.DEFAULT_SUGGESTIONS,
+    current_user: dict = Depends(get_current_user)
+):
+    """Suggestions de usernames pendant la frappe (index en mémoire, sans requête de recherche)"""
+    await autocomplete.index.ensure_loaded(db)
+    user_ids = autocomplete.index.lookup(prefix, autocomplete.clamp_suggestions(limit))
+    if not user_ids:
         return []
     
-    users_raw = await db.users.find({
-        "$or": [
-            {"username": {"$regex": q, "$options": "i"}},
-            {"bio": {"$regex": q, "$options": "i"}}
-        ]
-    }).limit(20).to_list(length=20)
+    # Cartes (cache) et état d'abonnement (un seul ensemble) pour toutes les suggestions
+    cards = await user_cards.cache.get_many(db, user_ids)
+    following = await follow_graph.graph.following(db, current_user["id"])
+    return [
+        UserSuggestion(**cards[user_id], is_following=user_id in following)
+        for user_id in user_ids if user_id in cards
+    ]
+
+@api_router.get("/users/suggestions", response_model=List[FollowSuggestion])
+async def get_follow_suggestions(
+    limit: int = suggestions.DEFAULT_SUGGESTIONS,
+    current_user: dict = Depends(get_current_user)
+):
+    """Comptes à suivre : amis d'amis précalculés, puis comptes les plus suivis"""
+    following = await follow_graph.graph.following(db, current_user["id"])
+    rows = await suggestions.suggest(db, current_user["id"], following, suggestions.clamp_suggestions(limit))
+    cards = await user_cards.cache.get_many(db, [s["user_id"] for s in rows])
+    return [
+        FollowSuggestion(**cards[s["user_id"]], mutual_count=s["mutual"])
+        for s in rows if s["user_id"] in cards
+    ]
+
+@api_router.get("/users/search")
+async def search_users(q: str, current_user: dict = Depends(get_current_user)):
+    """Recherche des utilisateurs (username / bio, par préfixe de mot)"""
+    users_raw = await search_engine.search_users(db, q, limit=20)
     
     users = []
     for user_raw in users_raw:
@@ -932,7 +1195,7 @@ async def search_users(q: str, current_user: dict = Depends(get_current_user)):
             id=user["id"],
             username=user["username"],
             bio=user.get("bio", ""),
-            profile_pic=user.get("profile_pic"),
+            profile_pic=derivatives.list_avatar(user),
             followers_count=user.get("followers_count", 0),
             following_count=user.get("following_count", 0),
             is_following=is_following,
@@ -949,6 +1212,7 @@ async def get_user_profile(user_id: str, current_user: dict = Depends(get_curren
         raise HTTPException(status_code=404, detail="User not found")
     
     user = convert_mongo_doc_to_dict(user_raw)
+    counters.merge("users", [user], "followers_count", "following_count")
     is_following = await check_is_following(current_user["id"], user_id)
     
     return UserProfile(
@@ -963,8 +1227,15 @@ async def get_user_profile(user_id: str, current_user: dict = Depends(get_curren
     )
 
 @api_router.get("/users/{user_id}/posts", response_model=List[Post])
-async def get_user_posts(user_id: str, current_user: dict = Depends(get_current_user)):
-    """Récupère les posts d'un utilisateur (avec vérification privacy)"""
+async def get_user_posts(
+    user_id: str,
+    response: Response,
+    limit: int = 50,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Récupère les posts d'un utilisateur (avec vérification privacy, paginé)"""
     
     # Vérifier si c'est son propre profil
     is_own_profile = current_user["id"] == user_id
@@ -987,16 +1258,17 @@ async def get_user_posts(user_id: str, current_user: dict = Depends(get_current_
                 )
     
     # Récupérer les posts
-    posts_raw = await db.posts.find({"author_id": user_id}).sort("created_at", -1).to_list(length=50)
+    posts_raw, next_cursor = await fetch_page(
+        db.posts, {"author_id": user_id},
+        limit=limit, before=before, after=after
+    )
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     
-    posts = []
-    for post_raw in posts_raw:
-        post = convert_mongo_doc_to_dict(post_raw)
-        like_raw = await db.likes.find_one({"post_id": post["id"], "user_id": current_user["id"]})
-        post["is_liked"] = bool(like_raw)
-        posts.append(Post(**post))
+    posts = [convert_mongo_doc_to_dict(p) for p in posts_raw]
+    await hydrate_posts(db, posts, current_user["id"])
     
-    return posts
+    return [Post(**post) for post in posts]
 
 # ==================== USER SETTINGS ROUTES ====================
 @api_router.put("/users/me/email")
@@ -1076,8 +1348,13 @@ async def update_username(
     
     await db.users.update_one(
         {"id": current_user["id"]},
-        {"$set": {"username": new_username}}
+        {"$set": {
+            "username": new_username,
+            **search_engine.user_search_fields(new_username, current_user.get("bio"))
+        }}
     )
+    user_cards.cache.update({**current_user, "username": new_username})
+    autocomplete.index.add(current_user["id"], new_username)
     
     return {"message": "Username updated successfully"}
 
@@ -1086,14 +1363,31 @@ async def delete_account(current_user: dict = Depends(get_current_user)):
     """Supprimer le compte utilisateur"""
     user_id = current_user["id"]
     
+    # Médias de l'utilisateur (avatar, posts, stories), effacés après ses documents
+    media = await blob_store.referenced_by(db, "users", {"id": user_id})
+    media += await blob_store.referenced_by(db, "posts", {"author_id": user_id})
+    media += await blob_store.referenced_by(db, "stories", {"author_id": user_id})
+    
     # Supprimer toutes les données de l'utilisateur
     await db.users.delete_one({"id": user_id})
+    post_ids = await db.posts.distinct("id", {"author_id": user_id})
     await db.posts.delete_many({"author_id": user_id})
+    for post_id in post_ids:
+        post_search.index.remove(post_id)
+    await post_search.record_deletions(db, post_ids)
     await db.comments.delete_many({"author_id": user_id})
     await db.likes.delete_many({"user_id": user_id})
-    await db.follows.delete_many({"$or": [{"follower_id": user_id}, {"followed_id": user_id}]})
+    await follow_graph.delete_user_edges(db, user_id)
+    follow_graph.graph.drop_user(user_id)
+    await db[suggestions.SUGGESTIONS].delete_one({"user_id": user_id})
+    user_cards.cache.invalidate(user_id)
+    autocomplete.index.remove(user_id)
     await db.messages.delete_many({"$or": [{"sender_id": user_id}, {"recipient_id": user_id}]})
     await db.notifications.delete_many({"$or": [{"user_id": user_id}, {"from_user_id": user_id}]})
+    story_ids = await db.stories.distinct("id", {"author_id": user_id})
+    await db.stories.delete_many({"author_id": user_id})
+    await db.story_views.delete_many({"$or": [{"story_id": {"$in": story_ids}}, {"user_id": user_id}]})
+    await blob_store.release(db, media)
     
     return {"message": "Account deleted successfully"}
 
@@ -1117,31 +1411,38 @@ async def get_liked_posts(current_user: dict = Depends(get_current_user)):
     """Récupère les publications aimées par l'utilisateur"""
     likes_raw = await db.likes.find({"user_id": current_user["id"]}).sort("created_at", -1).to_list(length=100)
     
-    posts = []
-    for like_raw in likes_raw:
-        like = convert_mongo_doc_to_dict(like_raw)
-        post_raw = await db.posts.find_one({"id": like["post_id"]})
-        if post_raw:
-            post = convert_mongo_doc_to_dict(post_raw)
-            post["is_liked"] = True
-            posts.append(Post(**post))
+    post_ids = [like["post_id"] for like in likes_raw]
+    posts_raw = await db.posts.find({"id": {"$in": post_ids}}).to_list(length=len(post_ids))
+    by_id = {p["id"]: convert_mongo_doc_to_dict(p) for p in posts_raw}
+    
+    posts = [by_id[post_id] for post_id in post_ids if post_id in by_id]
+    await user_cards.attach_cards(db, posts, "author")
+    counters.merge("posts", posts, "likes_count", "comments_count")
+    for post in posts:
+        post["is_liked"] = True
     
-    return posts
+    return [Post(**post) for post in posts]
 
 @api_router.get("/users/me/comments")
 async def get_user_comments(current_user: dict = Depends(get_current_user)):
     """Récupère tous les commentaires de l'utilisateur"""
     comments_raw = await db.comments.find({"author_id": current_user["id"]}).sort("created_at", -1).to_list(length=100)
     
+    # Auteur de chaque post commenté (une requête posts + cartes)
+    post_ids = list({c["post_id"] for c in comments_raw})
+    posts = await db.posts.find(
+        {"id": {"$in": post_ids}}, {"id": 1, "author_id": 1, "_id": 0}
+    ).to_list(length=len(post_ids))
+    await user_cards.attach_cards(db, posts, "author")
+    post_authors = {p["id"]: p["author_username"] for p in posts}
+    
     comments = []
     for comment_raw in comments_raw:
         comment = convert_mongo_doc_to_dict(comment_raw)
-        # Récupérer l'auteur du post
-        post_raw = await db.posts.find_one({"id": comment["post_id"]})
-        if post_raw:
-            post = convert_mongo_doc_to_dict(post_raw)
-            comment["post_author"] = post["author_username"]
+        if comment["post_id"] in post_authors:
+            comment["post_author"] = post_authors[comment["post_id"]]
             comments.append(comment)
+    await user_cards.attach_cards(db, comments, "author")
     
     return comments
 
@@ -1167,7 +1468,11 @@ async def get_time_stats(current_user: dict = Depends(get_current_user)):
     }
 
 @api_router.post("/users/{user_id}/follow")
-async def follow_user(user_id: str, current_user: dict = Depends(get_current_user)):
+async def follow_user(
+    user_id: str,
+    background_tasks: BackgroundTasks,
+    current_user: dict = Depends(get_current_user)
+):
     """Follow/unfollow un utilisateur"""
     if user_id == current_user["id"]:
         raise HTTPException(status_code=400, detail="Cannot follow yourself")
@@ -1181,48 +1486,60 @@ async def follow_user(user_id: str, current_user: dict = Depends(get_current_use
     if existing_follow_raw:
         # Unfollow
         await db.follows.delete_one({"follower_id": current_user["id"], "followed_id": user_id})
-        await db.users.update_one({"id": current_user["id"]}, {"$inc": {"following_count": -1}})
-        await db.users.update_one({"id": user_id}, {"$inc": {"followers_count": -1}})
+        follow_graph.graph.remove_edge(current_user["id"], user_id)
+        counters.incr("users", current_user["id"], "following_count", -1)
+        counters.incr("users", user_id, "followers_count", -1)
+        await feed_cache.invalidate([current_user["id"]])
+        background_tasks.add_task(timelines.prune_author, db, current_user["id"], user_id)
+        background_tasks.add_task(suggestions.mark_dirty, db, [current_user["id"]])
         return {"following": False}
     else:
         # Follow
         follow_id = str(uuid.uuid4())
-        await db.follows.insert_one({
-            "id": follow_id,
-            "follower_id": current_user["id"],
-            "followed_id": user_id,
-            "created_at": datetime.now(timezone.utc).isoformat()
-        })
-        await db.users.update_one({"id": current_user["id"]}, {"$inc": {"following_count": 1}})
-        await db.users.update_one({"id": user_id}, {"$inc": {"followers_count": 1}})
+        try:
+            await db.follows.insert_one({
+                "id": follow_id,
+                "follower_id": current_user["id"],
+                "followed_id": user_id,
+                "status": "following",
+                "created_at": datetime.now(timezone.utc).isoformat()
+            })
+        except DuplicateKeyError:
+            # Requête concurrente : l'abonnement existe déjà (index unique)
+            return {"following": True}
+        follow_graph.graph.add_edge(current_user["id"], user_id)
+        counters.incr("users", current_user["id"], "following_count", 1)
+        counters.incr("users", user_id, "followers_count", 1)
+        await feed_cache.invalidate([current_user["id"]])
+        background_tasks.add_task(timelines.backfill_author, db, current_user["id"], user_id)
+        background_tasks.add_task(suggestions.mark_dirty, db, [current_user["id"]])
         
-        # Créer une notification
-        notif_id = str(uuid.uuid4())
-        await db.notifications.insert_one({
-            "id": notif_id,
-            "user_id": user_id,
-            "type": "follow",
-            "from_user_id": current_user["id"],
-            "from_username": current_user["username"],
-            "from_profile_pic": current_user.get("profile_pic"),
-            "read": False,
-            "created_at": datetime.now(timezone.utc).isoformat()
-        })
+        # Créer une notification (enregistrée et envoyée en temps réel)
+        await Notifications.notify_follow(user_id, current_user["id"], current_user["username"])
         
         return {"following": True}
 
 # ==================== NOTIFICATIONS ROUTES ====================
 @api_router.get("/notifications", response_model=List[Notification])
-async def get_notifications(current_user: dict = Depends(get_current_user)):
-    """Récupère les notifications de l'utilisateur"""
-    notifications_raw = await db.notifications.find({"user_id": current_user["id"]}).sort("created_at", -1).limit(50).to_list(length=50)
+async def get_notifications(
+    response: Response,
+    limit: int = 50,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Récupère les notifications de l'utilisateur (paginé, curseur suivant dans X-Next-Cursor)"""
+    notifications_raw, next_cursor = await fetch_page(
+        db.notifications, {"user_id": current_user["id"]},
+        limit=limit, before=before, after=after
+    )
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     
-    notifications = []
-    for notif_raw in notifications_raw:
-        notif = convert_mongo_doc_to_dict(notif_raw)
-        notifications.append(Notification(**notif))
+    notifications = [convert_mongo_doc_to_dict(n) for n in notifications_raw]
+    await user_cards.attach_cards(db, notifications, "from")
     
-    return notifications
+    return [Notification(**notif) for notif in notifications]
 
 @api_router.put("/notifications/{notification_id}/read")
 async def mark_notification_read(notification_id: str, current_user: dict = Depends(get_current_user)):
@@ -1249,15 +1566,19 @@ async def get_conversations(current_user: dict = Depends(get_current_user)):
         ]
     }).sort("created_at", -1).to_list(length=1000)
     
+    # Cartes de tous les interlocuteurs en une requête
+    cards = await user_cards.cache.get_many(
+        db, (m["recipient_id"] if m["sender_id"] == current_user["id"] else m["sender_id"] for m in messages_raw)
+    )
+    
     conversations_dict = {}
     for msg_raw in messages_raw:
         msg = convert_mongo_doc_to_dict(msg_raw)
         other_user_id = msg["recipient_id"] if msg["sender_id"] == current_user["id"] else msg["sender_id"]
         
         if other_user_id not in conversations_dict:
-            other_user_raw = await db.users.find_one({"id": other_user_id})
-            if other_user_raw:
-                other_user = convert_mongo_doc_to_dict(other_user_raw)
+            other_user = cards.get(other_user_id)
+            if other_user:
                 unread_count = await db.messages.count_documents({
                     "sender_id": other_user_id,
                     "recipient_id": current_user["id"],
@@ -1267,7 +1588,7 @@ async def get_conversations(current_user: dict = Depends(get_current_user)):
                 conversations_dict[other_user_id] = Conversation(
                     user_id=other_user["id"],
                     username=other_user["username"],
-                    profile_pic=other_user.get("profile_pic"),
+                    profile_pic=other_user["profile_pic"],
                     last_message=msg["content"],
                     last_message_time=msg["created_at"],
                     unread_count=unread_count
@@ -1276,19 +1597,34 @@ async def get_conversations(current_user: dict = Depends(get_current_user)):
     return list(conversations_dict.values())
 
 @api_router.get("/messages/{user_id}", response_model=List[Message])
-async def get_messages_with_user(user_id: str, current_user: dict = Depends(get_current_user)):
-    """Récupère les messages avec un utilisateur spécifique"""
-    messages_raw = await db.messages.find({
-        "$or": [
+async def get_messages_with_user(
+    user_id: str,
+    response: Response,
+    limit: int = 50,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Récupère les messages avec un utilisateur spécifique
+    
+    Renvoie les `limit` derniers messages en ordre chronologique ;
+    ?before=<X-Next-Cursor> charge l'historique plus ancien.
+    """
+    messages_raw, next_cursor = await fetch_page(
+        db.messages,
+        {"$or": [
             {"sender_id": current_user["id"], "recipient_id": user_id},
             {"sender_id": user_id, "recipient_id": current_user["id"]}
-        ]
-    }).sort("created_at", 1).to_list(length=100)
+        ]},
+        limit=limit, before=before, after=after
+    )
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    messages_raw.reverse()  # affichage chronologique
     
-    messages = []
-    for msg_raw in messages_raw:
-        msg = convert_mongo_doc_to_dict(msg_raw)
-        messages.append(Message(**msg))
+    messages = [convert_mongo_doc_to_dict(m) for m in messages_raw]
+    await user_cards.attach_cards(db, messages, "sender", "recipient")
+    messages = [Message(**msg) for msg in messages]
     
     # Marquer les messages reçus comme lus
     await db.messages.update_many(
@@ -1305,16 +1641,12 @@ async def send_message(message_data: MessageCreate, current_user: dict = Depends
     if not recipient_raw:
         raise HTTPException(status_code=404, detail="Recipient not found")
     
-    recipient = convert_mongo_doc_to_dict(recipient_raw)
     message_id = str(uuid.uuid4())
     
     message_to_insert = {
         "id": message_id,
         "sender_id": current_user["id"],
-        "sender_username": current_user["username"],
-        "sender_profile_pic": current_user.get("profile_pic"),
         "recipient_id": message_data.recipient_id,
-        "recipient_username": recipient["username"],
         "content": message_data.content,
         "read": False,
         "created_at": datetime.now(timezone.utc).isoformat()
@@ -1323,22 +1655,15 @@ async def send_message(message_data: MessageCreate, current_user: dict = Depends
     await db.messages.insert_one(message_to_insert)
     
     message = convert_mongo_doc_to_dict(message_to_insert)
+    await user_cards.attach_cards(db, [message], "sender", "recipient")
     return Message(**message)
 
 # ==================== SEARCH ROUTES ====================
 @api_router.get("/search")
 async def search(q: str, current_user: dict = Depends(get_current_user)):
     """Recherche globale (utilisateurs et posts)"""
-    if not q or len(q.strip()) == 0:
-        return {"users": [], "posts": []}
-    
     # Search users
-    users_raw = await db.users.find({
-        "$or": [
-            {"username": {"$regex": q, "$options": "i"}},
-            {"bio": {"$regex": q, "$options": "i"}}
-        ]
-    }).limit(10).to_list(length=10)
+    users_raw = await search_engine.search_users(db, q, limit=10)
     
     users = []
     for user_raw in users_raw:
@@ -1348,7 +1673,7 @@ async def search(q: str, current_user: dict = Depends(get_current_user)):
             id=user["id"],
             username=user["username"],
             bio=user.get("bio", ""),
-            profile_pic=user.get("profile_pic"),
+            profile_pic=derivatives.list_avatar(user),
             followers_count=user.get("followers_count", 0),
             following_count=user.get("following_count", 0),
             is_following=is_following,
@@ -1356,22 +1681,62 @@ async def search(q: str, current_user: dict = Depends(get_current_user)):
         ))
     
     # Search posts
-    posts_raw = await db.posts.find({
-        "content": {"$regex": q, "$options": "i"}
-    }).sort("created_at", -1).limit(20).to_list(length=20)
-    
-    posts = []
-    for post_raw in posts_raw:
-        post = convert_mongo_doc_to_dict(post_raw)
-        like_raw = await db.likes.find_one({"post_id": post["id"], "user_id": current_user["id"]})
-        post["is_liked"] = bool(like_raw)
-        posts.append(Post(**post))
+    posts, _ = await post_search.search_page(db, q, current_user["id"], limit=20)
+    await hydrate_posts(db, posts, current_user["id"])
+    posts = [Post(**post) for post in posts]
     
     return {"users": users, "posts": posts}
 
+@api_router.get("/search/posts", response_model=List[Post])
+async def search_posts(
+    q: str,
+    response: Response,
+    limit: int = post_search.DEFAULT_RESULTS,
+    cursor: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Recherche de posts classée par pertinence (BM25), page suivante via X-Next-Cursor"""
+    posts, next_cursor = await post_search.search_page(db, q, current_user["id"], limit=limit, cursor=cursor)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    
+    await hydrate_posts(db, posts, current_user["id"])
+    return [Post(**post) for post in posts]
+
+# ==================== TAGS ROUTES ====================
+@api_router.get("/tags/trending")
+async def get_trending_tags(limit: int = tags.DEFAULT_TRENDING, current_user: dict = Depends(get_current_user)):
+    """Hashtags en tendance (fenêtre glissante, sans parcours des posts)"""
+    return await tags.trending.top(tags.clamp_trending(limit))
+
+@api_router.get("/tags/{tag}/posts", response_model=List[Post])
+async def get_tag_posts(
+    tag: str,
+    response: Response,
+    limit: int = 50,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Posts d'un hashtag, du plus récent au plus ancien (curseur suivant dans X-Next-Cursor)"""
+    posts, next_cursor = await fetch_page(
+        db.posts, {"hashtags": tags.normalize_tag(tag)},
+        limit=limit, before=before, after=after
+    )
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    
+    # Auteurs privés : visibles seulement de leurs abonnés
+    following = await follow_graph.graph.following(db, current_user["id"])
+    hidden = await post_search.hidden_authors(db, (p["author_id"] for p in posts), current_user["id"], following)
+    posts = [convert_mongo_doc_to_dict(p) for p in posts if p["author_id"] not in hidden]
+    await hydrate_posts(db, posts, current_user["id"])
+    return [Post(**post) for post in posts]
+
 # ==================== STORIES ROUTES ====================
 @api_router.post("/stories", response_model=Story)
 async def create_story(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(None),
     media_type: str = Form(None),
     media_url: str = Form(None),
@@ -1384,60 +1749,56 @@ async def create_story(
     
     # CAS 1: Upload de fichier
     if file:
-        content_type = file.content_type
-        if content_type.startswith('image'):
-            media_type = 'image'
-        elif content_type.startswith('video'):
-            media_type = 'video'
-        else:
-            raise HTTPException(status_code=400, detail="Type de fichier non supporté")
-        
-        # Lire et convertir en base64
-        file_content = await file.read()
-        media_url = f"data:{content_type};base64,{base64.b64encode(file_content).decode()}"
+        # Copie en flux vers le blob store (type reconnu sur les premiers octets, taille bornée)
+        media_type, media_url = await uploads.save_upload(file)
     
     # CAS 2: URL fournie directement (ancien système)
     elif media_url and media_type:
-        pass  # Utilise les valeurs fournies
+        uploads.check_data_uri(media_url)
+        media_url = await blob_store.externalize(media_url)
     
     else:
         raise HTTPException(status_code=400, detail="Fichier ou URL requis")
     
+    # Miniature pour les aperçus (stories image du blob store uniquement)
+    thumbnail_url = None
+    if media_type == "image":
+        thumbnail_url = await derivatives.make_story_thumbnail(media_url)
+    
     story_to_insert = {
         "id": story_id,
         "author_id": current_user["id"],
-        "author_username": current_user["username"],
-        "author_profile_pic": current_user.get("profile_pic"),
         "media_type": media_type,
         "media_url": media_url,
+        "thumbnail_url": thumbnail_url,
         "views_count": 0,
         "created_at": now.isoformat(),
         "expires_at": expires_at.isoformat()
     }
     
     await db.stories.insert_one(story_to_insert)
+    await feed_cache.invalidate([current_user["id"]])
+    background_tasks.add_task(timelines.invalidate_followers, db, current_user["id"])
     
     story = convert_mongo_doc_to_dict(story_to_insert)
     story["has_viewed"] = False
+    await user_cards.attach_cards(db, [story], "author")
     return Story(**story)
 
 @api_router.get("/stories/feed", response_model=List[StoryGroup])
 async def get_stories_feed(current_user: dict = Depends(get_current_user)):
     """Récupère les stories du feed (utilisateurs suivis + propres stories)"""
+    groups = await feed_cache.cache.get_or_compute(
+        current_user["id"], ("stories",), lambda: build_stories_feed(current_user)
+    )
+    return [StoryGroup(**group) for group in groups]
+
+async def build_stories_feed(current_user: dict) -> List[dict]:
+    """Assemble les groupes de stories du feed (mis en cache par get_stories_feed)"""
     now = datetime.now(timezone.utc).isoformat()
     
     # Récupère les utilisateurs suivis + l'utilisateur actuel
-    follows_raw = await db.follows.find({"follower_id": current_user["id"]}).to_list(length=100)
-    
-    # Support ancien format (following_id) et nouveau (followed_id)
-    followed_user_ids = []
-    for f in follows_raw:
-        f_dict = convert_mongo_doc_to_dict(f)
-        # Essaie followed_id puis following_id (rétrocompatibilité)
-        user_id = f_dict.get("followed_id") or f_dict.get("following_id")
-        if user_id:
-            followed_user_ids.append(user_id)
-    
+    followed_user_ids = await follow_graph.get_following_ids(db, current_user["id"])
     followed_user_ids.append(current_user["id"])  # Ajoute l'utilisateur actuel
     
     # Récupère toutes les stories non expirées des utilisateurs suivis
@@ -1446,19 +1807,15 @@ async def get_stories_feed(current_user: dict = Depends(get_current_user)):
         "expires_at": {"$gt": now}
     }).sort("created_at", -1).to_list(length=1000)
     
+    # Vérifie en une requête les stories déjà vues
+    stories = [convert_mongo_doc_to_dict(s) for s in stories_raw]
+    await hydrate_stories(db, stories, current_user["id"])
+    
     # Groupe les stories par auteur
     stories_by_user = {}
-    for story_raw in stories_raw:
-        story = convert_mongo_doc_to_dict(story_raw)
+    for story in stories:
         author_id = story["author_id"]
         
-        # Vérifie si l'utilisateur a vu cette story
-        view_raw = await db.story_views.find_one({
-            "story_id": story["id"],
-            "user_id": current_user["id"]
-        })
-        story["has_viewed"] = bool(view_raw)
-        
         if author_id not in stories_by_user:
             stories_by_user[author_id] = {
                 "user_id": author_id,
@@ -1477,7 +1834,7 @@ async def get_stories_feed(current_user: dict = Depends(get_current_user)):
     ]
     story_groups.sort(key=lambda x: x.last_story_time, reverse=True)
     
-    return story_groups
+    return [group.model_dump() for group in story_groups]
 
 @api_router.get("/stories/user/{user_id}", response_model=List[Story])
 async def get_user_stories(user_id: str, current_user: dict = Depends(get_current_user)):
@@ -1493,20 +1850,10 @@ async def get_user_stories(user_id: str, current_user: dict = Depends(get_curren
         "expires_at": {"$gt": now}
     }).sort("created_at", 1).to_list(length=100)
     
-    stories = []
-    for story_raw in stories_raw:
-        story = convert_mongo_doc_to_dict(story_raw)
-        
-        # Vérifie si l'utilisateur a vu cette story
-        view_raw = await db.story_views.find_one({
-            "story_id": story["id"],
-            "user_id": current_user["id"]
-        })
-        story["has_viewed"] = bool(view_raw)
-        
-        stories.append(Story(**story))
+    stories = [convert_mongo_doc_to_dict(s) for s in stories_raw]
+    await hydrate_stories(db, stories, current_user["id"])
     
-    return stories
+    return [Story(**story) for story in stories]
 
 @api_router.post("/stories/{story_id}/view")
 async def view_story(story_id: str, current_user: dict = Depends(get_current_user)):
@@ -1532,15 +1879,17 @@ async def view_story(story_id: str, current_user: dict = Depends(get_current_use
         })
         
         # Incrémente le compteur de vues
-        await db.stories.update_one(
-            {"id": story_id},
-            {"$inc": {"views_count": 1}}
-        )
+        counters.incr("stories", story_id, "views_count", 1)
+        await feed_cache.invalidate([current_user["id"]])
     
     return {"message": "Story viewed successfully"}
 
 @api_router.delete("/stories/{story_id}")
-async def delete_story(story_id: str, current_user: dict = Depends(get_current_user)):
+async def delete_story(
+    story_id: str,
+    background_tasks: BackgroundTasks,
+    current_user: dict = Depends(get_current_user)
+):
     """Supprime une story"""
     story_raw = await db.stories.find_one({"id": story_id})
     if not story_raw:
@@ -1552,6 +1901,9 @@ async def delete_story(story_id: str, current_user: dict = Depends(get_current_u
     
     await db.stories.delete_one({"id": story_id})
     await db.story_views.delete_many({"story_id": story_id})
+    await blob_store.release(db, [story.get("media_url"), story.get("thumbnail_url")])
+    await feed_cache.invalidate([current_user["id"]])
+    background_tasks.add_task(timelines.invalidate_followers, db, current_user["id"])
     
     return {"message": "Story deleted successfully"}
 
@@ -1568,16 +1920,17 @@ async def get_story_viewers(story_id: str, current_user: dict = Depends(get_curr
     
     views_raw = await db.story_views.find({"story_id": story_id}).to_list(length=1000)
     
+    cards = await user_cards.cache.get_many(db, (v["user_id"] for v in views_raw))
+    
     viewers = []
     for view_raw in views_raw:
         view = convert_mongo_doc_to_dict(view_raw)
-        user_raw = await db.users.find_one({"id": view["user_id"]})
-        if user_raw:
-            user = convert_mongo_doc_to_dict(user_raw)
+        card = cards.get(view["user_id"])
+        if card:
             viewers.append({
-                "user_id": user["id"],
-                "username": user["username"],
-                "profile_pic": user.get("profile_pic"),
+                "user_id": card["id"],
+                "username": card["username"],
+                "profile_pic": blob_store.resolve_url(card["profile_pic"]),
                 "viewed_at": view["viewed_at"]
             })
     
@@ -1699,7 +2052,7 @@ async def export_user_data(user_id: str):
             "email": user.get("email"),
             "created_at": user.get("created_at"),
             "bio": user.get("bio"),
-            "profile_pic": user.get("profile_pic")
+            "profile_pic": blob_store.resolve_url(user.get("profile_pic"))
         }
         
         # Export complet
@@ -1996,6 +2349,13 @@ if follow_router is not None:
     app.include_router(follow_router)
     print("✅ Follow system router registered")
 
+# Notifications temps réel : même base et même authentification que l'API
+Notifications.set_database(db, get_current_user, require_metrics_access)
+app.include_router(Notifications.notification_router, prefix="/api")
+
+# Diffusion des médias du blob store
+app.include_router(blob_store.media_router)
+
 # Inclure le routeur principal
 app.include_router(api_router)
 
@@ -2016,9 +2376,45 @@ async def startup_db_client():
     except Exception as e:
         logger.error(f"❌ MongoDB connection failed: {e}")
         raise
+    
+    counters.buffer.start(db)
+    autocomplete.index.start(db)
+    post_search.index.start(db)
+    tags.trending.start(db)
+    
+    # Index pour l'hydratation par lot (likes / vues de l'utilisateur courant)
+    # et pour la pagination keyset (created_at, id)
+    try:
+        await db.likes.create_index([("user_id", 1), ("post_id", 1)])
+        await db.comment_likes.create_index([("user_id", 1), ("comment_id", 1)])
+        await likes.ensure_indexes(db)
+        await db.story_views.create_index([("user_id", 1), ("story_id", 1)])
+        await db.posts.create_index([("author_id", 1), ("created_at", -1), ("id", -1)])
+        await db.comments.create_index([("post_id", 1), ("created_at", -1), ("id", -1)])
+        await db.comments.create_index("id")
+        await db.comment_replies.create_index([("parent_comment_id", 1), ("created_at", 1), ("id", 1)])
+        await db.notifications.create_index([("user_id", 1), ("created_at", -1), ("id", -1)])
+        await db.messages.create_index([("sender_id", 1), ("recipient_id", 1), ("created_at", -1), ("id", -1)])
+        await timelines.ensure_indexes(db)
+        await search_engine.ensure_indexes(db)
+        await post_search.ensure_indexes(db)
+        await tags.ensure_indexes(db)
+        await db.follow_requests.create_index([("followed_id", 1), ("status", 1), ("created_at", -1), ("id", -1)])
+        await db.follow_requests.create_index([("follower_id", 1), ("followed_id", 1)])
+        await follow_graph.ensure_indexes(db)
+        await suggestions.ensure_indexes(db)
+        await blob_store.ensure_indexes(db)
+        logger.info("✅ MongoDB indexes ensured")
+    except Exception as e:
+        logger.warning(f"⚠️ Could not create indexes: {e}")
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
     """Ferme la connexion MongoDB à l'arrêt"""
+    derivatives.shutdown()
+    await post_search.index.stop()
+    await tags.trending.stop()
+    await counters.buffer.stop()
+    await Notifications.manager.close()
     client.close()
     logger.info("MongoDB connection closed")
@@ -0,0 +1,268 @@
+"""
+suggestions.py - Suggestions d'abonnement « amis d'amis »
+Le graphe `follows` est exporté en matrice d'adjacence creuse CSR (tableaux NumPy indptr / indices,
+un int32 par abonnement) : les comptes à deux sauts d'un utilisateur sont lus par tranches contiguës.
+Score d'un candidat : somme sur les comptes suivis qui le suivent de 1 / log2(2 + abonnements du
+compte intermédiaire) (un compte qui suit peu de monde est un meilleur indice qu'un compte qui suit tout le monde).
+Les SUGGESTIONS_PER_USER meilleurs candidats sont précalculés par build_suggestions.py et servis tels quels ;
+les abonnements / demandes faits depuis sont filtrés à la lecture.
+"""
+
+from array import array
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Set
+import os
+
+import numpy as np
+from pymongo import ReplaceOne
+
+# Candidats conservés par utilisateur
+SUGGESTIONS_PER_USER = int(os.environ.get("SUGGESTIONS_PER_USER", 50))
+
+# Chemins à deux sauts examinés au maximum par utilisateur (les comptes suivis qui suivent
+# le moins de monde sont parcourus en premier)
+SUGGESTIONS_MAX_PATHS = int(os.environ.get("SUGGESTIONS_MAX_PATHS", 200000))
+
+# Utilisateurs recalculés par chargement partiel du graphe (rafraîchissement incrémental)
+SUGGESTIONS_CHUNK_USERS = int(os.environ.get("SUGGESTIONS_CHUNK_USERS", 5000))
+
+# Taille des lots ($in, bulk_write)
+BATCH_SIZE = 1000
+
+DEFAULT_SUGGESTIONS = 10
+MAX_SUGGESTIONS = 50
+
+SUGGESTIONS = "follow_suggestions"
+DIRTY = "follow_suggestions_dirty"
+
+
+async def ensure_indexes(db):
+    await db[SUGGESTIONS].create_index([("user_id", 1)], unique=True)
+    await db[DIRTY].create_index([("user_id", 1)], unique=True)
+    # Tri par followers_count de suggest() : index créé par timelines.ensure_indexes
+
+
+# ==================== MATRICE D'ADJACENCE ====================
+
+class FollowMatrix:
+    """Graphe d'abonnements en CSR : les abonnements de la ligne i sont indices[indptr[i]:indptr[i + 1]]"""
+
+    def __init__(self, ids: List[str], rows: Dict[str, int], indptr: np.ndarray, indices: np.ndarray):
+        self.ids = ids
+        self.rows = rows
+        self.indptr = indptr
+        self.indices = indices
+
+    @classmethod
+    async def load(cls, db, sources: Optional[Iterable[str]] = None) -> "FollowMatrix":
+        """Tout le graphe, ou seulement les abonnements des comptes `sources`"""
+        ids: List[str] = []
+        rows: Dict[str, int] = {}
+
+        def row(user_id: str) -> int:
+            i = rows.get(user_id)
+            if i is None:
+                i = rows[user_id] = len(ids)
+                ids.append(user_id)
+            return i
+
+        # Tableaux compacts pendant le parcours (pas d'objet Python par abonnement)
+        src, dst = array("i"), array("i")
+        projection = {"follower_id": 1, "followed_id": 1, "_id": 0}
+        if sources is None:
+            queries = [{}]
+        else:
+            sources = list(sources)
+            queries = [
+                {"follower_id": {"$in": sources[start:start + BATCH_SIZE]}}
+                for start in range(0, len(sources), BATCH_SIZE)
+            ]
+        for query in queries:
+            async for f in db.follows.find(query, projection).batch_size(10000):
+                if f.get("follower_id") and f.get("followed_id"):
+                    src.append(row(f["follower_id"]))
+                    dst.append(row(f["followed_id"]))
+
+        src = np.frombuffer(src, dtype=np.intc) if len(src) else np.zeros(0, dtype=np.intc)
+        dst = np.frombuffer(dst, dtype=np.intc) if len(dst) else np.zeros(0, dtype=np.intc)
+        indptr = np.zeros(len(ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=len(ids)), out=indptr[1:])
+        indices = dst[np.argsort(src, kind="stable")].astype(np.int32)
+        return cls(ids, rows, indptr, indices)
+
+    def following(self, i: int) -> np.ndarray:
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def candidates(self, user_id: str, exclude: Set[str] = frozenset(),
+                   limit: int = SUGGESTIONS_PER_USER) -> List[dict]:
+        """Meilleurs comptes à deux sauts, hors comptes déjà suivis, lui-même et `exclude`"""
+        i = self.rows.get(user_id)
+        if i is None:
+            return []
+        friends = self.following(i)
+        if not len(friends):
+            return []
+
+        # Budget de chemins : les comptes suivis qui suivent le moins de monde d'abord
+        degrees = self.indptr[friends + 1] - self.indptr[friends]
+        order = np.argsort(degrees, kind="stable")
+        degrees = degrees[order]
+        keep = np.cumsum(degrees) <= SUGGESTIONS_MAX_PATHS
+        keep[0] = True
+        via, degrees = friends[order][keep], degrees[keep]
+        total = int(degrees.sum())
+        if not total:
+            return []
+
+        # Concaténation des lignes des comptes suivis, sans boucle Python
+        ends = np.cumsum(degrees)
+        positions = np.arange(total) + np.repeat(self.indptr[via] - (ends - degrees), degrees)
+        second = self.indices[positions]
+        weights = np.repeat(1.0 / np.log2(2.0 + degrees), degrees)
+
+        candidates, inverse = np.unique(second, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights)
+        mutual = np.bincount(inverse)
+
+        excluded = [i, *friends.tolist()]
+        excluded.extend(self.rows[u] for u in exclude if u in self.rows)
+        mask = ~np.isin(candidates, np.asarray(excluded, dtype=np.int32))
+        candidates, scores, mutual = candidates[mask], scores[mask], mutual[mask]
+        if not len(candidates):
+            return []
+
+        if len(candidates) > limit:
+            top = np.argpartition(-scores, limit - 1)[:limit]
+            candidates, scores, mutual = candidates[top], scores[top], mutual[top]
+        order = np.lexsort((-mutual, -scores))
+        return [
+            {"user_id": self.ids[c], "mutual": int(m), "score": round(float(s), 4)}
+            for c, m, s in zip(candidates[order], mutual[order], scores[order])
+        ]
+
+
+# ==================== CALCUL ====================
+
+async def pending_targets(db, user_ids: Optional[List[str]] = None) -> Dict[str, Set[str]]:
+    """Comptes auxquels chaque utilisateur a déjà envoyé une demande"""
+    query = {"status": "pending"}
+    if user_ids is not None:
+        query["follower_id"] = {"$in": user_ids}
+    pending: Dict[str, Set[str]] = {}
+    async for r in db.follow_requests.find(query, {"follower_id": 1, "followed_id": 1, "_id": 0}):
+        pending.setdefault(r["follower_id"], set()).add(r["followed_id"])
+    return pending
+
+
+async def store(db, matrix: FollowMatrix, user_ids: Iterable[str], pending: Dict[str, Set[str]]) -> int:
+    """Calcule et remplace les suggestions de `user_ids` (une ligne par utilisateur)"""
+    now = datetime.now(timezone.utc).isoformat()
+    written = 0
+    ops = []
+    for user_id in user_ids:
+        ops.append(ReplaceOne(
+            {"user_id": user_id},
+            {
+                "user_id": user_id,
+                "suggestions": matrix.candidates(user_id, pending.get(user_id, set())),
+                "computed_at": now,
+            },
+            upsert=True
+        ))
+        if len(ops) >= BATCH_SIZE:
+            await db[SUGGESTIONS].bulk_write(ops, ordered=False)
+            written += len(ops)
+            ops = []
+    if ops:
+        await db[SUGGESTIONS].bulk_write(ops, ordered=False)
+        written += len(ops)
+    return written
+
+
+async def rebuild_all(db) -> int:
+    """Recalcul complet : un seul parcours de `follows`"""
+    started = datetime.now(timezone.utc).isoformat()
+    matrix = await FollowMatrix.load(db)
+    pending = await pending_targets(db)
+    sources = [user_id for i, user_id in enumerate(matrix.ids) if matrix.indptr[i + 1] > matrix.indptr[i]]
+    written = await store(db, matrix, sources, pending)
+    # Les marques antérieures au parcours sont couvertes par ce calcul
+    await db[DIRTY].delete_many({"marked_at": {"$lte": started}})
+    return written
+
+
+async def refresh_dirty(db) -> int:
+    """Recalcul incrémental : comptes dont les abonnements ont changé et leurs abonnés
+    (leurs comptes à deux sauts passent par eux) ; graphe chargé partiellement, par tranches"""
+    started = datetime.now(timezone.utc).isoformat()
+    dirty = [d["user_id"] async for d in db[DIRTY].find({"marked_at": {"$lte": started}}, {"user_id": 1, "_id": 0})]
+    if not dirty:
+        return 0
+
+    affected = set(dirty)
+    for start in range(0, len(dirty), BATCH_SIZE):
+        cursor = db.follows.find({"followed_id": {"$in": dirty[start:start + BATCH_SIZE]}}, {"follower_id": 1, "_id": 0})
+        affected.update([f["follower_id"] async for f in cursor if f.get("follower_id")])
+    affected = sorted(affected)
+
+    written = 0
+    for start in range(0, len(affected), SUGGESTIONS_CHUNK_USERS):
+        chunk = affected[start:start + SUGGESTIONS_CHUNK_USERS]
+        # Lignes des utilisateurs de la tranche, puis celles des comptes qu'ils suivent
+        first = await FollowMatrix.load(db, chunk)
+        matrix = await FollowMatrix.load(db, first.ids)
+        pending = await pending_targets(db, chunk)
+        written += await store(db, matrix, chunk, pending)
+
+    for start in range(0, len(dirty), BATCH_SIZE):
+        await db[DIRTY].delete_many({
+            "user_id": {"$in": dirty[start:start + BATCH_SIZE]},
+            "marked_at": {"$lte": started}
+        })
+    return written
+
+
+async def mark_dirty(db, user_ids: List[str]):
+    """À appeler après un abonnement / désabonnement (recalcul au prochain rafraîchissement)"""
+    now = datetime.now(timezone.utc).isoformat()
+    for user_id in user_ids:
+        await db[DIRTY].update_one({"user_id": user_id}, {"$set": {"marked_at": now}}, upsert=True)
+
+
+# ==================== LECTURE ====================
+
+async def suggest(db, user_id: str, following: Set[str], limit: int = DEFAULT_SUGGESTIONS) -> List[dict]:
+    """Suggestions précalculées encore valables, complétées par les comptes les plus suivis"""
+    row = await db[SUGGESTIONS].find_one({"user_id": user_id}, {"suggestions": 1, "_id": 0})
+    candidates = [
+        s for s in (row or {}).get("suggestions", [])
+        if s["user_id"] not in following and s["user_id"] != user_id
+    ]
+
+    if len(candidates) < limit:
+        # Nouveaux comptes (pas encore de ligne) : les plus suivis
+        seen = {s["user_id"] for s in candidates}
+        fill = min(limit + len(following) + 1, MAX_SUGGESTIONS * 4)
+        cursor = db.users.find({}, {"id": 1, "_id": 0}).sort("followers_count", -1).limit(fill)
+        async for u in cursor:
+            if u["id"] not in following and u["id"] != user_id and u["id"] not in seen:
+                candidates.append({"user_id": u["id"], "mutual": 0})
+
+    # Demandes envoyées depuis le calcul
+    requested = {
+        r["followed_id"] async for r in db.follow_requests.find(
+            {
+                "follower_id": user_id,
+                "followed_id": {"$in": [s["user_id"] for s in candidates]},
+                "status": "pending"
+            },
+            {"followed_id": 1, "_id": 0}
+        )
+    }
+    return [s for s in candidates if s["user_id"] not in requested][:limit]
+
+
+def clamp_suggestions(limit: Optional[int]) -> int:
+    if not limit or limit < 1:
+        return DEFAULT_SUGGESTIONS
+    return min(limit, MAX_SUGGESTIONS)
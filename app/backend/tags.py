@@ -0,0 +1,273 @@
+"""
+tags.py - Hashtags, mentions et tendances
+- Extraction à la création du post : posts.hashtags (normalisés) et posts.mentions (ids),
+  couverts par l'index (hashtags, created_at, id) pour la pagination keyset par tag
+- Mentions : usernames résolus en une requête $in sur users.username_key (index, sans
+  casse ni accents), notifications insérées en un seul lot puis envoyées en temps réel
+- Tendances : chaque worker compte les tags par tranche horaire dans un résumé Space-Saving
+  de taille fixe (heavy hitters), publié dans `trending_buckets` ; le classement fusionne
+  les tranches de la fenêtre glissante, sans jamais parcourir `posts`
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import os
+import re
+import socket
+import time
+import uuid
+
+try:
+    import backend.search as search_engine
+    import backend.Notifications as Notifications
+except ImportError:
+    import search as search_engine
+    import Notifications
+
+# Limites par post
+MAX_TAGS_PER_POST = 20
+MAX_MENTIONS_PER_POST = 20
+MAX_TAG_LENGTH = 64
+
+# Compteurs conservés par tranche et par worker (résumé Space-Saving)
+TRENDING_SKETCH_SIZE = int(os.environ.get("TRENDING_SKETCH_SIZE", 500))
+
+# Taille d'une tranche, fenêtre glissante et demi-vie de la pondération
+TRENDING_BUCKET_SECONDS = 3600
+TRENDING_WINDOW_HOURS = int(os.environ.get("TRENDING_WINDOW_HOURS", 24))
+TRENDING_HALF_LIFE_HOURS = float(os.environ.get("TRENDING_HALF_LIFE_HOURS", 6))
+
+# Publication des résumés / durée de cache du classement
+TRENDING_FLUSH_SECONDS = float(os.environ.get("TRENDING_FLUSH_SECONDS", 10))
+TRENDING_CACHE_SECONDS = float(os.environ.get("TRENDING_CACHE_SECONDS", 30))
+
+DEFAULT_TRENDING = 10
+MAX_TRENDING = 50
+
+TRENDING_BUCKETS = "trending_buckets"
+
+_HASHTAG_RE = re.compile(r"(?<![\w#])#(\w+)")
+_MENTION_RE = re.compile(r"(?<![\w@])@([\w.]+)")
+
+
+# ==================== EXTRACTION ====================
+
+def normalize_tag(tag: str) -> str:
+    """'#Café' → 'cafe'"""
+    return search_engine.normalize(tag.lstrip("#"))[:MAX_TAG_LENGTH]
+
+
+def extract(content: Optional[str]) -> Tuple[List[str], List[str]]:
+    """(hashtags normalisés, usernames mentionnés), sans doublons, dans l'ordre d'apparition"""
+    if not content:
+        return [], []
+    hashtags = list(dict.fromkeys(
+        tag for tag in (normalize_tag(m) for m in _HASHTAG_RE.findall(content)) if tag
+    ))[:MAX_TAGS_PER_POST]
+    mentions = list(dict.fromkeys(
+        m.rstrip(".") for m in _MENTION_RE.findall(content) if m.rstrip(".")
+    ))[:MAX_MENTIONS_PER_POST]
+    return hashtags, mentions
+
+
+def _mention_key(username: str) -> str:
+    """Clé indexée d'un username (search.py) : 'Jean_Luc.D' → 'jeanlucd'"""
+    terms = search_engine.username_terms(username)
+    return terms[0] if terms else ""
+
+
+async def resolve_mentions(db, usernames: List[str]) -> List[str]:
+    """Ids des comptes mentionnés (une requête $in sur l'index username_key ; les usernames
+    inconnus sont ignorés). Plusieurs comptes de même clé : le username exact, puis le seul
+    qui ne diffère que par la casse / les accents"""
+    keys = {name: _mention_key(name) for name in usernames}
+    keys = {name: key for name, key in keys.items() if key}
+    if not keys:
+        return []
+    cursor = db.users.find(
+        {"username_key": {"$in": list(set(keys.values()))}},
+        {"id": 1, "username": 1, "username_key": 1, "_id": 0}
+    )
+    by_key: Dict[str, List[dict]] = {}
+    async for user in cursor:
+        by_key.setdefault(user["username_key"], []).append(user)
+
+    ids = []
+    for name, key in keys.items():
+        candidates = by_key.get(key, [])
+        exact = [u for u in candidates if u.get("username") == name]
+        folded = [u for u in candidates if search_engine.normalize(u.get("username")) == search_engine.normalize(name)]
+        match = (exact or folded) if len(candidates) > 1 else candidates
+        if len(match) == 1 and match[0]["id"] not in ids:
+            ids.append(match[0]["id"])
+    return ids
+
+
+async def notify_mentions(post: dict, mentioned_ids: List[str], author_username: str):
+    """Une notification 'mention' par compte mentionné, en un seul lot, envoyée en temps réel
+    (tâche de fond de create_post)"""
+    now = datetime.now(timezone.utc).isoformat()
+    notifications = [
+        {
+            "id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "type": "mention",
+            "from_user_id": post["author_id"],
+            "post_id": post["id"],
+            "content": f"{author_username} vous a mentionné dans une publication",
+            "link": f"/posts/{post['id']}",
+            "read": False,
+            "created_at": now,
+        }
+        for user_id in mentioned_ids if user_id != post["author_id"]
+    ]
+    try:
+        await Notifications.create_notifications(notifications)
+    except Exception as e:
+        print(f"⚠️ Mention notifications failed for post {post['id']}: {e}")
+
+
+async def ensure_indexes(db):
+    await db.posts.create_index([("hashtags", 1), ("created_at", -1), ("id", -1)])
+    await db[TRENDING_BUCKETS].create_index([("bucket", 1)])
+    await db[TRENDING_BUCKETS].create_index([("expires_at", 1)], expireAfterSeconds=0)
+
+
+# ==================== TENDANCES ====================
+
+class SpaceSaving:
+    """Résumé Space-Saving : les `capacity` tags les plus fréquents, erreur bornée par le plus petit compteur"""
+
+    def __init__(self, capacity: int = TRENDING_SKETCH_SIZE):
+        self.capacity = capacity
+        self.counts: Dict[str, int] = {}
+
+    def offer(self, tag: str, n: int = 1):
+        if tag in self.counts or len(self.counts) < self.capacity:
+            self.counts[tag] = self.counts.get(tag, 0) + n
+            return
+        # Plein : le nouveau tag remplace le moins fréquent et hérite de son compte (surestimation bornée)
+        victim = min(self.counts, key=self.counts.get)
+        self.counts[tag] = self.counts.pop(victim) + n
+
+
+def _bucket_of(ts: float) -> int:
+    return int(ts // TRENDING_BUCKET_SECONDS) * TRENDING_BUCKET_SECONDS
+
+
+class TrendingTags:
+    """Résumés par tranche horaire de ce worker, publiés périodiquement dans MongoDB"""
+
+    def __init__(self):
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.sketches: Dict[int, SpaceSaving] = {}
+        self.dirty = set()
+        self.db = None
+        self.wake: Optional[asyncio.Event] = None
+        self.task: Optional[asyncio.Task] = None
+        self.stopping = False
+        self.cached: Optional[Tuple[float, List[dict]]] = None
+        self.stats = {"recorded": 0, "flushes": 0}
+
+    def record(self, hashtags: List[str], at: Optional[float] = None):
+        """À appeler à la création d'un post"""
+        if not hashtags:
+            return
+        bucket = _bucket_of(at if at is not None else time.time())
+        sketch = self.sketches.get(bucket)
+        if sketch is None:
+            sketch = self.sketches[bucket] = SpaceSaving()
+        for tag in hashtags:
+            sketch.offer(tag)
+        self.dirty.add(bucket)
+        self.stats["recorded"] += 1
+
+    async def flush(self):
+        """Publie les résumés modifiés (un document par tranche et par worker, remplacé en entier)"""
+        if self.db is None:
+            return
+        dirty, self.dirty = self.dirty, set()
+        for bucket in sorted(dirty):
+            sketch = self.sketches.get(bucket)
+            if sketch is None:
+                continue
+            expires_at = datetime.fromtimestamp(bucket, timezone.utc) + timedelta(
+                hours=TRENDING_WINDOW_HOURS, seconds=TRENDING_BUCKET_SECONDS
+            )
+            try:
+                await self.db[TRENDING_BUCKETS].update_one(
+                    {"bucket": bucket, "worker": self.worker_id},
+                    {"$set": {"counts": dict(sketch.counts), "expires_at": expires_at}},
+                    upsert=True
+                )
+            except Exception as e:
+                self.dirty.add(bucket)
+                print(f"⚠️ Trending flush failed: {e}")
+        # Les tranches sorties de la fenêtre ne sont plus utiles en mémoire
+        oldest = _bucket_of(time.time()) - TRENDING_WINDOW_HOURS * 3600
+        for bucket in [b for b in self.sketches if b < oldest]:
+            del self.sketches[bucket]
+        self.stats["flushes"] += 1
+
+    async def top(self, limit: int = DEFAULT_TRENDING) -> List[dict]:
+        """Tags les plus utilisés sur la fenêtre, pondérés par fraîcheur de la tranche"""
+        now = time.time()
+        if self.cached is None or now - self.cached[0] > TRENDING_CACHE_SECONDS:
+            self.cached = (now, await self._compute(now))
+        return self.cached[1][:limit]
+
+    async def _compute(self, now: float) -> List[dict]:
+        current = _bucket_of(now)
+        since = current - (TRENDING_WINDOW_HOURS - 1) * TRENDING_BUCKET_SECONDS
+        scores: Dict[str, float] = {}
+        totals: Dict[str, int] = {}
+        cursor = self.db[TRENDING_BUCKETS].find({"bucket": {"$gte": since}}, {"bucket": 1, "counts": 1, "_id": 0})
+        async for doc in cursor:
+            age_hours = (current - doc["bucket"]) / 3600
+            weight = 0.5 ** (age_hours / TRENDING_HALF_LIFE_HOURS)
+            for tag, count in doc.get("counts", {}).items():
+                scores[tag] = scores.get(tag, 0.0) + weight * count
+                totals[tag] = totals.get(tag, 0) + count
+        ranked = sorted(scores, key=scores.get, reverse=True)[:MAX_TRENDING]
+        return [{"tag": tag, "count": totals[tag], "score": round(scores[tag], 3)} for tag in ranked]
+
+    async def _run(self):
+        while not self.stopping:
+            try:
+                await asyncio.wait_for(self.wake.wait(), timeout=TRENDING_FLUSH_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"⚠️ Trending flush error: {e}")
+
+    def start(self, db):
+        self.db = db
+        self.wake = asyncio.Event()
+        self.stopping = False
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.stopping = True
+            self.wake.set()
+            await self.task
+            self.task = None
+        await self.flush()
+
+    def snapshot(self) -> dict:
+        data = dict(self.stats)
+        data["buckets"] = len(self.sketches)
+        return data
+
+
+trending = TrendingTags()
+
+
+def clamp_trending(limit: Optional[int]) -> int:
+    if not limit or limit < 1:
+        return DEFAULT_TRENDING
+    return min(limit, MAX_TRENDING)
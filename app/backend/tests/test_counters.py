@@ -0,0 +1,171 @@
+# app/backend/tests/test_counters.py - Compteurs en écriture différée (CounterBuffer de counters.py)
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+from backend import counters
+
+
+class FakeCollection:
+    """Collection en mémoire : applique les UpdateOne de CounterBuffer ($ne, $inc, $push $slice)"""
+
+    def __init__(self, docs):
+        self.docs = {doc["id"]: doc for doc in docs}
+        self.fail_after_apply = 0   # écritures appliquées puis réponse perdue (réseau)
+        self.fail_before_apply = 0  # écritures refusées sans effet
+        self.bad_ids = set()        # documents en erreur d'écriture définitive
+        self.gate = None            # asyncio.Event bloquant l'écriture (lot en cours)
+        self.calls = 0
+
+    def _apply(self, op) -> bool:
+        query, update = op._filter, op._doc
+        doc = self.docs.get(query["id"])
+        if doc is None or query[counters.COUNTER_FLUSH_FIELD]["$ne"] in doc.get(counters.COUNTER_FLUSH_FIELD, []):
+            return False
+        for field, delta in update["$inc"].items():
+            doc[field] = doc.get(field, 0) + delta
+        push = update["$push"][counters.COUNTER_FLUSH_FIELD]
+        history = doc.get(counters.COUNTER_FLUSH_FIELD, []) + push["$each"]
+        doc[counters.COUNTER_FLUSH_FIELD] = history[push["$slice"]:]
+        return True
+
+    async def bulk_write(self, ops, ordered=True):
+        self.calls += 1
+        if self.gate is not None:
+            await self.gate.wait()
+        if self.fail_before_apply:
+            self.fail_before_apply -= 1
+            raise AutoReconnect("connection reset")
+        errors = []
+        for index, op in enumerate(ops):
+            if op._filter["id"] in self.bad_ids:
+                errors.append({"index": index, "code": 14, "errmsg": "type mismatch"})
+            else:
+                self._apply(op)
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+        if self.fail_after_apply:
+            self.fail_after_apply -= 1
+            raise AutoReconnect("connection reset")
+
+
+class FakeDb:
+    def __init__(self, **collections):
+        self.collections = collections
+
+    def __getitem__(self, name):
+        return self.collections[name]
+
+
+def make_buffer(posts):
+    buffer = counters.CounterBuffer()
+    buffer.db = FakeDb(posts=posts)
+    return buffer
+
+
+def test_retried_chunk_is_not_applied_twice():
+    async def scenario():
+        posts = FakeCollection([{"id": "p1", "likes_count": 0}])
+        buffer = make_buffer(posts)
+        buffer.incr("posts", "p1", "likes_count", 1)
+
+        # Écrit, mais le résultat est perdu : le lot est gardé pour un nouvel essai
+        posts.fail_after_apply = 1
+        await buffer.flush()
+        retrying = len(buffer.retrying)
+
+        await buffer.flush()
+        return posts, buffer, retrying
+
+    posts, buffer, retrying = asyncio.run(scenario())
+    assert retrying == 1
+    assert posts.docs["p1"]["likes_count"] == 1
+    assert len(posts.docs["p1"][counters.COUNTER_FLUSH_FIELD]) == 1
+    assert buffer.retrying == [] and buffer.pending_delta("posts", "p1", "likes_count") == 0
+    assert buffer.stats["retries"] == 1
+
+
+def test_retrying_chunk_stays_visible_then_is_dropped_after_max_retries():
+    async def scenario():
+        posts = FakeCollection([{"id": "p1", "likes_count": 5}])
+        buffer = make_buffer(posts)
+        buffer.incr("posts", "p1", "likes_count", 2)
+
+        posts.fail_before_apply = counters.COUNTER_MAX_RETRIES
+        await buffer.flush()
+        visible = buffer.pending_delta("posts", "p1", "likes_count")
+        for _ in range(counters.COUNTER_MAX_RETRIES - 1):
+            await buffer.flush()
+        return posts, buffer, visible
+
+    posts, buffer, visible = asyncio.run(scenario())
+    assert visible == 2
+    assert posts.calls == counters.COUNTER_MAX_RETRIES
+    assert posts.docs["p1"]["likes_count"] == 5
+    assert buffer.retrying == [] and buffer.stats["dropped"] == 1
+    assert buffer.pending_delta("posts", "p1", "likes_count") == 0
+
+
+def test_write_error_drops_only_the_failing_document():
+    async def scenario():
+        posts = FakeCollection([{"id": "p1"}, {"id": "p2"}])
+        posts.bad_ids = {"p2"}
+        buffer = make_buffer(posts)
+        buffer.incr("posts", "p1", "likes_count", 1)
+        buffer.incr("posts", "p2", "likes_count", 1)
+        written = await buffer.flush()
+        return posts, buffer, written
+
+    posts, buffer, written = asyncio.run(scenario())
+    assert written == 1
+    assert posts.docs["p1"]["likes_count"] == 1 and "likes_count" not in posts.docs["p2"]
+    assert buffer.retrying == [] and buffer.stats["dropped"] == 1
+
+
+def test_deltas_stay_visible_while_a_batch_is_in_flight():
+    async def scenario():
+        posts = FakeCollection([{"id": "p1", "likes_count": 0}])
+        posts.gate = asyncio.Event()
+        buffer = make_buffer(posts)
+        buffer.incr("posts", "p1", "likes_count", 3)
+
+        flush = asyncio.create_task(buffer.flush())
+        await asyncio.sleep(0)
+        in_flight = buffer.pending_delta("posts", "p1", "likes_count")
+        # Incrément pendant l'écriture : en attente pour le vidage suivant
+        buffer.incr("posts", "p1", "likes_count", 1)
+        both = buffer.pending_delta("posts", "p1", "likes_count")
+
+        posts.gate.set()
+        await flush
+        return posts, buffer, in_flight, both
+
+    posts, buffer, in_flight, both = asyncio.run(scenario())
+    assert (in_flight, both) == (3, 4)
+    assert posts.docs["p1"]["likes_count"] == 3
+    assert buffer.pending_delta("posts", "p1", "likes_count") == 1
+
+
+def test_merge_adds_pending_deltas_to_stats_documents():
+    buffer = counters.CounterBuffer()
+    buffer.incr("users", "u1", "followers_count", 2)
+    buffer.incr("users", "u2", "following_count", 1)
+    buffer.incr("users", "u2", "following_count", -1)
+    buffer.incr("posts", "u1", "likes_count", 7)
+
+    docs = [
+        {"id": "u1", "followers_count": 10, "following_count": 4},
+        {"id": "u2", "followers_count": 1},
+        {"followers_count": 3},
+    ]
+    buffer.merge("users", docs, "followers_count", "following_count")
+
+    assert docs == [
+        {"id": "u1", "followers_count": 12, "following_count": 4},
+        {"id": "u2", "followers_count": 1},
+        {"followers_count": 3},
+    ]
@@ -0,0 +1,127 @@
+# app/backend/tests/test_notifications.py - Diffusion des notifications (LocalBroker → ConnectionManager)
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from backend import Notifications, notification_broker
+
+
+class FakeWebSocket:
+    """Socket en mémoire : garde les messages envoyés"""
+
+    def __init__(self):
+        self.sent = []
+        self.closed_with = None
+
+    async def accept(self):
+        pass
+
+    async def send_json(self, message):
+        self.sent.append(message)
+
+    async def close(self, code=1000):
+        self.closed_with = code
+
+
+async def settle():
+    """Laisse les tâches d'envoi des connexions vider leurs files"""
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def disconnect_all(manager):
+    manager.heartbeat.cancel()
+    for user_id, connections in list(manager.active_connections.items()):
+        for websocket in list(connections):
+            manager.disconnect(websocket, user_id)
+
+
+def test_local_broker_dispatches_to_subscribers():
+    async def scenario():
+        broker = notification_broker.LocalBroker()
+        received = []
+
+        async def handler(user_id, message):
+            received.append((user_id, message))
+
+        broker.subscribe(handler)
+        await broker.publish("u1", {"content": "hello"})
+        return received, broker.snapshot()
+
+    received, snapshot = asyncio.run(scenario())
+    assert received == [("u1", {"content": "hello"})]
+    assert snapshot["published"] == 1 and snapshot["received"] == 1
+
+
+def test_deliver_reaches_only_the_recipient_sockets():
+    async def scenario():
+        manager = Notifications.ConnectionManager(notification_broker.LocalBroker())
+        alice_phone, alice_laptop, bob = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+        await manager.connect(alice_phone, "alice")
+        await manager.connect(alice_laptop, "alice")
+        await manager.connect(bob, "bob")
+
+        await manager.send_notification("alice", {"_id": "oid", "type": "like", "content": "hi"})
+        await settle()
+        disconnect_all(manager)
+        return manager, alice_phone, alice_laptop, bob
+
+    manager, alice_phone, alice_laptop, bob = asyncio.run(scenario())
+    assert alice_phone.sent == [{"type": "like", "content": "hi"}]
+    assert alice_laptop.sent == [{"type": "like", "content": "hi"}]
+    assert bob.sent == []
+    assert manager.stats["sent"] == 2
+
+
+def test_deliver_drops_oldest_when_queue_is_full(monkeypatch):
+    monkeypatch.setattr(Notifications, "WS_SEND_QUEUE_SIZE", 2)
+
+    async def scenario():
+        manager = Notifications.ConnectionManager(notification_broker.LocalBroker())
+        socket = FakeWebSocket()
+        await manager.connect(socket, "alice")
+        # Sans laisser la tâche d'envoi tourner : la file se remplit
+        for n in range(4):
+            await manager.deliver("alice", {"n": n})
+        await settle()
+        disconnect_all(manager)
+        return manager, socket
+
+    manager, socket = asyncio.run(scenario())
+    assert socket.sent == [{"n": 2}, {"n": 3}]
+    assert manager.stats["dropped"] == 2
+
+
+def test_close_stops_heartbeat_and_closes_sockets():
+    async def scenario():
+        manager = Notifications.ConnectionManager(notification_broker.LocalBroker())
+        sockets = [FakeWebSocket(), FakeWebSocket()]
+        await manager.connect(sockets[0], "alice")
+        await manager.connect(sockets[1], "bob")
+        heartbeat = manager.heartbeat
+        await manager.close()
+        return manager, sockets, heartbeat
+
+    manager, sockets, heartbeat = asyncio.run(scenario())
+    assert heartbeat.cancelled() and manager.heartbeat is None
+    assert [s.closed_with for s in sockets] == [Notifications.WS_CLOSE_GOING_AWAY] * 2
+    assert manager.active_connections == {} and not manager.subscribed
+
+
+def test_socket_requires_a_token_for_the_path_user(monkeypatch):
+    async def current_user(credentials):
+        if credentials.credentials != "token-alice":
+            raise Notifications.HTTPException(status_code=401, detail="Invalid token")
+        return {"id": "alice"}
+
+    monkeypatch.setattr(Notifications, "_current_user", current_user)
+
+    async def scenario():
+        return [
+            await Notifications.authenticate_socket(token, user_id)
+            for token, user_id in [("token-alice", "alice"), ("token-alice", "bob"), ("bad", "alice"), (None, "alice")]
+        ]
+
+    assert asyncio.run(scenario()) == [True, False, False, False]
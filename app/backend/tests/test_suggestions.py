@@ -0,0 +1,113 @@
+# app/backend/tests/test_suggestions.py - Suggestions « amis d'amis » (matrice CSR de suggestions.py)
+import asyncio
+import math
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from backend import suggestions
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def batch_size(self, n):
+        return self
+
+    def __aiter__(self):
+        self._it = iter(self.docs)
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._it)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class FakeFollows:
+    """Collection `follows` en mémoire (filtre follower_id $in seulement)"""
+
+    def __init__(self, edges):
+        self.docs = [{"follower_id": a, "followed_id": b} for a, b in edges]
+
+    def find(self, query, projection=None):
+        sources = query.get("follower_id", {}).get("$in")
+        return FakeCursor([d for d in self.docs if sources is None or d["follower_id"] in sources])
+
+
+class FakeDb:
+    def __init__(self, edges):
+        self.follows = FakeFollows(edges)
+
+
+def load(edges, sources=None):
+    return asyncio.run(suggestions.FollowMatrix.load(FakeDb(edges), sources))
+
+
+def weight(degree):
+    return 1 / math.log2(2 + degree)
+
+
+def test_candidates_are_scored_by_inverse_log_degree():
+    # a suit b et c ; b suit d ; c suit d et e
+    matrix = load([("a", "b"), ("a", "c"), ("b", "d"), ("c", "d"), ("c", "e")])
+
+    result = matrix.candidates("a")
+
+    assert [s["user_id"] for s in result] == ["d", "e"]
+    assert [s["mutual"] for s in result] == [2, 1]
+    assert result[0]["score"] == round(weight(1) + weight(2), 4)
+    assert result[1]["score"] == round(weight(2), 4)
+
+
+def test_self_friends_and_excluded_accounts_are_never_suggested():
+    # b (suivi par a) suit a lui-même, c (déjà suivi) et d
+    matrix = load([("a", "b"), ("a", "c"), ("b", "a"), ("b", "c"), ("b", "d")])
+
+    assert [s["user_id"] for s in matrix.candidates("a")] == ["d"]
+    # Demande déjà envoyée à d
+    assert matrix.candidates("a", exclude={"d"}) == []
+    # Inconnu du graphe / ne suit personne
+    assert matrix.candidates("zed") == []
+    assert matrix.candidates("d") == []
+
+
+def test_path_budget_keeps_the_least_connected_friends_first(monkeypatch):
+    # b suit 1 compte, c en suit 3 : avec un budget de 2 chemins, seul b est parcouru
+    edges = [("a", "c"), ("a", "b"), ("b", "x"), ("c", "y1"), ("c", "y2"), ("c", "y3")]
+    matrix = load(edges)
+    assert len(matrix.candidates("a")) == 4
+
+    monkeypatch.setattr(suggestions, "SUGGESTIONS_MAX_PATHS", 2)
+    assert [s["user_id"] for s in matrix.candidates("a")] == ["x"]
+
+    # Budget inférieur au premier compte suivi : il est tout de même parcouru
+    monkeypatch.setattr(suggestions, "SUGGESTIONS_MAX_PATHS", 0)
+    assert [s["user_id"] for s in matrix.candidates("a")] == ["x"]
+
+
+def test_rows_are_contiguous_slices_and_partial_load_keeps_only_sources():
+    edges = [("a", "b"), ("c", "a"), ("a", "c"), ("b", "c")]
+    matrix = load(edges)
+    following = {
+        user_id: sorted(matrix.ids[j] for j in matrix.following(i))
+        for user_id, i in matrix.rows.items()
+    }
+    assert following == {"a": ["b", "c"], "b": ["c"], "c": ["a"]}
+
+    partial = load(edges, sources=["a"])
+    assert sorted(partial.ids[j] for j in partial.following(partial.rows["a"])) == ["b", "c"]
+    assert len(partial.following(partial.rows["b"])) == 0
+
+
+def test_limit_keeps_the_best_scores():
+    # Trois candidats : z atteint par deux chemins, x et y par un seul
+    edges = [("a", "b"), ("a", "c"), ("b", "z"), ("c", "z"), ("b", "x"), ("c", "y")]
+    matrix = load(edges)
+
+    result = matrix.candidates("a", limit=1)
+
+    assert [(s["user_id"], s["mutual"]) for s in result] == [("z", 2)]
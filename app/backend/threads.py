@@ -0,0 +1,96 @@
+"""
+threads.py - Chargement d'un fil de commentaires en une requête HTTP
+Une page de commentaires + les premières réponses de chacun :
+1 requête pour la page, 1 agrégation pour les premières réponses de chaque commentaire
+($lookup borné par parent), puis likes / cartes / compteurs hydratés en un seul lot (hydration.py).
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+try:
+    from backend.pagination import fetch_page, encode_cursor
+    from backend.hydration import hydrate_comments
+except ImportError:
+    from pagination import fetch_page, encode_cursor
+    from hydration import hydrate_comments
+
+# Réponses incluses par commentaire
+DEFAULT_REPLIES_PER_COMMENT = 3
+MAX_REPLIES_PER_COMMENT = 20
+
+
+def clamp_replies(replies: Optional[int]) -> int:
+    if replies is None or replies < 0:
+        return DEFAULT_REPLIES_PER_COMMENT
+    return min(replies, MAX_REPLIES_PER_COMMENT)
+
+
+async def first_replies(db, comment_ids: List[str], per_comment: int) -> Dict[str, List[dict]]:
+    """
+    Premières réponses (ordre chronologique) de chaque commentaire, en une agrégation :
+    pour chaque parent, un $lookup trié et limité (index parent_comment_id, created_at, id).
+    Le coût dépend de la taille de la page, jamais du nombre total de réponses d'un fil,
+    et chaque document résultat reste borné (un parent et ses per_comment + 1 réponses).
+    Retourne jusqu'à per_comment + 1 réponses par parent : la dernière sert à savoir s'il en reste.
+    """
+    if not comment_ids or per_comment <= 0:
+        return {}
+
+    pipeline = [
+        {"$match": {"id": {"$in": comment_ids}}},
+        {"$lookup": {
+            "from": "comment_replies",
+            "let": {"cid": "$id"},
+            "pipeline": [
+                {"$match": {"$expr": {"$eq": ["$parent_comment_id", "$$cid"]}}},
+                {"$sort": {"created_at": 1, "id": 1}},
+                {"$limit": per_comment + 1},
+                {"$project": {"_id": 0}},
+            ],
+            "as": "replies",
+        }},
+        {"$project": {"_id": 0, "id": 1, "replies": 1}},
+    ]
+    heads = {}
+    async for row in db.comments.aggregate(pipeline):
+        if row["replies"]:
+            heads[row["id"]] = row["replies"]
+    return heads
+
+
+async def load_thread(
+    db,
+    post_id: str,
+    user_id: str,
+    limit: Optional[int] = None,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    replies: Optional[int] = None
+) -> Tuple[List[dict], Optional[str]]:
+    """
+    Page de commentaires d'un post, chacun avec `replies` (premières réponses)
+    et `replies_next_cursor` (à passer en `after` à /comments/{id}/replies).
+    Retourne (commentaires, next_cursor de la page).
+    """
+    per_comment = clamp_replies(replies)
+    comments, next_cursor = await fetch_page(
+        db.comments, {"post_id": post_id},
+        limit=limit, before=before, after=after
+    )
+    for comment in comments:
+        comment.pop("_id", None)
+
+    heads = await first_replies(db, [c["id"] for c in comments], per_comment)
+
+    all_replies = []
+    for comment in comments:
+        thread = heads.get(comment["id"], [])
+        comment["replies"] = thread[:per_comment]
+        comment["replies_next_cursor"] = (
+            encode_cursor(thread[per_comment - 1]) if len(thread) > per_comment else None
+        )
+        all_replies.extend(comment["replies"])
+
+    # Likes, cartes auteur et compteurs des commentaires et des réponses en un seul lot
+    await hydrate_comments(db, comments + all_replies, user_id)
+    return comments, next_cursor
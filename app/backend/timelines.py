@@ -0,0 +1,403 @@
+"""
+timelines.py - Feed hybride push/pull
+- Auteurs ordinaires : fan-out à l'écriture dans un document `timelines` plafonné
+  par abonné (la lecture devient un seul find_one indexé).
+- Auteurs à forte audience (followers_count >= FANOUT_FOLLOWER_THRESHOLD) : pas de
+  fan-out, leurs posts sont tirés à la lecture et fusionnés (k-way merge par tas).
+- Les pages en cache (feed_cache.py) des abonnés d'un auteur tiré ne sont pas invalidées
+  à chaque post : ses posts y apparaissent à l'expiration de la page (au plus 75 s).
+- Un auteur qui repasse sous le seuil n'est plus tiré : ses posts récents sont alors
+  recopiés dans les timelines de ses abonnés (backfill_followers).
+"""
+
+from pymongo import UpdateOne
+from typing import Dict, List, Optional, Set, Tuple
+import asyncio
+import heapq
+import os
+import time
+
+try:
+    from backend.pagination import clamp_limit, decode_cursor, encode_cursor, keyset_filter
+except ImportError:
+    from pagination import clamp_limit, decode_cursor, encode_cursor, keyset_filter
+
+try:
+    import backend.feed_cache as feed_cache
+    import backend.follow_graph as follow_graph
+except ImportError:
+    import feed_cache
+    import follow_graph
+
+# Nombre maximum d'entrées conservées par timeline (liste plafonnée via $slice)
+TIMELINE_MAX_ENTRIES = int(os.environ.get("TIMELINE_MAX_ENTRIES", 800))
+
+# Nombre de timelines mises à jour par bulk_write lors du fan-out
+FANOUT_BATCH_SIZE = 1000
+
+# Au-delà de ce nombre d'abonnés, un auteur n'est plus poussé mais tiré à la lecture
+FANOUT_FOLLOWER_THRESHOLD = int(os.environ.get("FANOUT_FOLLOWER_THRESHOLD", 10000))
+
+# Durée de validité de la liste des auteurs à forte audience (par worker)
+HIGH_FANOUT_REFRESH_SECONDS = 60
+
+
+class FeedMetrics:
+    """Compteurs en mémoire des chemins push (écriture) et pull (lecture)"""
+
+    def __init__(self):
+        self.counters: Dict[str, float] = {
+            "push_posts": 0,              # posts poussés dans les timelines
+            "push_timelines_written": 0,  # timelines ciblées par le fan-out
+            "push_skipped_high_fanout": 0,  # posts non poussés (auteur tiré)
+            "push_seconds": 0.0,
+            "timeline_reads": 0,          # lectures servies par la timeline
+            "timeline_fallbacks": 0,      # lectures renvoyées vers la requête directe
+            "pull_reads": 0,              # lectures ayant fusionné des auteurs tirés
+            "pull_authors_merged": 0,
+            "pull_seconds": 0.0,
+            "backfilled_authors": 0,      # auteurs repassés sous le seuil, recopiés chez leurs abonnés
+        }
+
+    def incr(self, name: str, value: float = 1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def snapshot(self) -> dict:
+        data = dict(self.counters)
+        data["fanout_follower_threshold"] = FANOUT_FOLLOWER_THRESHOLD
+        data["high_fanout_authors"] = len(high_fanout_authors.ids)
+        return data
+
+
+class HighFanoutAuthors:
+    """Ensemble (mis en cache par worker) des auteurs au-dessus du seuil de fan-out"""
+
+    def __init__(self):
+        self.ids: Set[str] = set()
+        self.loaded_at = 0.0
+        self.loaded = False
+        self._lock = asyncio.Lock()
+        # Recopies en cours (référence gardée jusqu'à la fin de la tâche)
+        self._backfills: Set[asyncio.Task] = set()
+
+    async def get(self, db) -> Set[str]:
+        if time.monotonic() - self.loaded_at < HIGH_FANOUT_REFRESH_SECONDS:
+            return self.ids
+        async with self._lock:
+            if time.monotonic() - self.loaded_at >= HIGH_FANOUT_REFRESH_SECONDS:
+                try:
+                    cursor = db.users.find(
+                        {"followers_count": {"$gte": FANOUT_FOLLOWER_THRESHOLD}},
+                        {"id": 1, "_id": 0}
+                    )
+                    ids = {u["id"] async for u in cursor if u.get("id")}
+                    if self.loaded:
+                        # Auteurs sortis de l'ensemble : jamais poussés, plus tirés
+                        for author_id in self.ids - ids:
+                            task = asyncio.create_task(backfill_followers(db, author_id))
+                            self._backfills.add(task)
+                            task.add_done_callback(self._backfills.discard)
+                    self.ids = ids
+                    self.loaded = True
+                except Exception as e:
+                    print(f"⚠️ Could not refresh high fan-out authors: {e}")
+                self.loaded_at = time.monotonic()
+        return self.ids
+
+
+metrics = FeedMetrics()
+high_fanout_authors = HighFanoutAuthors()
+
+
+def set_fanout_threshold(threshold: int):
+    """Ajuste le seuil à chaud (la liste des auteurs tirés est rechargée)"""
+    global FANOUT_FOLLOWER_THRESHOLD
+    FANOUT_FOLLOWER_THRESHOLD = threshold
+    high_fanout_authors.loaded_at = 0.0
+
+
+def is_high_fanout(user: dict) -> bool:
+    """Décision à partir du document auteur (followers_count maintenu)"""
+    return user.get("followers_count", 0) >= FANOUT_FOLLOWER_THRESHOLD
+
+
+def _entry(post: dict) -> dict:
+    """Entrée de timeline : uniquement les clés de tri, pas le contenu du post"""
+    return {
+        "id": post["id"],
+        "author_id": post["author_id"],
+        "created_at": post["created_at"]
+    }
+
+
+def _push_entries(entries: List[dict]) -> dict:
+    """$push trié et plafonné (les doublons sont retirés au préalable par $pull)"""
+    return {
+        "$push": {
+            "entries": {
+                "$each": entries,
+                "$sort": {"created_at": -1, "id": -1},
+                "$slice": TIMELINE_MAX_ENTRIES
+            }
+        }
+    }
+
+
+async def ensure_indexes(db):
+    """Index : une timeline par utilisateur, retrait rapide d'un post, auteurs tirés"""
+    await db.timelines.create_index("owner_id", unique=True)
+    await db.timelines.create_index("entries.id")
+    await db.users.create_index("followers_count")
+
+
+async def get_follower_ids(db, user_id: str) -> List[str]:
+    """IDs des abonnés de user_id (graphe en mémoire)"""
+    return await follow_graph.get_follower_ids(db, user_id)
+
+
+async def get_followed_ids(db, user_id: str) -> List[str]:
+    """IDs des comptes suivis par user_id (graphe en mémoire)"""
+    return await follow_graph.get_following_ids(db, user_id)
+
+
+# ==================== ÉCRITURES ====================
+
+async def fan_out_post(db, post: dict, author: Optional[dict] = None, follower_ids: Optional[List[str]] = None):
+    """Pousse un nouveau post dans la timeline de l'auteur et de ses abonnés
+
+    Un auteur à forte audience n'est poussé que dans sa propre timeline :
+    ses abonnés le tirent à la lecture. On ne saute le push que si le document
+    auteur ET la liste partagée avec les lecteurs s'accordent (sinon doublon
+    éventuel, dédupliqué à la fusion, plutôt qu'un post manquant).
+    """
+    started = time.perf_counter()
+    try:
+        if author is None:
+            author = await db.users.find_one({"id": post["author_id"]}, {"followers_count": 1, "_id": 0}) or {}
+        if is_high_fanout(author) and post["author_id"] in await high_fanout_authors.get(db):
+            follower_ids = []
+            metrics.incr("push_skipped_high_fanout")
+        elif follower_ids is None:
+            follower_ids = await get_follower_ids(db, post["author_id"])
+        owners = [post["author_id"]] + [f for f in follower_ids if f != post["author_id"]]
+        update = _push_entries([_entry(post)])
+
+        # Seules les timelines déjà matérialisées sont mises à jour : les autres
+        # seront reconstruites à la première lecture
+        for i in range(0, len(owners), FANOUT_BATCH_SIZE):
+            batch = owners[i:i + FANOUT_BATCH_SIZE]
+            await db.timelines.bulk_write(
+                [UpdateOne({"owner_id": owner_id}, update) for owner_id in batch],
+                ordered=False
+            )
+        metrics.incr("push_posts")
+        metrics.incr("push_timelines_written", len(owners))
+        await feed_cache.invalidate(owners)
+    except Exception as e:
+        print(f"⚠️ Timeline fan-out failed for post {post.get('id')}: {e}")
+    finally:
+        metrics.incr("push_seconds", time.perf_counter() - started)
+
+
+async def retract_post(db, post_id: str, author_id: Optional[str] = None):
+    """Retire un post supprimé de toutes les timelines"""
+    try:
+        await db.timelines.update_many(
+            {"entries.id": post_id},
+            {"$pull": {"entries": {"id": post_id}}}
+        )
+        if author_id:
+            await feed_cache.invalidate([author_id] + await get_follower_ids(db, author_id))
+    except Exception as e:
+        print(f"⚠️ Timeline retract failed for post {post_id}: {e}")
+
+
+async def backfill_author(db, owner_id: str, author_id: str):
+    """Après un abonnement : ajoute les posts récents de l'auteur à la timeline"""
+    try:
+        if author_id in await high_fanout_authors.get(db):
+            return  # tiré à la lecture
+        posts = await db.posts.find(
+            {"author_id": author_id},
+            {"id": 1, "author_id": 1, "created_at": 1, "_id": 0}
+        ).sort("created_at", -1).limit(TIMELINE_MAX_ENTRIES).to_list(length=TIMELINE_MAX_ENTRIES)
+        if not posts:
+            return
+        await db.timelines.bulk_write([
+            UpdateOne({"owner_id": owner_id}, {"$pull": {"entries": {"author_id": author_id}}}),
+            UpdateOne({"owner_id": owner_id}, _push_entries([_entry(p) for p in posts]))
+        ], ordered=True)
+    except Exception as e:
+        print(f"⚠️ Timeline backfill failed ({owner_id} ← {author_id}): {e}")
+    finally:
+        await feed_cache.invalidate([owner_id])
+
+
+async def invalidate_followers(db, author_id: str):
+    """Story publiée / supprimée : invalide le feed des abonnés (sauf auteur tiré, cf. fan_out_post)"""
+    try:
+        if author_id in await high_fanout_authors.get(db):
+            return
+        await feed_cache.invalidate(await get_follower_ids(db, author_id))
+    except Exception as e:
+        print(f"⚠️ Feed invalidation failed for followers of {author_id}: {e}")
+
+
+async def backfill_followers(db, author_id: str):
+    """Auteur repassé sous le seuil : ses posts récents dans les timelines de ses abonnés.
+    Chaque worker détecte la transition ; la recopie ($pull puis $push) est idempotente."""
+    try:
+        posts = await db.posts.find(
+            {"author_id": author_id},
+            {"id": 1, "author_id": 1, "created_at": 1, "_id": 0}
+        ).sort("created_at", -1).limit(TIMELINE_MAX_ENTRIES).to_list(length=TIMELINE_MAX_ENTRIES)
+        if not posts:
+            return
+        follower_ids = await get_follower_ids(db, author_id)
+        pull = {"$pull": {"entries": {"author_id": author_id}}}
+        push = _push_entries([_entry(p) for p in posts])
+        for i in range(0, len(follower_ids), FANOUT_BATCH_SIZE):
+            batch = follower_ids[i:i + FANOUT_BATCH_SIZE]
+            ops = []
+            for owner_id in batch:
+                ops += [UpdateOne({"owner_id": owner_id}, pull), UpdateOne({"owner_id": owner_id}, push)]
+            await db.timelines.bulk_write(ops, ordered=True)
+            await feed_cache.invalidate(batch)
+        metrics.incr("backfilled_authors")
+    except Exception as e:
+        print(f"⚠️ Timeline backfill failed for followers of {author_id}: {e}")
+
+
+async def prune_author(db, owner_id: str, author_id: str):
+    """Après un désabonnement : retire les posts de l'auteur de la timeline"""
+    try:
+        await db.timelines.update_one(
+            {"owner_id": owner_id},
+            {"$pull": {"entries": {"author_id": author_id}}}
+        )
+    except Exception as e:
+        print(f"⚠️ Timeline prune failed ({owner_id} ✕ {author_id}): {e}")
+    finally:
+        await feed_cache.invalidate([owner_id])
+
+
+async def rebuild_timeline(db, owner_id: str, followed_ids: Optional[List[str]] = None):
+    """(Re)construit entièrement la timeline d'un utilisateur"""
+    try:
+        if followed_ids is None:
+            followed_ids = await get_followed_ids(db, owner_id)
+        pulled = await high_fanout_authors.get(db)
+        author_ids = list((set(followed_ids) - pulled) | {owner_id})
+        posts = await db.posts.find(
+            {"author_id": {"$in": author_ids}},
+            {"id": 1, "author_id": 1, "created_at": 1, "_id": 0}
+        ).sort([("created_at", -1), ("id", -1)]).limit(TIMELINE_MAX_ENTRIES).to_list(length=TIMELINE_MAX_ENTRIES)
+        await db.timelines.update_one(
+            {"owner_id": owner_id},
+            {"$set": {"entries": [_entry(p) for p in posts]}},
+            upsert=True
+        )
+    except Exception as e:
+        print(f"⚠️ Timeline rebuild failed for {owner_id}: {e}")
+
+
+# ==================== LECTURE ====================
+
+def _sort_key(entry: dict) -> Tuple[str, str]:
+    return entry["created_at"], entry["id"]
+
+
+def _window(entries: List[dict], before: Optional[str], after: Optional[str]) -> List[dict]:
+    """Entrées strictement au-delà du curseur, dans l'ordre de parcours"""
+    if after:
+        key = decode_cursor(after)
+        return [e for e in reversed(entries) if _sort_key(e) > key]
+    if before:
+        key = decode_cursor(before)
+        return [e for e in entries if _sort_key(e) < key]
+    return entries
+
+
+async def _pull_author(db, author_id: str, limit: int, before: Optional[str], after: Optional[str]) -> List[dict]:
+    """Flux trié des posts d'un auteur tiré (même sens de parcours que la timeline)"""
+    query = {"author_id": author_id}
+    if before or after:
+        query = {"$and": [query, keyset_filter(before or after, older=not after)]}
+    direction = 1 if after else -1
+    return await db.posts.find(
+        query, {"id": 1, "author_id": 1, "created_at": 1, "_id": 0}
+    ).sort([("created_at", direction), ("id", direction)]).limit(limit).to_list(length=limit)
+
+
+def _merge(streams: List[List[dict]], newest_first: bool, limit: int) -> List[dict]:
+    """K-way merge par tas de flux déjà triés, sans doublons"""
+    merged, seen = [], set()
+    for entry in heapq.merge(*streams, key=_sort_key, reverse=newest_first):
+        if entry["id"] in seen:
+            continue
+        seen.add(entry["id"])
+        merged.append(entry)
+        if len(merged) >= limit:
+            break
+    return merged
+
+
+async def read_timeline(
+    db,
+    owner_id: str,
+    limit: Optional[int] = None,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    followed_ids: Optional[List[str]] = None
+) -> Optional[Tuple[List[dict], Optional[str]]]:
+    """
+    Lit une page du feed hybride (même sémantique que fetch_page) :
+    timeline poussée + posts des auteurs tirés, fusionnés par tas.
+    Retourne None si la timeline n'existe pas encore ou si la page demandée
+    dépasse la partie plafonnée : l'appelant bascule alors sur la lecture directe.
+    """
+    timeline = await db.timelines.find_one({"owner_id": owner_id}, {"entries": 1, "_id": 0})
+    if timeline is None:
+        metrics.incr("timeline_fallbacks")
+        return None
+
+    limit = clamp_limit(limit)
+    entries = timeline.get("entries", [])  # triées du plus récent au plus ancien
+    pushed = _window(entries, before, after)
+
+    capped = len(entries) >= TIMELINE_MAX_ENTRIES
+    if capped and not after and len(pushed) <= limit:
+        # Fin de la partie plafonnée : la suite n'existe que dans `posts`
+        metrics.incr("timeline_fallbacks")
+        return None
+
+    # Auteurs suivis tirés à la lecture
+    pulled_ids = await high_fanout_authors.get(db)
+    if pulled_ids:
+        if followed_ids is None:
+            followed_ids = await get_followed_ids(db, owner_id)
+        pulled_ids = pulled_ids.intersection(followed_ids)
+
+    streams = [pushed]
+    if pulled_ids:
+        started = time.perf_counter()
+        streams += await asyncio.gather(*[
+            _pull_author(db, author_id, limit + 1, before, after) for author_id in pulled_ids
+        ])
+        metrics.incr("pull_reads")
+        metrics.incr("pull_authors_merged", len(pulled_ids))
+        metrics.incr("pull_seconds", time.perf_counter() - started)
+
+    window = _merge(streams, newest_first=not after, limit=limit + 1)
+    metrics.incr("timeline_reads")
+
+    page = window[:limit]
+    has_more = len(window) > limit
+    next_cursor = encode_cursor(page[-1]) if has_more and page else None
+    if after:
+        page.reverse()
+
+    ids = [e["id"] for e in page]
+    posts = await db.posts.find({"id": {"$in": ids}}).to_list(length=len(ids))
+    by_id = {p["id"]: p for p in posts}
+    return [by_id[i] for i in ids if i in by_id], next_cursor
@@ -0,0 +1,212 @@
+"""
+uploads.py - Réception des uploads en flux, bornée en taille
+- Le type est déterminé sur les premiers octets (signatures), pas sur l'en-tête client
+- Le fichier est recopié par blocs vers un fichier temporaire en calculant le sha256
+- Dépassement de la limite du type → 413 immédiat ; mémoire constante quelle que soit la taille
+- Le corps de chaque requête est borné par route (BodySizeLimitMiddleware), avant que le parseur
+  multipart de Starlette ne l'ait reçu en entier
+"""
+
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+from pathlib import Path
+from starlette.concurrency import run_in_threadpool
+from typing import Iterable, Optional, Tuple
+import hashlib
+import os
+import tempfile
+
+try:
+    import backend.blob_store as blob_store
+except ImportError:
+    import blob_store
+
+# Limites par type de média (octets)
+MAX_IMAGE_UPLOAD_BYTES = int(os.environ.get("MAX_IMAGE_UPLOAD_BYTES", 10 * 1024 * 1024))
+MAX_VIDEO_UPLOAD_BYTES = int(os.environ.get("MAX_VIDEO_UPLOAD_BYTES", 100 * 1024 * 1024))
+
+UPLOAD_LIMITS = {
+    "image": MAX_IMAGE_UPLOAD_BYTES,
+    "video": MAX_VIDEO_UPLOAD_BYTES,
+}
+
+# Corps de requête maximum des routes sans média (JSON, formulaires)
+MAX_REQUEST_BODY_BYTES = int(os.environ.get("MAX_REQUEST_BODY_BYTES", 1024 * 1024))
+
+# Marge pour les champs de formulaire et l'enveloppe multipart
+FORM_MARGIN_BYTES = 64 * 1024
+
+
+def data_uri_bytes(size: int) -> int:
+    """Longueur maximum d'un média de `size` octets envoyé en data URI (base64 + en-tête)"""
+    return 4 * -(-size // 3) + 256
+
+
+# Corps maximum des routes qui reçoivent un média : (méthode, chemin) → octets
+ROUTE_BODY_LIMITS = {
+    ("PUT", "/api/auth/profile"): MAX_IMAGE_UPLOAD_BYTES + FORM_MARGIN_BYTES,
+    ("POST", "/api/stories"): data_uri_bytes(MAX_VIDEO_UPLOAD_BYTES) + FORM_MARGIN_BYTES,
+    ("POST", "/api/posts"): data_uri_bytes(MAX_VIDEO_UPLOAD_BYTES) + FORM_MARGIN_BYTES,
+}
+
+# Taille des blocs copiés
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# Octets lus pour reconnaître le type
+SNIFF_BYTES = 32
+
+# Marques principales (ISO BMFF, octets 8 à 12) des vidéos acceptées ; les images du même
+# conteneur (HEIC, AVIF) ne sont pas des types acceptés
+VIDEO_BRANDS = {
+    b"isom": "video/mp4", b"iso2": "video/mp4", b"iso4": "video/mp4", b"iso5": "video/mp4",
+    b"iso6": "video/mp4", b"mp41": "video/mp4", b"mp42": "video/mp4", b"avc1": "video/mp4",
+    b"dash": "video/mp4", b"M4V ": "video/mp4", b"3gp4": "video/mp4", b"3gp5": "video/mp4",
+    b"qt  ": "video/quicktime",
+}
+
+# Fichiers temporaires sur le même disque que le blob store (déplacement = renommage)
+UPLOAD_TMP_DIR = Path(os.environ.get("UPLOAD_TMP_DIR", blob_store.MEDIA_ROOT / "tmp"))
+
+
+def sniff_content_type(head: bytes) -> Optional[str]:
+    """Type MIME à partir des premiers octets, None si non reconnu"""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head.startswith(b"\x1a\x45\xdf\xa3"):
+        return "video/webm"
+    if head[4:8] == b"ftyp":
+        return VIDEO_BRANDS.get(head[8:12])
+    return None
+
+
+def media_kind(content_type: Optional[str]) -> Optional[str]:
+    """'image/png' → 'image'"""
+    return content_type.split("/", 1)[0] if content_type else None
+
+
+def check_size(kind: str, size: int):
+    limit = UPLOAD_LIMITS[kind]
+    if size > limit:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Fichier trop volumineux (max {limit / (1024 * 1024):g} Mo pour un(e) {kind})"
+        )
+
+
+def _open_temp():
+    UPLOAD_TMP_DIR.mkdir(parents=True, exist_ok=True)
+    return tempfile.NamedTemporaryFile(dir=UPLOAD_TMP_DIR, prefix="upload-", delete=False)
+
+
+async def save_upload(
+    upload: UploadFile,
+    allowed_kinds: Iterable[str] = ("image", "video")
+) -> Tuple[str, str]:
+    """
+    Copie un upload vers le blob store, bloc par bloc.
+    Retourne (type de média 'image'/'video', référence du blob).
+    """
+    head = await upload.read(SNIFF_BYTES)
+    content_type = sniff_content_type(head)
+    kind = media_kind(content_type)
+    if kind not in allowed_kinds:
+        raise HTTPException(status_code=400, detail="Type de fichier non supporté")
+
+    # Taille connue (fichier déjà reçu par le parseur multipart) : refus sans recopie
+    if upload.size is not None:
+        check_size(kind, upload.size)
+
+    hasher = hashlib.sha256(head)
+    size = len(head)
+    tmp = await run_in_threadpool(_open_temp)
+    try:
+        await run_in_threadpool(tmp.write, head)
+        while True:
+            chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            check_size(kind, size)
+            hasher.update(chunk)
+            await run_in_threadpool(tmp.write, chunk)
+        await run_in_threadpool(tmp.close)
+
+        digest = hasher.hexdigest()
+        await run_in_threadpool(blob_store.store.put_file, digest, Path(tmp.name))
+    except BaseException:
+        tmp.close()
+        try:
+            os.unlink(tmp.name)
+        except FileNotFoundError:
+            pass
+        raise
+
+    return kind, blob_store.media_url(blob_store.make_key(digest, content_type))
+
+
+def check_data_uri(value: Optional[str], allowed_kinds: Iterable[str] = ("image", "video")):
+    """Valide un média envoyé en data URI (type reconnu et taille décodée dans la limite)"""
+    if not blob_store.is_data_uri(value):
+        return
+    try:
+        _, data = blob_store.parse_data_uri(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid media data")
+    kind = media_kind(sniff_content_type(data[:SNIFF_BYTES]))
+    if kind not in allowed_kinds:
+        raise HTTPException(status_code=400, detail="Type de fichier non supporté")
+    check_size(kind, len(data))
+
+
+def body_limit(method: str, path: str) -> int:
+    """Corps maximum accepté pour une route"""
+    return ROUTE_BODY_LIMITS.get((method, path.rstrip("/")), MAX_REQUEST_BODY_BYTES)
+
+
+class BodySizeLimitMiddleware:
+    """
+    Coupe les requêtes dont le corps dépasse la limite de leur route (body_limit) :
+    d'après Content-Length avant toute lecture, puis au fil de la réception (chunked,
+    Content-Length inexact), avant que le corps ne soit mis en tampon.
+    """
+
+    def __init__(self, app, max_bytes: Optional[int] = None):
+        self.app = app
+        # Limite unique imposée à toutes les routes (tests) ; sinon par route
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        max_bytes = self.max_bytes or body_limit(scope["method"], scope["path"])
+        for name, value in scope.get("headers", ()):
+            if name == b"content-length":
+                try:
+                    too_large = int(value) > max_bytes
+                except ValueError:
+                    too_large = False
+                if too_large:
+                    response = JSONResponse({"detail": "Request body too large"}, status_code=413)
+                    await response(scope, receive, send)
+                    return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes:
+                    raise HTTPException(status_code=413, detail="Request body too large")
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -0,0 +1,129 @@
+"""
+user_cards.py - Cartes utilisateur (id, username, avatar) pour l'affichage des auteurs
+Les documents (posts, commentaires, stories, notifications, messages) ne stockent
+que des ids ; les réponses sont complétées depuis ce modèle de lecture,
+en une seule requête $in par réponse pour les cartes absentes du cache.
+"""
+
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+import os
+import time
+
+try:
+    import backend.blob_store as blob_store
+    import backend.derivatives as derivatives
+except ImportError:
+    import blob_store
+    import derivatives
+
+# Durée de validité d'une carte en cache (les autres workers convergent dans ce délai)
+USER_CARD_TTL_SECONDS = float(os.environ.get("USER_CARD_TTL_SECONDS", 60))
+
+# Nombre maximum de cartes conservées par worker (LRU)
+USER_CARD_MAX_ENTRIES = int(os.environ.get("USER_CARD_MAX_ENTRIES", 50000))
+
+_USER_FIELDS = {"id": 1, "username": 1, "profile_pic": 1, "profile_pic_sizes": 1, "_id": 0}
+
+# Rôle → (champ id, champ username, champ avatar) dans les documents
+ROLES: Dict[str, Tuple[str, str, Optional[str]]] = {
+    "author": ("author_id", "author_username", "author_profile_pic"),
+    "from": ("from_user_id", "from_username", "from_profile_pic"),
+    "sender": ("sender_id", "sender_username", "sender_profile_pic"),
+    "recipient": ("recipient_id", "recipient_username", None),
+    # Stories créées par routers/stories.py
+    "user": ("user_id", "username", "avatar"),
+}
+
+# Champs dénormalisés des anciens documents (plus écrits ; retirés par migrate_user_cards.py)
+DENORMALIZED_FIELDS = {
+    field for _, username_field, avatar_field in ROLES.values()
+    for field in (username_field, avatar_field) if field
+}
+
+
+def make_card(user: dict) -> dict:
+    return {
+        "id": user["id"],
+        "username": user.get("username", ""),
+        "profile_pic": derivatives.list_avatar(user),
+    }
+
+
+def public_card(card: dict) -> dict:
+    """Copie d'une carte renvoyée telle quelle au client (avatar en URL publique)"""
+    return {**card, "profile_pic": blob_store.resolve_url(card["profile_pic"])}
+
+
+class UserCardCache:
+    """LRU + TTL des cartes, rempli par lot"""
+
+    def __init__(self, max_entries: int = USER_CARD_MAX_ENTRIES):
+        self.max_entries = max_entries
+        # user_id → (loaded_at, carte)
+        self.entries: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "queries": 0}
+
+    def _store(self, card: dict):
+        self.entries[card["id"]] = (time.monotonic(), card)
+        self.entries.move_to_end(card["id"])
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def get_many(self, db, user_ids: Iterable[str]) -> Dict[str, dict]:
+        """Cartes des utilisateurs demandés (les comptes inexistants sont absents)"""
+        cards = {}
+        missing = []
+        now = time.monotonic()
+        for user_id in set(u for u in user_ids if u):
+            entry = self.entries.get(user_id)
+            if entry is not None and now - entry[0] < USER_CARD_TTL_SECONDS:
+                self.entries.move_to_end(user_id)
+                cards[user_id] = entry[1]
+            else:
+                missing.append(user_id)
+
+        self.stats["hits"] += len(cards)
+        if missing:
+            self.stats["misses"] += len(missing)
+            self.stats["queries"] += 1
+            async for user in db.users.find({"id": {"$in": missing}}, _USER_FIELDS):
+                card = make_card(user)
+                self._store(card)
+                cards[card["id"]] = card
+        return cards
+
+    def update(self, user: dict):
+        """À appeler après une modification du profil (username, avatar)"""
+        self._store(make_card(user))
+
+    def invalidate(self, user_id: str):
+        self.entries.pop(user_id, None)
+
+    def snapshot(self) -> dict:
+        data = dict(self.stats)
+        data["entries"] = len(self.entries)
+        return data
+
+
+cache = UserCardCache()
+
+
+async def attach_cards(db, docs: List[dict], *roles: str) -> List[dict]:
+    """Complète username / avatar de chaque rôle (ex. "author") depuis les cartes"""
+    if not docs:
+        return docs
+    fields = [ROLES[role] for role in roles]
+    cards = await cache.get_many(db, (doc.get(id_field) for doc in docs for id_field, _, _ in fields))
+
+    for doc in docs:
+        for id_field, username_field, avatar_field in fields:
+            card = cards.get(doc.get(id_field))
+            if card is not None:
+                doc[username_field] = card["username"]
+                if avatar_field:
+                    doc[avatar_field] = card["profile_pic"]
+            else:
+                # Compte supprimé : valeurs éventuellement dénormalisées des anciens documents
+                doc.setdefault(username_field, "")
+    return docs
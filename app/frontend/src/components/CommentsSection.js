@@ -23,7 +23,8 @@ export default function CommentsSection({ postId, currentUser, onCommentAdded, o
 
   const fetchComments = async () => {
     try {
-      const response = await axios.get(`${API}/posts/${postId}/comments`);
+      // Commentaires + premières réponses de chacun en une seule requête
+      const response = await axios.get(`${API}/posts/${postId}/thread`);
       // Initialise les états des likes pour chaque commentaire
       const commentsWithLikeState = response.data.map(comment => ({
         ...comment,
@@ -31,7 +32,8 @@ export default function CommentsSection({ postId, currentUser, onCommentAdded, o
         likesCount: comment.likes_count || 0,
         repliesCount: comment.replies_count || 0,
         showReplies: false,
-        replies: [],
+        replies: comment.replies || [],
+        repliesCursor: comment.replies_next_cursor || null,
       }));
       setComments(commentsWithLikeState);
     } catch (error) {
@@ -60,6 +62,7 @@ export default function CommentsSection({ postId, currentUser, onCommentAdded, o
         repliesCount: 0,
         showReplies: false,
         replies: [],
+        repliesCursor: null,
       };
       setComments([newCommentData, ...comments]);
       setNewComment("");
@@ -125,8 +128,9 @@ export default function CommentsSection({ postId, currentUser, onCommentAdded, o
         c.id === commentId 
           ? { 
               ...c, 
-              replies: [response.data, ...c.replies],
+              replies: [...c.replies, response.data],
               repliesCount: c.repliesCount + 1,
+              showReplies: true,
             }
           : c
       ));
@@ -140,28 +144,33 @@ export default function CommentsSection({ postId, currentUser, onCommentAdded, o
     }
   };
 
-  const toggleReplies = async (commentId) => {
+  const toggleReplies = (commentId) => {
+    setComments(comments.map(c => 
+      c.id === commentId 
+        ? { ...c, showReplies: !c.showReplies }
+        : c
+    ));
+  };
+
+  const loadMoreReplies = async (commentId) => {
     const comment = comments.find(c => c.id === commentId);
-    
-    if (!comment.showReplies && comment.replies.length === 0) {
-      // Charger les réponses
-      try {
-        const response = await axios.get(`${API}/comments/${commentId}/replies`);
-        setComments(comments.map(c => 
-          c.id === commentId 
-            ? { ...c, replies: response.data, showReplies: true }
-            : c
-        ));
-      } catch (error) {
-        console.error("Erreur lors du chargement des réponses:", error);
-      }
-    } else {
-      // Toggle l'affichage
-      setComments(comments.map(c => 
-        c.id === commentId 
-          ? { ...c, showReplies: !c.showReplies }
-          : c
-      ));
+    try {
+      // Suite du fil à partir du curseur renvoyé avec le commentaire
+      const response = await axios.get(`${API}/comments/${commentId}/replies`, {
+        params: comment.repliesCursor ? { after: comment.repliesCursor } : {},
+      });
+      const nextCursor = response.headers["x-next-cursor"] || null;
+      setComments(comments.map(c => {
+        if (c.id !== commentId) return c;
+        const known = new Set(c.replies.map(r => r.id));
+        return {
+          ...c,
+          replies: [...c.replies, ...response.data.filter(r => !known.has(r.id))],
+          repliesCursor: nextCursor,
+        };
+      }));
+    } catch (error) {
+      console.error("Erreur lors du chargement des réponses:", error);
     }
   };
 
@@ -351,6 +360,14 @@ export default function CommentsSection({ postId, currentUser, onCommentAdded, o
                       </div>
                     </div>
                   ))}
+                  {comment.repliesCursor && (
+                    <button
+                      onClick={() => loadMoreReplies(comment.id)}
+                      className="text-xs text-slate-400 hover:text-cyan-500 transition-colors"
+                    >
+                      Voir plus de réponses
+                    </button>
+                  )}
                 </div>
               )}
             </div>
@@ -57,7 +57,8 @@ export default function NotificationDropdown() {
 
       // Construire l'URL WebSocket
       const wsUrl = API.replace('http', 'ws').replace('https', 'wss');
-      const socket = new WebSocket(`${wsUrl}/notifications/ws/${userId}`);
+      // Le serveur vérifie que le token correspond à userId (fermeture 1008 sinon)
+      const socket = new WebSocket(`${wsUrl}/notifications/ws/${userId}?token=${encodeURIComponent(token)}`);
 
       socket.onopen = () => {
         console.log('WebSocket connecté');
@@ -65,6 +66,11 @@ export default function NotificationDropdown() {
 
       socket.onmessage = (event) => {
         const notification = JSON.parse(event.data);
+        // Heartbeat du serveur : répondre pour garder la connexion ouverte
+        if (notification.type === 'ping') {
+          socket.send('pong');
+          return;
+        }
         setNotifications(prev => [notification, ...prev]);
         setUnreadCount(prev => prev + 1);
         
@@ -81,8 +87,10 @@ export default function NotificationDropdown() {
         console.error('WebSocket error:', error);
       };
 
-      socket.onclose = () => {
+      socket.onclose = (event) => {
         console.log('WebSocket déconnecté');
+        // Token refusé : inutile de réessayer avec le même
+        if (event.code === 1008) return;
         // Reconnecter après 5 secondes
         setTimeout(connectWebSocket, 5000);
       };
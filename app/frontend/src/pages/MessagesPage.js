@@ -79,7 +79,8 @@ export default function MessagesPage({ user }) {
   const searchUsers = async () => {
     try {
       setSearchLoading(true);
-      const response = await axios.get(`${API}/users/search?q=${searchQuery}`);
+      // Suggestions à la frappe (index des usernames côté serveur)
+      const response = await axios.get(`${API}/users/autocomplete`, { params: { prefix: searchQuery } });
       // Filtrer pour ne pas montrer soi-même
       const filtered = response.data.filter(u => u.id !== user.id);
       setSearchResults(filtered);
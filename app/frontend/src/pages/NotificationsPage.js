@@ -5,7 +5,7 @@ import Layout from "@/components/Layout";
 import { Button } from "@/components/ui/button";
 import { Avatar, AvatarFallback, AvatarImage } from "@/components/ui/avatar";
 import { useNavigate } from "react-router-dom";
-import { Heart, MessageCircle, UserPlus, Share2 } from "lucide-react";
+import { Heart, MessageCircle, UserPlus, Share2, AtSign } from "lucide-react";
 import { toast } from "sonner";
 
 export default function NotificationsPage({ user }) {
@@ -67,6 +67,8 @@ export default function NotificationsPage({ user }) {
         return <UserPlus className="w-5 h-5 text-green-500" />;
       case 'share':
         return <Share2 className="w-5 h-5 text-purple-500" />;
+      case 'mention':
+        return <AtSign className="w-5 h-5 text-cyan-500" />;
       default:
         return null;
     }
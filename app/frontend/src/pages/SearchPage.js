@@ -25,11 +25,11 @@ export default function SearchPage({ user }) {
     setLoading(true);
     try {
       if (searchType === "users") {
-        const response = await axios.get(`${API}/users/search?q=${searchQuery}`);
+        const response = await axios.get(`${API}/users/search`, { params: { q: searchQuery } });
         setUsers(response.data);
         setPosts([]);
       } else {
-        const response = await axios.get(`${API}/search/posts?q=${searchQuery}`);
+        const response = await axios.get(`${API}/search/posts`, { params: { q: searchQuery } });
         setPosts(response.data);
         setUsers([]);
       }